@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Benchmark - 評価処理の速度計測
+合成写真（synthetic.py）を使って、PhotoEvaluator の各評価メソッド・顔検出・1枚の評価・
+run() 全体の速さを「枚/秒」「MB/秒」で計測し、JSONに保存します。
+保存したJSONを --compare に渡すと、前回（別のコミット）の計測との比を表示します。
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import cv2
+
+from photo_selector import AnalysisContext, PhotoSelector
+from synthetic import SyntheticCorpus, parse_sizes
+
+
+# 計測する段階（この順に計測する）
+STAGES = [
+    'load_image',
+    'evaluate_sharpness',
+    'evaluate_exposure',
+    'evaluate_contrast',
+    'detect_faces',
+    'evaluate_eyes_open',
+    'evaluate_smile',
+    'evaluate_face_composition',
+    'evaluate_face_size',
+    'evaluate_photo',
+    'run',
+]
+
+
+def git_commit() -> Optional[str]:
+    """計測したコードのコミット（gitで管理されていない場合は None）"""
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+class Benchmark:
+    """合成写真で各段階の処理時間を計測するクラス"""
+
+    def __init__(self, files: List[Path], repeat: int = 3, analysis_size: int = 0, workers: int = 1):
+        self.files = files
+        self.repeat = max(1, repeat)
+        self.analysis_size = analysis_size
+        self.workers = workers
+        self.total_bytes = sum(os.path.getsize(path) for path in files)
+        self.selector = PhotoSelector(
+            input_dir=str(files[0].parent) if files else '.',
+            output_dir=tempfile.gettempdir(),
+            analysis_size=analysis_size,
+        )
+        self.evaluator = self.selector.evaluator
+        # 評価メソッドの計測に使うデコード済みのグレースケール画像と検出済みの顔（計測前に1回だけ用意）
+        self._prepared = None
+
+    def prepare(self):
+        """デコード済みの画像と顔の位置を用意（評価メソッドの計測にデコード時間を含めない）"""
+        if self._prepared is None:
+            self._prepared = []
+            for path in self.files:
+                ctx = self.selector.load_image(path)
+                if ctx is None:
+                    continue
+                faces = self.evaluator.detect_faces(ctx)
+                self._prepared.append((ctx.gray, ctx.scale, faces))
+        return self._prepared
+
+    def contexts(self):
+        """評価メソッドごとに新しいコンテキストを作る（ヒストグラム等の計算結果を使い回さない）"""
+        for gray, scale, faces in self.prepare():
+            yield AnalysisContext(gray, scale=scale), faces
+
+    def time_stage(self, name: str) -> List[float]:
+        """1つの段階を repeat 回計測（1回 = 全写真を1枚ずつ処理する時間、秒）"""
+        if name == 'run':
+            return [self.time_run() for _ in range(self.repeat)]
+
+        body = self.stage_body(name)
+        if name != 'load_image' and name != 'evaluate_photo':
+            self.prepare()
+        seconds = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            body()
+            seconds.append(time.perf_counter() - start)
+        return seconds
+
+    def stage_body(self, name: str) -> Callable[[], None]:
+        """段階ごとの計測対象の処理"""
+        evaluator = self.evaluator
+        if name == 'load_image':
+            return lambda: [self.selector.load_image(path) for path in self.files]
+        if name == 'evaluate_photo':
+            return lambda: [self.selector.evaluate_photo(path) for path in self.files]
+        if name == 'detect_faces':
+            return lambda: [evaluator.detect_faces(ctx) for ctx, _ in self.contexts()]
+        method = getattr(evaluator, name)
+        if name in ('evaluate_sharpness', 'evaluate_exposure', 'evaluate_contrast'):
+            return lambda: [method(ctx) for ctx, _ in self.contexts()]
+        return lambda: [method(ctx, faces) for ctx, faces in self.contexts()]
+
+    def time_run(self) -> float:
+        """新しい出力フォルダで run() 全体（走査・評価・コピー・results.csv の作成）を1回計測"""
+        with tempfile.TemporaryDirectory(prefix='photo-selector-bench-') as output_dir:
+            selector = PhotoSelector(
+                input_dir=str(self.files[0].parent),
+                output_dir=output_dir,
+                batch_size=len(self.files),
+                workers=self.workers,
+                analysis_size=self.analysis_size,
+            )
+            # 進捗表示は計測の邪魔になるため捨てる
+            with open(os.devnull, 'w') as devnull, \
+                    contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                start = time.perf_counter()
+                selector.run()
+                return time.perf_counter() - start
+
+    def measure(self, stages: List[str]) -> Dict[str, dict]:
+        """各段階を計測し、最速の回から 枚/秒・MB/秒 を求める"""
+        results = {}
+        megabytes = self.total_bytes / (1024 * 1024)
+        for name in stages:
+            print(f"  {name} ...", end='', flush=True, file=sys.stderr)
+            seconds = self.time_stage(name)
+            best = min(seconds)
+            results[name] = {
+                'seconds': seconds,
+                'best_seconds': best,
+                'median_seconds': statistics.median(seconds),
+                'photos_per_sec': len(self.files) / best if best else None,
+                'mb_per_sec': megabytes / best if best else None,
+            }
+            print(f" {best:.3f}秒", file=sys.stderr)
+        return results
+
+
+def print_results(results: Dict[str, dict], previous: Optional[dict] = None):
+    """計測結果の表（previous があれば前回に対する速さの比も表示）"""
+    header = f"{'段階':28s} {'枚/秒':>10s} {'MB/秒':>10s}"
+    if previous:
+        header += f" {'前回比':>8s}"
+    print(header)
+    for name, result in results.items():
+        line = f"{name:30s} {result['photos_per_sec']:10.2f} {result['mb_per_sec']:10.2f}"
+        before = (previous or {}).get(name)
+        if before and before.get('best_seconds'):
+            # 1より大きいほど速くなった
+            line += f" {before['best_seconds'] / result['best_seconds']:7.2f}x"
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description='合成写真で評価処理の速さを計測し、JSONに保存します。'
+    )
+    parser.add_argument(
+        '--corpus',
+        default=os.path.join(tempfile.gettempdir(), 'photo-selector-bench-corpus'),
+        help='合成写真を置くフォルダ（同じ条件の写真があればそのまま使う）'
+    )
+    parser.add_argument(
+        '--sizes',
+        default='1024x768,2048x1536,4032x3024',
+        help='合成写真の解像度（カンマ区切り、デフォルト: 1024x768,2048x1536,4032x3024）'
+    )
+    parser.add_argument(
+        '--count',
+        type=int,
+        default=12,
+        help='解像度ごとの合成写真の枚数（デフォルト: 12）'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='合成写真の乱数の種（デフォルト: 0）'
+    )
+    parser.add_argument(
+        '--repeat', '-r',
+        type=int,
+        default=3,
+        help='各段階を計測する回数（最速の回で比べる、デフォルト: 3）'
+    )
+    parser.add_argument(
+        '--stages',
+        default=','.join(STAGES),
+        help='計測する段階（カンマ区切り、デフォルト: すべて）'
+    )
+    parser.add_argument(
+        '--analysis-size',
+        type=int,
+        default=0,
+        help='解析解像度（photo_selector.py の --analysis-size と同じ）'
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        default=1,
+        help='run() の計測で並列に評価するプロセス数（デフォルト: 1）'
+    )
+    parser.add_argument(
+        '--output', '-o',
+        default='benchmark.json',
+        help='計測結果を保存するJSONファイル（デフォルト: benchmark.json）'
+    )
+    parser.add_argument(
+        '--compare',
+        metavar='JSON',
+        help='前回の計測結果のJSON。同じ段階の速さの比を表示する'
+    )
+    args = parser.parse_args(argv)
+
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        print(f"エラー: 不明な段階です: {', '.join(unknown)}（{', '.join(STAGES)} から選んでください）")
+        sys.exit(1)
+
+    corpus = SyntheticCorpus(Path(args.corpus), sizes=parse_sizes(args.sizes), count=args.count, seed=args.seed)
+    print(f"合成写真を用意しています: {corpus.root}", file=sys.stderr)
+    files = corpus.ensure()
+
+    benchmark = Benchmark(files, repeat=args.repeat, analysis_size=args.analysis_size, workers=args.workers)
+    print(f"計測中（{len(files)}枚、{benchmark.total_bytes / (1024 * 1024):.1f}MB、{benchmark.repeat}回）", file=sys.stderr)
+    results = benchmark.measure(stages)
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'corpus': dict(corpus.settings, files=len(files), bytes=benchmark.total_bytes),
+        'settings': {
+            'repeat': benchmark.repeat,
+            'analysis_size': args.analysis_size,
+            'workers': args.workers,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('results')
+    print_results(results, previous)
+    print(f"\n計測結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Dedupe - 連写・ほぼ同じ写真のグループ化
+知覚ハッシュ（dHash）で似ている写真をまとめ、グループ内で最もスコアの高い1枚だけを
+上位の分類に残します。
+"""
+
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+# 代表以外の写真を残す最も上の分類（これより上の分類には代表だけを残す）
+DEMOTE_TO = '4_普通'
+# windowモードでウィンドウに保持する最大枚数（撮影日時の順に並べ替えるときの先読みの枚数にも使う）
+MAX_WINDOW = 256
+
+
+def dhash(gray: np.ndarray) -> int:
+    """
+    差分ハッシュ（dHash）を計算
+    9x8に縮小し、横に隣り合う画素の明暗から64ビットの値を作る
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """2つのハッシュ値の異なるビット数"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """ハミング距離で近いハッシュを高速に探すための木（BK-tree）"""
+
+    def __init__(self):
+        self.root = None  # [ハッシュ値, 要素, {距離: 子ノード}]
+
+    def add(self, value: int, item):
+        """ハッシュ値と要素を追加"""
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list:
+        """ハミング距離が radius 以内の要素をすべて取得"""
+        if self.root is None:
+            return []
+
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= radius:
+                found.append(node[1])
+            # 三角不等式により、この範囲の子だけを調べればよい
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class DuplicateGrouper:
+    """
+    評価済みの写真をほぼ同じ写真ごとにグループ化するクラス
+    mode='window': 撮影時刻が近い写真だけを比べ、グループが確定したものから順に返す（連写向け。
+                   撮影時刻の順に追加すること）
+    mode='global': すべての写真をBK-treeで比べ、最後にまとめて返す（途中では何も返さない）
+    """
+
+    def __init__(self, categories: List[str], mode: str = 'window', max_distance: int = 6,
+                 window_seconds: float = 10.0, demote_to: str = DEMOTE_TO, max_window: int = MAX_WINDOW,
+                 first_group_id: int = 1):
+        if mode not in ('window', 'global'):
+            raise ValueError(f'不明なグループ化モードです: {mode}')
+        self.categories = categories
+        self.mode = mode
+        self.max_distance = max_distance
+        self.window_seconds = window_seconds
+        # ウィンドウに保持する最大枚数（撮影日時が前後していても無制限に溜めない）
+        self.max_window = max_window
+        # 代表以外の写真はこの分類より上には残さない
+        self.demote_index = categories.index(demote_to)
+
+        self.tree = BKTree()
+        self.window = deque()  # (撮影日時, ハッシュ値, 番号)
+        self.entries: Dict[int, dict] = {}
+        self.parent: Dict[int, int] = {}
+        self.open_counts: Dict[int, int] = {}  # グループごとの、まだウィンドウ内にある写真の数
+        self.next_index = 0
+        # グループ番号（前回までの実行と重ならないよう、続きの番号から振る）
+        self.next_group_id = first_group_id
+
+    def _find(self, index: int) -> int:
+        """グループの代表番号を取得（Union-Find）"""
+        root = index
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[index] != root:
+            self.parent[index], index = root, self.parent[index]
+        return root
+
+    def _union(self, a: int, b: int):
+        """2つのグループをまとめる"""
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a == root_b:
+            return
+        self.parent[root_b] = root_a
+        self.open_counts[root_a] = self.open_counts.get(root_a, 0) + self.open_counts.pop(root_b, 0)
+
+    @staticmethod
+    def _timestamp(result: dict) -> float:
+        photo_datetime: Optional[datetime] = result.get('photo_datetime')
+        return photo_datetime.timestamp() if photo_datetime else 0.0
+
+    def add(self, result: dict) -> List[dict]:
+        """
+        評価結果を追加
+        Returns: グループが確定した評価結果のリスト（globalモードでは常に空）
+        """
+        features = result.get('features') or {}
+        value = features.get('dhash')
+        if value is None:
+            # ハッシュがない（読み込めなかった）写真はグループ化しない
+            return [result]
+
+        index = self.next_index
+        self.next_index += 1
+        self.entries[index] = result
+        self.parent[index] = index
+        self.open_counts[index] = 1
+
+        if self.mode == 'global':
+            for other in self.tree.search(value, self.max_distance):
+                self._union(other, index)
+            self.tree.add(value, index)
+            return []
+
+        timestamp = self._timestamp(result)
+        finished = self._evict(timestamp)
+        for other_time, other_value, other in self.window:
+            if abs(timestamp - other_time) <= self.window_seconds and \
+                    hamming_distance(value, other_value) <= self.max_distance:
+                self._union(other, index)
+        self.window.append((timestamp, value, index))
+        return finished
+
+    def _evict(self, timestamp: Optional[float] = None) -> List[dict]:
+        """時間枠から外れた写真をウィンドウから外し、確定したグループを返す"""
+        finished = []
+        while self.window and (timestamp is None
+                               or timestamp - self.window[0][0] > self.window_seconds
+                               or len(self.window) >= self.max_window):
+            _, _, index = self.window.popleft()
+            root = self._find(index)
+            self.open_counts[root] -= 1
+            if self.open_counts[root] == 0:
+                finished.extend(self._finalize(root))
+        return finished
+
+    def finish(self) -> List[dict]:
+        """残っているすべてのグループを確定して返す"""
+        if self.mode == 'window':
+            return self._evict()
+
+        groups: Dict[int, List[int]] = {}
+        for index in list(self.entries):
+            groups.setdefault(self._find(index), []).append(index)
+        finished = []
+        for members in groups.values():
+            finished.extend(self._finalize_members(members))
+        return finished
+
+    def _finalize(self, root: int) -> List[dict]:
+        members = [index for index in self.entries if self._find(index) == root]
+        return self._finalize_members(members)
+
+    def _finalize_members(self, members: List[int]) -> List[dict]:
+        """グループ内で最もスコアの高い写真を代表にし、それ以外を上位の分類から外す"""
+        results = [self.entries.pop(index) for index in sorted(members)]
+        for index in members:
+            self.parent.pop(index, None)
+            self.open_counts.pop(index, None)
+
+        if len(results) == 1:
+            return results
+
+        group_id = self.next_group_id
+        self.next_group_id += 1
+        best = max(results, key=lambda r: r['total_score'])
+        for result in results:
+            result['dup_group'] = group_id
+            result['dup_best'] = result is best
+            if result is not best and self.categories.index(result['category']) < self.demote_index:
+                result['category'] = self.categories[self.demote_index]
+        return results
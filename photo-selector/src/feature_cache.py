@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Feature Cache - 特徴量キャッシュ
+写真ごとの計測値（シャープさ・露出・コントラスト・顔の位置・目/笑顔の検出数など）を
+SQLiteに保存し、変更のないファイルや計算方法の変わっていない計測値の再計算を省きます。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class FeatureCache:
+    """写真の計測値と処理状況を保存するキャッシュ（SQLite）"""
+
+    # files テーブルに後から追加した列（古いキャッシュには ALTER TABLE で追加する）
+    ADDED_COLUMNS = {
+        'identical_to': 'TEXT',   # 内容がまったく同じ代表ファイル（--identical）
+        'dup_group': 'INTEGER',   # ほぼ同じ写真のグループ番号（--dedupe）
+        'dup_best': 'INTEGER',    # グループの代表か（1/0）
+    }
+
+    def __init__(self, db_path: Path, use_hash: bool = False, commit_interval: int = 200):
+        self.db_path = Path(db_path)
+        self.use_hash = use_hash
+        # この件数ごとにまとめてコミット（1件ずつ書き込まない。0 = flush() を呼ぶまでコミットしない）
+        self.commit_interval = commit_interval
+        self._pending = 0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                processed INTEGER NOT NULL DEFAULT 0,
+                category TEXT,
+                total_score REAL,
+                output_path TEXT,
+                updated_at TEXT,
+                identical_to TEXT,
+                dup_group INTEGER,
+                dup_best INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS metrics (
+                path TEXT NOT NULL,
+                name TEXT NOT NULL,
+                version TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (path, name)
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(files)')}
+        for name, definition in self.ADDED_COLUMNS.items():
+            if name not in columns:
+                self.conn.execute(f'ALTER TABLE files ADD COLUMN {name} {definition}')
+        self.conn.commit()
+
+    @staticmethod
+    def file_signature(file_path: Path) -> Optional[Tuple[int, int]]:
+        """ファイルのサイズと更新日時（ナノ秒）を取得"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def content_hash(file_path: Path) -> str:
+        """ファイル内容のハッシュ値（BLAKE2b）を計算"""
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _row_matches(self, file_path: str, row: tuple, size: int, mtime_ns: int) -> bool:
+        """保存済みの行が現在のファイルと同じ内容かを判定"""
+        stored_size, stored_mtime, stored_hash = row
+        if stored_size != size:
+            return False
+        if stored_mtime == mtime_ns:
+            return True
+        # 更新日時だけが変わった場合は、ハッシュ値が一致すれば同じファイルとみなす
+        if self.use_hash and stored_hash:
+            try:
+                return self.content_hash(Path(file_path)) == stored_hash
+            except OSError:
+                return False
+        return False
+
+    def lookup(self, file_path: str) -> Optional[Dict[str, Tuple[str, object]]]:
+        """
+        ファイルの保存済み計測値を取得
+        Returns: {計測名: (バージョン, 値)}。未保存またはファイルが変更されている場合は None
+        """
+        signature = self.file_signature(Path(file_path))
+        if signature is None:
+            return None
+
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, content_hash FROM files WHERE path = ?', (file_path,)
+        ).fetchone()
+        if row is None or not self._row_matches(file_path, row, *signature):
+            return None
+
+        metrics = {}
+        for name, version, value in self.conn.execute(
+            'SELECT name, version, value FROM metrics WHERE path = ?', (file_path,)
+        ):
+            metrics[name] = (version, json.loads(value))
+        return metrics
+
+    def processed_files(self) -> set:
+        """処理済み（分類・コピー済み）で、その後変更されていないファイルのセットを取得"""
+        processed = set()
+        rows = self.conn.execute(
+            'SELECT path, size, mtime_ns, content_hash FROM files WHERE processed = 1'
+        ).fetchall()
+        for path, size, mtime_ns, content_hash in rows:
+            signature = self.file_signature(Path(path))
+            if signature is None:
+                continue
+            if self._row_matches(path, (size, mtime_ns, content_hash), *signature):
+                processed.add(path)
+        return processed
+
+    def processed_entry(self, file_path: str) -> Optional[Tuple[Optional[str], Optional[float], Optional[str]]]:
+        """
+        処理済みファイルの記録を取得（ファイルの変更確認はしない）
+        Returns: (分類, 総合スコア, 出力先パス)（未処理の場合は None）
+        """
+        return self.conn.execute(
+            'SELECT category, total_score, output_path FROM files WHERE path = ? AND processed = 1',
+            (file_path,)
+        ).fetchone()
+
+    def record(self, file_path: str, metrics: Optional[Dict[str, Tuple[str, object]]] = None,
+               processed: bool = False, category: Optional[str] = None,
+               total_score: Optional[float] = None, output_path: Optional[str] = None,
+               signature: Optional[Tuple[int, int]] = None, identical_to: Optional[str] = None,
+               dup_group: Optional[int] = None, dup_best: Optional[bool] = None):
+        """
+        ファイルの計測値と処理状況を保存（commit_interval件ごとにまとめてコミット）
+        signature: 事前に取得した (サイズ, 更新日時)（移動モードなど、元ファイルがなくなる場合に指定）
+        identical_to: 内容がまったく同じ代表ファイル（評価を省いて代表の結果を使った場合）
+        dup_group, dup_best: ほぼ同じ写真のグループ番号と、グループの代表か（グループ化した場合）
+        """
+        if signature is None:
+            signature = self.file_signature(Path(file_path))
+            if signature is None:
+                return
+        size, mtime_ns = signature
+        content_hash = None
+        if self.use_hash and os.path.exists(file_path):
+            content_hash = self.content_hash(Path(file_path))
+
+        self.conn.execute(
+            '''INSERT OR REPLACE INTO files
+               (path, size, mtime_ns, content_hash, processed, category, total_score, output_path, updated_at,
+                identical_to, dup_group, dup_best)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (file_path, size, mtime_ns, content_hash, int(processed), category,
+             total_score, output_path, datetime.now().isoformat(timespec='seconds'), identical_to,
+             dup_group, None if dup_best is None else int(dup_best))
+        )
+        if metrics:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO metrics (path, name, version, value) VALUES (?, ?, ?, ?)',
+                [(file_path, name, str(version), json.dumps(value))
+                 for name, (version, value) in metrics.items()]
+            )
+
+        self._pending += 1
+        if self.commit_interval and self._pending >= self.commit_interval:
+            self.flush()
+
+    def store_metrics(self, file_path: str, metrics: Dict[str, Tuple[str, object]],
+                      signature: Optional[Tuple[int, int]] = None):
+        """
+        計測値だけを保存（処理済みかどうかや分類は変更しない）
+        ファイルが変更されている場合は、古い計測値を消してから保存する
+        """
+        if signature is None:
+            signature = self.file_signature(Path(file_path))
+            if signature is None:
+                return
+        size, mtime_ns = signature
+
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, content_hash FROM files WHERE path = ?', (file_path,)
+        ).fetchone()
+        if row is None or not self._row_matches(file_path, row, size, mtime_ns):
+            content_hash = None
+            if self.use_hash and os.path.exists(file_path):
+                content_hash = self.content_hash(Path(file_path))
+            self.conn.execute('DELETE FROM metrics WHERE path = ?', (file_path,))
+            self.conn.execute(
+                '''INSERT OR REPLACE INTO files
+                   (path, size, mtime_ns, content_hash, processed, updated_at)
+                   VALUES (?, ?, ?, ?, 0, ?)''',
+                (file_path, size, mtime_ns, content_hash, datetime.now().isoformat(timespec='seconds'))
+            )
+        if metrics:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO metrics (path, name, version, value) VALUES (?, ?, ?, ?)',
+                [(file_path, name, str(version), json.dumps(value))
+                 for name, (version, value) in metrics.items()]
+            )
+
+        self._pending += 1
+        if self.commit_interval and self._pending >= self.commit_interval:
+            self.flush()
+
+    def iter_processed(self) -> Iterator[Tuple[str, Dict[str, object], Dict[str, object]]]:
+        """
+        処理済みファイルを計測値と一緒に順番に取得（ファイルの変更確認はしない）
+        Yields: (元ファイルパス, {'output_path': 出力先パス, 'identical_to': 代表ファイル,
+                 'dup_group': グループ番号, 'dup_best': グループの代表か}, {計測名: 値})
+        """
+        outputs = {
+            path: {'output_path': output_path, 'identical_to': identical_to,
+                   'dup_group': dup_group, 'dup_best': None if dup_best is None else bool(dup_best)}
+            for path, output_path, identical_to, dup_group, dup_best in self.conn.execute(
+                'SELECT path, output_path, identical_to, dup_group, dup_best FROM files WHERE processed = 1'
+            )
+        }
+        rows = self.conn.execute(
+            'SELECT path, name, value FROM metrics ORDER BY path'
+        )
+
+        current_path = None
+        metrics = {}
+        for path, name, value in rows:
+            if path != current_path:
+                if current_path in outputs:
+                    yield current_path, outputs.pop(current_path), metrics
+                current_path = path
+                metrics = {}
+            metrics[name] = json.loads(value)
+        if current_path in outputs:
+            yield current_path, outputs.pop(current_path), metrics
+
+        # 計測値が1つもない処理済みファイル（旧形式から取り込んだもの）
+        for path, entry in outputs.items():
+            yield path, entry, {}
+
+    def update_results(self, rows: List[Tuple[str, float, str, Optional[str], Optional[bool]]]):
+        """
+        再分類の結果を一括で保存
+        rows: [(元ファイルパス, 総合スコア, 分類, 出力先パス, グループの代表か), ...]
+        """
+        self.conn.executemany(
+            'UPDATE files SET total_score = ?, category = ?, output_path = ?, dup_best = ? WHERE path = ?',
+            [(total_score, category, output_path, None if dup_best is None else int(dup_best), path)
+             for path, total_score, category, output_path, dup_best in rows]
+        )
+        self.flush()
+
+    def max_dup_group(self) -> int:
+        """記録済みのグループ番号の最大値（まだない場合は 0）"""
+        row = self.conn.execute('SELECT MAX(dup_group) FROM files').fetchone()
+        return row[0] or 0
+
+    def import_processed_list(self, processed_file: Path):
+        """旧形式の .processed.txt を取り込む（計測値なしの処理済みとして登録）"""
+        if not processed_file.exists():
+            return
+
+        already = {row[0] for row in self.conn.execute('SELECT path FROM files')}
+        with open(processed_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                path = line.strip()
+                if path and path not in already:
+                    self.record(path, processed=True)
+        self.flush()
+
+    def get_state(self, key: str) -> Optional[str]:
+        """保存済みの状態（ジョブの進み具合など）を取得"""
+        row = self.conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: Optional[str]):
+        """状態を保存（次の flush() で計測値・処理状況と一緒にコミットされる）"""
+        if value is None:
+            self.conn.execute('DELETE FROM state WHERE key = ?', (key,))
+        else:
+            self.conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def flush(self, durable: bool = False):
+        """
+        保留中の書き込みをコミット
+        durable: WALの内容をデータベース本体に書き込んで同期する（電源断でも失われない）
+        """
+        self.conn.commit()
+        if durable:
+            self.conn.execute('PRAGMA wal_checkpoint(FULL)')
+        self._pending = 0
+
+    def close(self):
+        """コミットして接続を閉じる"""
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Identical - 内容がまったく同じファイルの検出
+スマホのバックアップを統合したフォルダなどで、別の場所にある同じ写真を見つけます。
+サイズが同じファイルが2つ以上見つかった時点で初めてハッシュ値を計算するため、
+サイズが1つしかないファイル（ほとんどの写真）は読み込みません。
+"""
+
+import hashlib
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+def file_digest(file_path: str) -> bytes:
+    """ファイル内容のハッシュ値（BLAKE2b）。メモリマップで読み、全体を一度にハッシュ計算する"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+    return digest.digest()
+
+
+class IdenticalFileIndex:
+    """
+    走査順に届くファイルから、内容が同じファイルを見つけるクラス
+    最初に見つかったファイルを代表とし、後から見つかった同じ内容のファイルは代表のパスを返す
+    """
+
+    def __init__(self, eager: bool = False):
+        # サイズごとの代表ファイル（ハッシュ値は同じサイズのファイルが現れるまで計算しない）
+        self.by_size: Dict[int, List[str]] = {}
+        self.digests: Dict[str, bytes] = {}
+        self.by_digest: Dict[Tuple[int, bytes], str] = {}
+        # 代表ファイルが後で移動・削除される場合（移動モード）は、見つけた時点でハッシュ値を計算する
+        self.eager = eager
+        self.hashed = 0      # ハッシュ値を計算したファイル数
+        self.duplicates = 0  # 同じ内容のファイル数
+
+    def _digest(self, file_path: str, size: int) -> Optional[bytes]:
+        if file_path not in self.digests:
+            try:
+                value = file_digest(file_path)
+            except OSError:
+                return None
+            self.hashed += 1
+            self.digests[file_path] = value
+            self.by_digest.setdefault((size, value), file_path)
+        return self.digests[file_path]
+
+    def add(self, file_path: Path) -> Optional[str]:
+        """
+        ファイルを登録
+        Returns: 同じ内容の代表ファイルのパス（初めての内容なら None）
+        """
+        canonical = self._add(str(file_path))
+        if canonical is not None:
+            self.duplicates += 1
+        return canonical
+
+    def add_known(self, file_path: str):
+        """処理済みのファイルを、後から見つかるファイルの代表候補として登録（同一ファイルとして数えない）"""
+        self._add(str(file_path))
+
+    def _add(self, path: str) -> Optional[str]:
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return None
+
+        bucket = self.by_size.get(size)
+        if bucket is None:
+            self.by_size[size] = [path]
+            if self.eager:
+                self._digest(path, size)
+            return None
+
+        # 同じサイズのファイルがある場合だけ、それぞれのハッシュ値を比べる
+        for other in bucket:
+            self._digest(other, size)
+        digest = self._digest(path, size)
+        if digest is not None:
+            canonical = self.by_digest[(size, digest)]
+            if canonical != path:
+                return canonical
+        bucket.append(path)
+        return None
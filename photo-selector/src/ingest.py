@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Ingest - 画像ファイルの読み込み
+ファイルを1回だけ読み込み、同じバイト列から画素のデコードと撮影日時（EXIF）の取得を行います。
+撮影日時はJPEGのAPP1（EXIF）ヘッダーだけを解析し、目的のタグが見つかった時点で止めます。
+"""
+
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+# EXIFのタグ番号
+TAG_DATETIME = 0x0132            # DateTime（IFD0）
+TAG_EXIF_IFD = 0x8769            # Exif IFDへのポインタ（IFD0）
+TAG_DATETIME_ORIGINAL = 0x9003   # DateTimeOriginal（Exif IFD）
+
+# TIFFヘッダーのマジックナンバー（42 = TIFF/DNG/CR2/NEF/ARW、0x4F52・0x5352 = ORF、0x55 = RW2）
+TIFF_MAGICS = (42, 0x4F52, 0x5352, 0x55)
+
+# 撮影日時だけを読む場合に先頭から読むバイト数（APP1は最大64KB）
+HEADER_READ_SIZE = 128 * 1024
+
+
+def read_file(file_path: Path, limit: Optional[int] = None) -> bytes:
+    """ファイルを1回の read() で読み込む（limit指定時は先頭だけ）"""
+    with open(file_path, 'rb') as f:
+        return f.read() if limit is None else f.read(limit)
+
+
+def is_tiff(data: bytes) -> bool:
+    """TIFF形式（多くのRAWファイルを含む）のバイト列かどうか"""
+    if data[:2] == b'II':
+        endian = '<'
+    elif data[:2] == b'MM':
+        endian = '>'
+    else:
+        return False
+    return len(data) >= 8 and struct.unpack_from(endian + 'H', data, 2)[0] in TIFF_MAGICS
+
+
+def _parse_exif_datetime_value(raw: bytes) -> Optional[datetime]:
+    """EXIFの日時文字列（'YYYY:MM:DD HH:MM:SS'）を datetime に変換"""
+    try:
+        return datetime.strptime(raw.split(b'\x00', 1)[0].decode('ascii').strip(), '%Y:%m:%d %H:%M:%S')
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def _tiff_datetime(tiff: bytes) -> Optional[datetime]:
+    """TIFFヘッダー（EXIF本体）から撮影日時を取得（DateTimeOriginal優先、なければDateTime）"""
+    if len(tiff) < 8:
+        return None
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+
+    def read_ifd(offset: int, wanted: Tuple[int, ...]) -> dict:
+        """IFDのエントリから必要なタグだけを取り出す"""
+        found = {}
+        if offset + 2 > len(tiff):
+            return found
+        count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            if entry + 12 > len(tiff):
+                break
+            tag, value_type, value_count = struct.unpack_from(endian + 'HHI', tiff, entry)
+            if tag not in wanted:
+                continue
+            if tag == TAG_EXIF_IFD:
+                found[tag] = struct.unpack_from(endian + 'I', tiff, entry + 8)[0]
+            elif value_type == 2:  # ASCII
+                if value_count <= 4:
+                    found[tag] = tiff[entry + 8:entry + 8 + value_count]
+                else:
+                    value_offset = struct.unpack_from(endian + 'I', tiff, entry + 8)[0]
+                    # 途中で切れた文字列は、残りだけで別の日時として読めてしまうことがあるため使わない
+                    if value_offset + value_count <= len(tiff):
+                        found[tag] = tiff[value_offset:value_offset + value_count]
+            if len(found) == len(wanted):
+                break
+        return found
+
+    ifd0_offset = struct.unpack_from(endian + 'I', tiff, 4)[0]
+    ifd0 = read_ifd(ifd0_offset, (TAG_DATETIME, TAG_EXIF_IFD))
+
+    if TAG_EXIF_IFD in ifd0:
+        exif_ifd = read_ifd(ifd0[TAG_EXIF_IFD], (TAG_DATETIME_ORIGINAL,))
+        if TAG_DATETIME_ORIGINAL in exif_ifd:
+            value = _parse_exif_datetime_value(exif_ifd[TAG_DATETIME_ORIGINAL])
+            if value:
+                return value
+
+    if TAG_DATETIME in ifd0:
+        return _parse_exif_datetime_value(ifd0[TAG_DATETIME])
+    return None
+
+
+def exif_datetime(data: bytes) -> Optional[datetime]:
+    """
+    JPEG/PNG/TIFF（RAW）のバイト列から撮影日時を取得（ヘッダーのみ解析）
+    Returns: 撮影日時（EXIFがない場合は None）
+    """
+    try:
+        if data[:2] == b'\xff\xd8':
+            # JPEG: マーカーをたどってAPP1（EXIF）を探す。画像データ（SOS）に達したら終了
+            offset = 2
+            while offset + 4 <= len(data):
+                if data[offset] != 0xFF:
+                    return None
+                marker = data[offset + 1]
+                if marker == 0xFF:  # 埋め草
+                    offset += 1
+                    continue
+                if marker == 0xDA or marker == 0xD9:
+                    return None
+                length = struct.unpack_from('>H', data, offset + 2)[0]
+                if marker == 0xE1 and data[offset + 4:offset + 10] == b'Exif\x00\x00':
+                    value = _tiff_datetime(data[offset + 10:offset + 2 + length])
+                    if value:
+                        return value
+                offset += 2 + length
+
+        elif data[:8] == b'\x89PNG\r\n\x1a\n':
+            # PNG: eXIfチャンクを探す。画像データ（IDAT）に達したら終了
+            offset = 8
+            while offset + 8 <= len(data):
+                length, chunk_type = struct.unpack_from('>I4s', data, offset)
+                if chunk_type == b'eXIf':
+                    return _tiff_datetime(data[offset + 8:offset + 8 + length])
+                if chunk_type in (b'IDAT', b'IEND'):
+                    return None
+                offset += 12 + length
+
+        elif is_tiff(data):
+            # TIFF・RAW: ファイル全体がEXIFと同じTIFF構造
+            return _tiff_datetime(data)
+
+    except struct.error:
+        return None
+    return None
+
+
+def jpeg_frame(data: bytes) -> Optional[Tuple[int, int, int]]:
+    """
+    JPEGのバイト列からフレームヘッダー（SOF）を取得（ヘッダーのみ解析）
+    Returns: (SOFマーカー, 幅, 高さ)（JPEGでない場合は None）
+    """
+    try:
+        if data[:2] != b'\xff\xd8':
+            return None
+        offset = 2
+        while offset + 4 <= len(data):
+            if data[offset] != 0xFF:
+                return None
+            marker = data[offset + 1]
+            if marker == 0xFF:
+                offset += 1
+                continue
+            if marker == 0xDA or marker == 0xD9:
+                return None
+            length = struct.unpack_from('>H', data, offset + 2)[0]
+            # SOF0〜SOF15（DHT・JPG・DACを除く）に画像サイズがある
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack_from('>HH', data, offset + 5)
+                return marker, width, height
+            offset += 2 + length
+    except struct.error:
+        return None
+    return None
+
+
+def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    JPEG/PNGのバイト列から画像サイズ（幅, 高さ）を取得（ヘッダーのみ解析）
+    Returns: (幅, 高さ)（判別できない場合は None）
+    """
+    try:
+        if data[:2] == b'\xff\xd8':
+            frame = jpeg_frame(data)
+            return frame[1:] if frame else None
+
+        elif data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+            width, height = struct.unpack_from('>II', data, 16)
+            return width, height
+
+    except struct.error:
+        return None
+    return None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Job - ライブラリ全体を再開可能なジョブとして処理するための記録
+分類フォルダへ出力する前に「出力予定」を追記し、チャンクの区切りでチェックポイントを書いて fsync します。
+途中で強制終了しても、最後のチェックポイント以降に確定していない出力だけを取り消して続きから再開できます。
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Iterator, Tuple
+
+
+class JobJournal:
+    """
+    ジョブの記録（出力予定とチェックポイントを1行1件のJSONで追記）
+    チェックポイントより前の出力は確定済み（キャッシュにコミット済み）、後の出力は未確定として扱う
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+        self.checkpoints = 0
+
+    def exists(self) -> bool:
+        """前回のジョブが途中で止まっているか（完了したジョブの記録は削除される）"""
+        return self.path.exists()
+
+    def pending_outputs(self) -> Iterator[Tuple[str, str]]:
+        """
+        最後のチェックポイントより後に記録した出力予定
+        Yields: (元ファイルパス, 出力先パス)
+        """
+        pending = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で止まった最後の行は読み飛ばす
+                    continue
+                if entry.get('op') == 'checkpoint':
+                    pending = []
+                elif entry.get('op') == 'output':
+                    pending.append((entry['source'], entry['destination']))
+        yield from pending
+
+    def start(self):
+        """新しい記録を開始（前回の記録は復旧後に破棄する。続けて checkpoint() を呼ぶ）"""
+        self.close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'w', encoding='utf-8')
+
+    def record_output(self, source: Path, destination: Path):
+        """出力を始める前に出力予定を追記（プロセスが止まっても残るよう、すぐにOSへ書き出す）"""
+        self._write({'op': 'output', 'source': str(source), 'destination': str(destination)})
+        self._file.flush()
+
+    def checkpoint(self):
+        """ここまでの出力が確定したことを記録して fsync"""
+        self._write({'op': 'checkpoint', 'n': self.checkpoints})
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.checkpoints += 1
+
+    def _write(self, entry: dict):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def finish(self):
+        """ジョブの完了（記録を削除）"""
+        self.close()
+        if self.path.exists():
+            self.path.unlink()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Output Writer - 分類フォルダへの出力
+写真を分類フォルダへコピー・ハードリンク・reflink・シンボリックリンク・移動のいずれかで出力します。
+同名ファイルの確認は、起動時に1回だけ作る各フォルダのファイル名一覧（メモリ上）で行います。
+"""
+
+import ctypes
+import errno
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+OUTPUT_MODES = ('copy', 'hardlink', 'reflink', 'symlink', 'move')
+
+# LinuxのFICLONE ioctl（reflink）
+FICLONE = 0x40049409
+
+
+class OutputWriter:
+    """分類フォルダへの出力とファイル名の重複回避を行うクラス"""
+
+    def __init__(self, output_dir: Path, categories: Iterable[str], mode: str = 'copy'):
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f'不明な出力方法です: {mode}')
+        self.output_dir = Path(output_dir)
+        self.categories = list(categories)
+        self.mode = mode
+        self.names: Dict[str, Set[str]] = {}
+        self.fallbacks = 0  # 指定の方法が使えずコピーした件数
+        self._lock = threading.Lock()
+
+    def build_index(self):
+        """各分類フォルダのファイル名一覧を作成（起動時に1回だけ）"""
+        for category in self.categories:
+            category_dir = self.output_dir / category
+            try:
+                self.names[category] = set(os.listdir(category_dir))
+            except FileNotFoundError:
+                self.names[category] = set()
+
+    def reserve_path(self, category: str, filename: str) -> Path:
+        """出力先のパスを予約（同名ファイルがある場合は連番を追加）"""
+        with self._lock:
+            if category not in self.names:
+                category_dir = self.output_dir / category
+                self.names[category] = set(os.listdir(category_dir)) if category_dir.exists() else set()
+            names = self.names[category]
+
+            name = filename
+            stem, suffix = os.path.splitext(filename)
+            counter = 1
+            while name in names:
+                name = f'{stem}_{counter}{suffix}'
+                counter += 1
+            names.add(name)
+            return self.output_dir / category / name
+
+    def release_path(self, path: Path):
+        """予約済み（または移動済み）のファイル名を一覧から外す"""
+        with self._lock:
+            self.names.get(path.parent.name, set()).discard(path.name)
+
+    def write(self, source: Path, destination: Path, mode: Optional[str] = None):
+        """
+        指定の方法で写真を出力（使えない場合はコピー）
+        mode: この写真だけ出力方法を変える場合に指定（省略時は self.mode）
+        """
+        mode = mode or self.mode
+        try:
+            if mode == 'hardlink':
+                os.link(source, destination)
+            elif mode == 'symlink':
+                os.symlink(os.path.abspath(source), destination)
+            elif mode == 'move':
+                shutil.move(str(source), str(destination))
+            elif mode == 'reflink':
+                reflink(source, destination)
+            else:
+                copy_file(source, destination)
+            return
+        except OSError as e:
+            if mode == 'copy' or e.errno == errno.EEXIST:
+                raise
+            # 別のファイルシステムや未対応の場合はコピーにフォールバック
+            with self._lock:
+                self.fallbacks += 1
+            try:
+                os.unlink(destination)
+            except OSError:
+                pass
+        copy_file(source, destination)
+
+
+def copy_file(source: Path, destination: Path):
+    """
+    ファイルをコピー（メタデータも含む）
+    Linuxでは os.copy_file_range でカーネル内コピーを行い、使えない場合は shutil.copy2
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(source, 'rb') as src, open(destination, 'wb') as dst:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            shutil.copystat(source, destination)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+
+
+def reflink(source: Path, destination: Path):
+    """
+    reflink（コピーオンライトの複製）を作成
+    APFS（macOS）は clonefile、Btrfs/XFS（Linux）は FICLONE を使う。未対応の場合は OSError
+    """
+    if sys.platform == 'darwin':
+        libc = ctypes.CDLL('/usr/lib/libSystem.dylib', use_errno=True)
+        if libc.clonefile(os.fsencode(source), os.fsencode(destination), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        shutil.copystat(source, destination)
+        return
+
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'reflinkに対応していません')
+
+    import fcntl
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Parity - 高速化オプションの評価結果の検証
+同じ写真を標準の設定（原寸）と高速化オプション（縮小デコード・2段階評価・埋め込みプレビュー・
+メモリ上限など）で評価し、計測値ごとの誤差・7段階の分類の一致表・速度の比を表示します。
+分類の一致率が基準を下回った場合は終了コード1で終わるため、高速化オプションを本番で使う前の確認に使えます。
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmark import git_commit
+from photo_selector import PhotoSelector
+from preview import HEIF_EXTENSIONS, HEIF_SUPPORTED, RAW_EXTENSIONS
+from scanner import IMAGE_EXTENSIONS, ImageScanner
+from synthetic import SyntheticCorpus, parse_sizes
+
+
+# 誤差を比べる項目（0〜100点のスコアと総合スコア）
+METRICS = ['sharpness', 'exposure', 'contrast', 'face_score', 'eyes_open', 'smile', 'composition', 'total_score']
+# 補正係数を求める縮小率（縮小デコードの 1/2・1/4・1/8）
+FIT_REDUCTIONS = (2, 4, 8)
+# 縮小した長辺がこれより小さくなる縮小率では評価しない（顔検出ができない大きさ）
+FIT_MIN_SIZE = 128
+
+
+class ParityCheck:
+    """標準の設定と高速化オプションで同じ写真を評価し、結果の違いを集計するクラス"""
+
+    def __init__(self, files: List[Path], fast_options: dict):
+        self.files = files
+        self.fast_options = fast_options
+        output_dir = tempfile.gettempdir()
+        input_dir = str(files[0].parent) if files else '.'
+        self.reference = PhotoSelector(input_dir=input_dir, output_dir=output_dir)
+        self.fast = PhotoSelector(input_dir=input_dir, output_dir=output_dir, **fast_options)
+        self.categories = self.reference.categories
+        self.rows: List[dict] = []
+
+    def run(self, progress: bool = True):
+        """すべての写真を両方の設定で評価（キャッシュは使わない）"""
+        for index, file_path in enumerate(self.files, 1):
+            start = time.perf_counter()
+            reference = self.reference.evaluate_photo(file_path)
+            reference_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fast = self.fast.evaluate_photo(file_path)
+            fast_seconds = time.perf_counter() - start
+
+            self.rows.append({
+                'file_path': str(file_path),
+                'reference': {name: float(reference[name]) for name in METRICS},
+                'fast': {name: float(fast[name]) for name in METRICS},
+                'reference_category': reference['category'],
+                'fast_category': fast['category'],
+                # 2段階評価の1回目の結果（評価し直さなかった写真は最終結果と同じ）
+                'coarse_total_score': float(fast.get('coarse_total_score', fast['total_score'])),
+                'coarse_category': fast.get('coarse_category', fast['category']),
+                'refined': bool(fast.get('refined')),
+                'reference_faces': len((reference.get('features') or {}).get('faces') or []),
+                'fast_faces': len((fast.get('features') or {}).get('faces') or []),
+                'reference_seconds': reference_seconds,
+                'fast_seconds': fast_seconds,
+            })
+            if progress:
+                print(f"\r評価中: {index}/{len(self.files)}", end='', flush=True, file=sys.stderr)
+        if progress:
+            print(file=sys.stderr)
+
+    def metric_errors(self) -> Dict[str, dict]:
+        """項目ごとの誤差（高速化 - 標準）の分布"""
+        errors = {}
+        for name in METRICS:
+            diff = np.array([row['fast'][name] - row['reference'][name] for row in self.rows])
+            absolute = np.abs(diff)
+            errors[name] = {
+                'mean': float(diff.mean()),
+                'mean_abs': float(absolute.mean()),
+                'p50_abs': float(np.percentile(absolute, 50)),
+                'p95_abs': float(np.percentile(absolute, 95)),
+                'max_abs': float(absolute.max()),
+            }
+        return errors
+
+    def confusion_matrix(self) -> np.ndarray:
+        """7段階の分類の一致表（行 = 標準の分類、列 = 高速化オプションの分類）"""
+        index = {category: i for i, category in enumerate(self.categories)}
+        matrix = np.zeros((len(self.categories), len(self.categories)), dtype=int)
+        for row in self.rows:
+            matrix[index[row['reference_category']], index[row['fast_category']]] += 1
+        return matrix
+
+    def coarse_summary(self) -> Optional[dict]:
+        """
+        2段階評価の1回目の誤差と、評価し直しの効果（--coarse-size を指定したときだけ）
+          coarse_p95_abs: 1回目の総合スコアと標準の総合スコアの差（絶対値）のp95
+          disagreements: 評価し直した写真のうち、1回目と分類が食い違った枚数
+          misses: 評価し直さなかった写真のうち、標準と分類が違う枚数（幅が足りなかった写真）
+        """
+        if not self.fast_options.get('coarse_size') or not self.rows:
+            return None
+        diff = np.array([row['coarse_total_score'] - row['reference']['total_score'] for row in self.rows])
+        refined = [row for row in self.rows if row['refined']]
+        return {
+            'coarse_p95_abs': float(np.percentile(np.abs(diff), 95)),
+            'refined': len(refined),
+            'disagreements': sum(row['coarse_category'] != row['fast_category'] for row in refined),
+            'misses': sum(not row['refined'] and row['fast_category'] != row['reference_category']
+                          for row in self.rows),
+        }
+
+    def summary(self) -> dict:
+        """一致率・速度の比などのまとめ"""
+        matrix = self.confusion_matrix()
+        total = int(matrix.sum())
+        # 隣の分類までのずれ（境目付近の写真）を許容した一致率
+        near = sum(int(matrix[i, j]) for i in range(len(matrix)) for j in range(len(matrix)) if abs(i - j) <= 1)
+        reference_seconds = sum(row['reference_seconds'] for row in self.rows)
+        fast_seconds = sum(row['fast_seconds'] for row in self.rows)
+        return {
+            'photos': total,
+            'tier_agreement': float(np.trace(matrix)) / total if total else 1.0,
+            'within_one_tier': near / total if total else 1.0,
+            'face_count_agreement': sum(row['reference_faces'] == row['fast_faces'] for row in self.rows) / total
+            if total else 1.0,
+            'reference_seconds': reference_seconds,
+            'fast_seconds': fast_seconds,
+            'speedup': reference_seconds / fast_seconds if fast_seconds else None,
+            'coarse': self.coarse_summary(),
+        }
+
+    def report(self) -> List[str]:
+        """結果の表（誤差・一致表・まとめ）"""
+        lines = [f"{'項目':12s} {'平均':>6s} {'平均(絶対値)':>8s} {'p50':>7s} {'p95':>7s} {'最大':>5s}"]
+        for name, stats in self.metric_errors().items():
+            lines.append(f"{name:14s} {stats['mean']:+7.2f} {stats['mean_abs']:12.2f} "
+                         f"{stats['p50_abs']:7.2f} {stats['p95_abs']:7.2f} {stats['max_abs']:7.2f}")
+
+        lines.append('')
+        lines.append('分類の一致表（行: 標準、列: 高速化オプション）')
+        labels = [category.split('_')[0] for category in self.categories]
+        lines.append('      ' + ''.join(f'{label:>6s}' for label in labels))
+        for label, counts in zip(labels, self.confusion_matrix()):
+            lines.append(f'{label:>6s}' + ''.join(f'{count:6d}' for count in counts))
+
+        summary = self.summary()
+        lines.append('')
+        lines.append(f"分類の一致率: {summary['tier_agreement'] * 100:.1f}%"
+                     f"（隣の分類まで含めると {summary['within_one_tier'] * 100:.1f}%）")
+        lines.append(f"顔の数の一致率: {summary['face_count_agreement'] * 100:.1f}%")
+        coarse = summary['coarse']
+        if coarse:
+            margin = self.fast.refine_margin
+            lines.append(f"2段階評価: 1回目の総合スコアの誤差 p95 {coarse['coarse_p95_abs']:.2f}点"
+                         f"（評価し直す幅: {'縮小率に応じた誤差の目安' if margin is None else f'{margin:g}点'}）")
+            lines.append(f"  評価し直した写真: {coarse['refined']}枚 / {summary['photos']}枚"
+                         f"（うち1回目と分類が食い違った写真: {coarse['disagreements']}枚）")
+            lines.append(f"  評価し直さずに標準と分類が違った写真: {coarse['misses']}枚")
+        if summary['speedup']:
+            lines.append(f"速度: {summary['speedup']:.2f}倍（標準 {summary['reference_seconds']:.1f}秒 → "
+                         f"高速化 {summary['fast_seconds']:.1f}秒）")
+        return lines
+
+    def save(self, path: Path, min_agreement: float):
+        data = {
+            'commit': git_commit(),
+            'fast_options': self.fast_options,
+            'min_agreement': min_agreement,
+            'summary': self.summary(),
+            'metric_errors': self.metric_errors(),
+            'categories': self.categories,
+            'confusion_matrix': self.confusion_matrix().tolist(),
+            'photos': self.rows,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+class GainFit:
+    """
+    縮小デコードの補正係数（PhotoEvaluator の sharpness_scale_gain・contrast_scale_gain）を求めるクラス
+    写真ごとに原寸と各縮小率で評価し、縮小率ごとに次の値を求める
+      シャープさ: 補正後のシャープさのスコアと原寸のスコアの差（絶対値）の平均が最小になる係数
+      コントラスト: 縮小した画像と原寸の標準偏差の比の中央値
+      総合スコアの誤差: 求めた係数で補正したときの、原寸との差の絶対値のp95（scale_score_error）
+    """
+
+    def __init__(self, files: List[Path]):
+        self.files = files
+        self.output_dir = tempfile.gettempdir()
+        self.input_dir = str(files[0].parent) if files else '.'
+        self.reference = PhotoSelector(input_dir=self.input_dir, output_dir=self.output_dir)
+        self.evaluator = self.reference.evaluator
+        self._selectors: Dict[int, PhotoSelector] = {}
+        # 縮小率 -> [(原寸の評価結果, 縮小した評価結果, 補正前のLaplacian分散, 補正前の標準偏差), ...]
+        self.samples: Dict[int, list] = {reduction: [] for reduction in FIT_REDUCTIONS}
+        self.gains: Dict[str, Dict[int, float]] = {}
+
+    def selector(self, analysis_size: int) -> PhotoSelector:
+        """解析解像度ごとのセレクター（検出器は共有されるため、作るのは軽い）"""
+        if analysis_size not in self._selectors:
+            self._selectors[analysis_size] = PhotoSelector(
+                input_dir=self.input_dir, output_dir=self.output_dir, analysis_size=analysis_size)
+        return self._selectors[analysis_size]
+
+    def run(self, progress: bool = True):
+        """すべての写真を原寸と各縮小率で評価（キャッシュは使わない）"""
+        for index, file_path in enumerate(self.files, 1):
+            reference = self.reference.evaluate_photo(file_path)
+            features = reference.get('features')
+            if features and 'faces' in features:
+                long_side = max(features['frame'])
+                for reduction in FIT_REDUCTIONS:
+                    # 長辺 / 縮小率 を解析解像度にすると、ちょうどその縮小率でデコードされる
+                    analysis_size = long_side // reduction
+                    if analysis_size < FIT_MIN_SIZE:
+                        continue
+                    fast = self.selector(analysis_size).evaluate_photo(file_path)
+                    fast_features = fast.get('features')
+                    if not fast_features or 'faces' not in fast_features:
+                        continue
+                    # 現在の係数で補正された値を、補正前の値に戻しておく
+                    raw_sharpness = fast_features['sharpness'] * \
+                        self.evaluator.scale_gain(self.evaluator.sharpness_scale_gain, reduction)
+                    raw_contrast = fast_features['contrast'] * \
+                        self.evaluator.scale_gain(self.evaluator.contrast_scale_gain, reduction)
+                    self.samples[reduction].append((reference, fast, raw_sharpness, raw_contrast))
+            if progress:
+                print(f"\r評価中: {index}/{len(self.files)}", end='', flush=True, file=sys.stderr)
+        if progress:
+            print(file=sys.stderr)
+
+    def fit(self) -> Dict[str, Dict[int, float]]:
+        """
+        縮小率ごとの補正係数を求める
+        Returns: {'sharpness_scale_gain': {縮小率: 係数}, 'contrast_scale_gain': {...},
+                  'scale_score_error': {縮小率: 総合スコアの誤差のp95}}
+        """
+        sharpness_score = self.evaluator.sharpness_score
+        # シャープさの係数の候補（1/20〜50倍を対数で等間隔に）
+        candidates = np.exp(np.linspace(np.log(0.05), np.log(50), 801))
+
+        gains = {'sharpness_scale_gain': {1: 1.0}, 'contrast_scale_gain': {1: 1.0}, 'scale_score_error': {1: 0.0}}
+        for reduction, samples in self.samples.items():
+            if not samples:
+                continue
+            reference_sharpness = np.array([ref['features']['sharpness'] for ref, _, _, _ in samples])
+            raw_sharpness = np.array([raw for _, _, raw, _ in samples])
+            target = sharpness_score(reference_sharpness)
+            errors = [np.abs(sharpness_score(raw_sharpness / gain) - target).mean() for gain in candidates]
+            sharpness_gain = float(candidates[int(np.argmin(errors))])
+
+            ratios = [raw / ref['features']['contrast'] for ref, _, _, raw in samples if ref['features']['contrast']]
+            contrast_gain = float(np.median(ratios)) if ratios else 1.0
+
+            gains['sharpness_scale_gain'][reduction] = round(sharpness_gain, 3)
+            gains['contrast_scale_gain'][reduction] = round(contrast_gain, 3)
+            gains['scale_score_error'][reduction] = round(float(np.percentile(
+                np.abs(self.total_errors(reduction, sharpness_gain, contrast_gain)), 95)), 1)
+        self.gains = gains
+        return gains
+
+    def total_errors(self, reduction: int, sharpness_gain: float, contrast_gain: float) -> np.ndarray:
+        """指定の係数で補正したときの総合スコアの誤差（縮小 - 原寸）"""
+        errors = []
+        for reference, fast, raw_sharpness, raw_contrast in self.samples[reduction]:
+            features = dict(fast['features'], sharpness=raw_sharpness / sharpness_gain,
+                            contrast=raw_contrast / contrast_gain)
+            rescored = {}
+            self.reference.score_result(rescored, features)
+            errors.append(rescored['total_score'] - reference['total_score'])
+        return np.array(errors)
+
+    def report(self) -> List[str]:
+        """縮小率ごとの係数と誤差（現在の係数との比較）"""
+        evaluator = self.evaluator
+        lines = [f"{'縮小率':6s} {'枚数':>4s} {'シャープさ':>10s} {'コントラスト':>10s} "
+                 f"{'総合p95(現在)':>12s} {'総合p95(補正後)':>12s}"]
+        for reduction in FIT_REDUCTIONS:
+            samples = self.samples[reduction]
+            if not samples or reduction not in self.gains['sharpness_scale_gain']:
+                continue
+            current = np.percentile(np.abs(self.total_errors(
+                reduction, evaluator.scale_gain(evaluator.sharpness_scale_gain, reduction),
+                evaluator.scale_gain(evaluator.contrast_scale_gain, reduction))), 95)
+            lines.append(f"1/{reduction:<4d} {len(samples):6d} {self.gains['sharpness_scale_gain'][reduction]:12.3f} "
+                         f"{self.gains['contrast_scale_gain'][reduction]:12.3f} {current:14.1f} "
+                         f"{self.gains['scale_score_error'][reduction]:16.1f}")
+        return lines
+
+    def save(self, path: Path):
+        data = {
+            'commit': git_commit(),
+            'photos': len(self.files),
+            'samples': {str(reduction): len(samples) for reduction, samples in self.samples.items()},
+            **{name: {str(k): v for k, v in table.items()} for name, table in self.gains.items()},
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description='標準の設定と高速化オプションで同じ写真を評価し、スコアと分類の違いを確認します。'
+    )
+    parser.add_argument(
+        '--input', '-i',
+        help='評価する写真のフォルダ（省略時は合成写真を使う）'
+    )
+    parser.add_argument(
+        '--corpus',
+        default=os.path.join(tempfile.gettempdir(), 'photo-selector-bench-corpus'),
+        help='--input を省略した場合に合成写真を置くフォルダ'
+    )
+    parser.add_argument(
+        '--sizes',
+        default='1024x768,2048x1536,4032x3024',
+        help='合成写真の解像度（カンマ区切り）'
+    )
+    parser.add_argument(
+        '--count',
+        type=int,
+        default=12,
+        help='解像度ごとの合成写真の枚数（デフォルト: 12）'
+    )
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=0,
+        help='評価する写真の最大枚数（0 = すべて）'
+    )
+    # 高速化オプション（photo_selector.py と同じ意味）
+    parser.add_argument('--analysis-size', type=int, default=0, help='解析解像度（長辺のピクセル数）')
+    parser.add_argument('--coarse-size', type=int, default=0, help='2段階評価の低解像度（長辺のピクセル数）')
+    parser.add_argument('--refine-margin', type=float, default=None,
+                        help='2段階評価で評価し直す境目からの点数の幅（省略時は縮小率に応じた誤差の目安）')
+    parser.add_argument('--jpeg-preview', action='store_true', help='JPEGの埋め込みプレビューで評価する')
+    parser.add_argument('--memory-limit', type=int, default=0, metavar='MB', help='1枚の解析に使うメモリの上限')
+    parser.add_argument('--tile-threads', type=int, default=1, help='帯ごとの統計を並列に計算するスレッド数')
+    parser.add_argument(
+        '--min-agreement',
+        type=float,
+        default=0.95,
+        help='分類の一致率の基準（0〜1、デフォルト: 0.95）。下回ると終了コード1で終わる'
+    )
+    parser.add_argument(
+        '--fit-gains',
+        action='store_true',
+        help='高速化オプションと比べる代わりに、縮小デコードの補正係数（縮小率ごと）を求める'
+    )
+    parser.add_argument(
+        '--output', '-o',
+        help='結果（写真ごとのスコアを含む）を保存するJSONファイル'
+    )
+    args = parser.parse_args(argv)
+
+    fast_options = {
+        'analysis_size': args.analysis_size,
+        'coarse_size': args.coarse_size,
+        'refine_margin': args.refine_margin,
+        'jpeg_preview': args.jpeg_preview,
+        'memory_limit': args.memory_limit,
+        'tile_threads': args.tile_threads,
+    }
+    if not args.fit_gains and \
+            not any(value for name, value in fast_options.items() if name != 'refine_margin' and name != 'tile_threads'):
+        print("エラー: 高速化オプション（--analysis-size・--coarse-size・--jpeg-preview・--memory-limit）を指定してください")
+        sys.exit(1)
+
+    if args.input:
+        if not os.path.isdir(args.input):
+            print(f"エラー: 入力フォルダが見つかりません: {args.input}")
+            sys.exit(1)
+        extensions = IMAGE_EXTENSIONS + RAW_EXTENSIONS
+        if HEIF_SUPPORTED:
+            extensions += HEIF_EXTENSIONS
+        files = sorted(ImageScanner(Path(args.input), extensions=extensions))
+    else:
+        corpus = SyntheticCorpus(Path(args.corpus), sizes=parse_sizes(args.sizes), count=args.count)
+        print(f"合成写真を用意しています: {corpus.root}", file=sys.stderr)
+        files = corpus.ensure()
+    if args.limit:
+        files = files[:args.limit]
+    if not files:
+        print("評価する写真がありません。")
+        sys.exit(1)
+
+    if args.fit_gains:
+        fit = GainFit(files)
+        fit.run()
+        gains = fit.fit()
+        for line in fit.report():
+            print(line)
+        print("\nPhotoEvaluator に設定する値:")
+        for name, table in gains.items():
+            print(f"  self.{name} = {table}")
+        if args.output:
+            fit.save(Path(args.output))
+            print(f"\n結果を保存しました: {args.output}")
+        return
+
+    check = ParityCheck(files, fast_options)
+    check.run()
+    for line in check.report():
+        print(line)
+    if args.output:
+        check.save(Path(args.output), args.min_agreement)
+        print(f"\n結果を保存しました: {args.output}")
+
+    agreement = check.summary()['tier_agreement']
+    if agreement < args.min_agreement:
+        print(f"\n不合格: 分類の一致率 {agreement * 100:.1f}% が基準 {args.min_agreement * 100:.1f}% を下回りました")
+        sys.exit(1)
+    print(f"\n合格: 分類の一致率 {agreement * 100:.1f}%（基準 {args.min_agreement * 100:.1f}%）")
+
+
+if __name__ == '__main__':
+    main()
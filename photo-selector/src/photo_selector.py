@@ -5,130 +5,589 @@ Photo Selector - 写真自動選定ツール
 """
 
 import argparse
-import csv
+import contextlib
+import io
+import heapq
+import itertools
+import json
+import math
 import os
 import shutil
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import IO, Callable, Optional, List, Tuple, Union
 
 import cv2
 import numpy as np
 from PIL import Image
-from PIL.ExifTags import TAGS
 from tqdm import tqdm
 
+from dedupe import MAX_WINDOW, DuplicateGrouper, dhash
+from feature_cache import FeatureCache
+from identical import IdenticalFileIndex
+from job import JobJournal
+from ingest import HEADER_READ_SIZE, exif_datetime, image_size, read_file
+from output_writer import OutputWriter
+from pipeline import OutputStage, PrefetchReader, StageStats
+from profiler import Profiler
+from preview import HEIF_EXTENSIONS, HEIF_SUPPORTED, RAW_EXTENSIONS, decode_full, largest_preview, source_size
+from results_writer import ResultsWriter
+from scanner import IMAGE_EXTENSIONS, ImageScanner
+from thumbnails import THUMBNAIL_LIMIT_MB, ThumbnailCache
+
+
+# 顔・目・笑顔の検出器（OpenCVのHaar Cascade）のファイル名
+CASCADE_FILES = {
+    'face': 'haarcascade_frontalface_default.xml',
+    'eye': 'haarcascade_eye.xml',
+    'smile': 'haarcascade_smile.xml',
+}
+_cascades = {}
+_cascades_lock = threading.Lock()
+
+
+def load_cascades() -> dict:
+    """
+    Haar Cascadeを読み込む（プロセスごとに1回だけ。以降は同じ検出器を返す）
+    GUIはウィンドウを表示した後に別スレッドで呼んでおき、最初の実行までに読み込みを済ませる
+    （読み込み中に呼んだ場合は、読み込みが終わるまで待つ）
+    """
+    with _cascades_lock:
+        if not _cascades:
+            for name, file_name in CASCADE_FILES.items():
+                _cascades[name] = cv2.CascadeClassifier(cv2.data.haarcascades + file_name)
+        return _cascades
+
+
+class AnalysisContext:
+    """
+    1枚の写真の解析用データをまとめたクラス
+    グレースケール変換・ヒストグラム・平均/標準偏差・縮小画像を1回だけ計算し、
+    各評価メソッドで共有する
+    strip_rows を指定すると、Laplacian分散・ヒストグラム・平均/標準偏差を横長の帯ごとに計算して合算する
+    （作業用のメモリが帯1本分で済むため、巨大な画像やパノラマでもメモリを使いすぎない）
+    """
+
+    def __init__(self, image: np.ndarray, scale: float = 1, strip_rows: int = 0,
+                 strip_pool: Optional[ThreadPoolExecutor] = None):
+        self.image = image
+        self.height, self.width = image.shape[:2]
+        # 元画像に対する縮小率（1 = 原寸、2/4/8 = 縮小デコード。埋め込みプレビューでは端数もある）
+        self.scale = scale
+
+        # グレースケール画像（すでにグレースケールならそのまま使う）
+        if image.ndim == 2:
+            self.gray = image
+        else:
+            self.gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        # 帯の行数（0 = 画像全体を一度に計算）と、帯を並列に計算するスレッドプール（None = 順番に計算）
+        self.strip_rows = strip_rows
+        self.strip_pool = strip_pool
+
+        self._hist = None
+        self._mean = None
+        self._std = None
+        self._laplacian_var = None
+        self._pyramid = [self.gray]
+
+    @classmethod
+    def of(cls, image: Union[np.ndarray, 'AnalysisContext']) -> 'AnalysisContext':
+        """画像または既存のコンテキストからコンテキストを取得"""
+        if isinstance(image, cls):
+            return image
+        return cls(image)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.image.shape
+
+    @property
+    def tiled(self) -> bool:
+        """統計を帯ごとに計算するか"""
+        return self.strip_rows > 0
+
+    @property
+    def hist(self) -> np.ndarray:
+        """正規化済みの輝度ヒストグラム（256ビン）"""
+        if self._hist is None:
+            if self.tiled:
+                self._compute_strip_stats()
+            else:
+                hist = cv2.calcHist([self.gray], [0], None, [256], [0, 256]).flatten()
+                self._hist = hist / hist.sum()
+        return self._hist
+
+    def _compute_mean_std(self):
+        if self.tiled:
+            self._compute_strip_stats()
+            return
+        mean, std = cv2.meanStdDev(self.gray)
+        self._mean = float(mean[0][0])
+        self._std = float(std[0][0])
+
+    @property
+    def laplacian_var(self) -> float:
+        """Laplacian（3×3）の分散"""
+        if self._laplacian_var is None:
+            if self.tiled:
+                self._compute_strip_stats()
+            else:
+                self._laplacian_var = float(cv2.Laplacian(self.gray, cv2.CV_64F).var())
+        return self._laplacian_var
+
+    @staticmethod
+    def _moments(values: np.ndarray) -> Tuple[int, float, float]:
+        """(画素数, 平均, 偏差の二乗和)"""
+        mean, std = cv2.meanStdDev(values)
+        count = values.shape[0] * values.shape[1]
+        return count, float(mean[0][0]), float(std[0][0]) ** 2 * count
+
+    @staticmethod
+    def _combine(parts: List[Tuple[int, float, float]]) -> Tuple[float, float]:
+        """帯ごとの (画素数, 平均, 偏差の二乗和) を合算して (平均, 分散) を求める"""
+        count, mean, m2 = 0, 0.0, 0.0
+        for part_count, part_mean, part_m2 in parts:
+            total = count + part_count
+            delta = part_mean - mean
+            mean += delta * part_count / total
+            m2 += part_m2 + delta * delta * count * part_count / total
+            count = total
+        return mean, m2 / count
+
+    def _strip_stats(self, top: int) -> Tuple[np.ndarray, tuple, tuple]:
+        """1本の帯（top 行目から strip_rows 行）のヒストグラム・輝度とLaplacianの統計"""
+        bottom = min(top + self.strip_rows, self.height)
+        strip = self.gray[top:bottom]
+        # 上下の帯と1行ずつ重ねてLaplacianを計算し、重ねた行を捨てる
+        # （帯の境目の行も画像全体で計算した値と同じになる。3×3の整数なので16ビットで足りる）
+        begin = max(top - 1, 0)
+        end = min(bottom + 1, self.height)
+        laplacian = cv2.Laplacian(self.gray[begin:end], cv2.CV_16S)
+        laplacian = laplacian[top - begin:top - begin + bottom - top]
+        hist = cv2.calcHist([strip], [0], None, [256], [0, 256]).flatten()
+        return hist, self._moments(strip), self._moments(laplacian)
+
+    def _compute_strip_stats(self):
+        """帯ごとの統計を合算（strip_pool があれば帯を並列に計算する）"""
+        tops = range(0, self.height, self.strip_rows)
+        if self.strip_pool is not None:
+            parts = list(self.strip_pool.map(self._strip_stats, tops))
+        else:
+            parts = [self._strip_stats(top) for top in tops]
+
+        hist = np.sum([part[0] for part in parts], axis=0)
+        self._hist = hist / hist.sum()
+        mean, variance = self._combine([part[1] for part in parts])
+        self._mean = mean
+        self._std = variance ** 0.5
+        _, self._laplacian_var = self._combine([part[2] for part in parts])
+
+    @property
+    def mean(self) -> float:
+        """輝度の平均"""
+        if self._mean is None:
+            self._compute_mean_std()
+        return self._mean
+
+    @property
+    def std(self) -> float:
+        """輝度の標準偏差"""
+        if self._std is None:
+            self._compute_mean_std()
+        return self._std
+
+    def pyramid(self, level: int) -> np.ndarray:
+        """1/2^level に縮小したグレースケール画像（必要になった段まで生成）"""
+        while len(self._pyramid) <= level:
+            self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+        return self._pyramid[level]
+
+    def face_roi(self, face: Tuple[int, int, int, int], level: int = 0) -> np.ndarray:
+        """
+        顔領域のグレースケール画像（コピーせずビューを返す）
+        level: 縮小画像の段（座標は原寸のまま渡す）
+        """
+        x, y, w, h = (v >> level for v in face)
+        return self.pyramid(level)[y:y+h, x:x+w]
+
 
 class PhotoEvaluator:
     """写真の品質を評価するクラス"""
 
+    # 各計測値のコードバージョン（計算方法を変えたら上げると、キャッシュ済みの値が再計算される）
+    metric_versions = {
+        'datetime': 1,
+        'frame': 1,
+        'sharpness': 2,
+        'exposure': 1,
+        'contrast': 2,
+        'faces': 2,
+        'eyes': 2,
+        'smiles': 2,
+        'dhash': 1,
+    }
+
     def __init__(self):
         self.supported_extensions = {'.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG'}
+        self.supported_extensions.update(RAW_EXTENSIONS)
+        if HEIF_SUPPORTED:
+            self.supported_extensions.update(HEIF_EXTENSIONS)
+
+        # OpenCVの顔検出器（Haar Cascade）は最初の検出で読み込む（load_cascades() を参照）
+        self._cascades = None
+
+        # 縮小デコード時の補正係数（縮小率ごと）
+        # 縮小するとLaplacian分散と標準偏差が変わるため、原寸相当の値に換算してから同じ閾値で評価する
+        # 値は `parity.py --fit-gains` で、parity.py の既定の合成写真36枚（1024x768・2048x1536・4032x3024 各12枚）
+        # を原寸と各縮小率で評価して求めたもの。シャープさは補正後のスコアと原寸のスコアの差（絶対値）の平均が
+        # 最小になる係数、コントラストは標準偏差の比の中央値
+        # 細かな質感の多い写真は縮小でLaplacian分散が小さくなり、ぼけた写真は大きくなるため、1つの係数では合わせきれない
+        self.sharpness_scale_gain = {1: 1.0, 2: 0.397, 4: 0.301, 8: 0.542}
+        self.contrast_scale_gain = {1: 1.0, 2: 0.999, 4: 0.994, 8: 0.986}
+        # 上の係数で補正したときの総合スコアの誤差の目安（原寸との差の絶対値のp95。同じ計測で求めた値）
+        # 縮小すると目・笑顔の検出結果も変わるため、シャープさを補正しても誤差は残る
+        self.scale_score_error = {1: 0.0, 2: 16.4, 4: 19.4, 8: 24.3}
+
+        # 顔検出の解像度
+        # 面積比1%未満の顔は構図・顔サイズのスコアが一定になるため、原寸で細かく探す必要はない
+        # 余裕をみて面積比0.1%の顔が最小サイズ（30px）になる段まで縮小して検出する
+        self.min_face_ratio = 0.001
+        self.face_min_size = 30
+        # 目・笑顔の検出では、顔の幅がこのピクセル数を下回らない段まで縮小する
+        self.face_roi_width = 300
+        # 上位K枚の選定で顔検出を省けるかの事前確認では、面積比1%以上の顔だけを粗い段で探す
+        # それより小さい顔の顔サイズは30点、構図は位置（最大100点）と大きさ（30点）の平均が上限になる
+        self.precheck_face_ratio = 0.01
+        self.small_face_scores = {'face_score': 30, 'composition': (100 + 30) / 2}
+
+    # ------------------------------------------------------------
+    # 計測（画像から生の値を求める）
+    # ------------------------------------------------------------
+
+    @property
+    def cascades(self) -> dict:
+        if self._cascades is None:
+            self._cascades = load_cascades()
+        return self._cascades
+
+    @property
+    def face_cascade(self) -> cv2.CascadeClassifier:
+        return self.cascades['face']
+
+    @property
+    def eye_cascade(self) -> cv2.CascadeClassifier:
+        return self.cascades['eye']
+
+    @property
+    def smile_cascade(self) -> cv2.CascadeClassifier:
+        return self.cascades['smile']
+
+    def measure_sharpness(self, image: Union[np.ndarray, AnalysisContext]) -> float:
+        """Laplacian分散（原寸相当に換算した値）"""
+        ctx = AnalysisContext.of(image)
+        return float(ctx.laplacian_var / self.scale_gain(self.sharpness_scale_gain, ctx.scale))
+
+    def measure_exposure(self, image: Union[np.ndarray, AnalysisContext]) -> List[float]:
+        """輝度ヒストグラムの [暗部の割合, 明部の割合, 中間調の割合]"""
+        hist = AnalysisContext.of(image).hist
 
-        # OpenCVの顔検出器（Haar Cascade）
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
-        self.eye_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_eye.xml'
-        )
-        self.smile_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_smile.xml'
-        )
+        dark_ratio = hist[:20].sum()  # 暗すぎるピクセルの割合
+        bright_ratio = hist[235:].sum()  # 明るすぎるピクセルの割合
+        mid_ratio = hist[50:200].sum()  # 中間調の分布
+
+        return [float(dark_ratio), float(bright_ratio), float(mid_ratio)]
+
+    def measure_contrast(self, image: Union[np.ndarray, AnalysisContext]) -> float:
+        """輝度の標準偏差（原寸相当に換算した値）"""
+        ctx = AnalysisContext.of(image)
+        return ctx.std / self.scale_gain(self.contrast_scale_gain, ctx.scale)
+
+    @staticmethod
+    def scale_gain(gains: dict, scale: float) -> float:
+        """縮小率に対する補正値（1/2/4/8 の間の縮小率（埋め込みプレビュー）は対数で補間）"""
+        if scale in gains:
+            return gains[scale]
+        points = sorted(gains)
+        if scale <= points[0]:
+            return gains[points[0]]
+        if scale >= points[-1]:
+            return gains[points[-1]]
+        for low, high in zip(points, points[1:]):
+            if low <= scale <= high:
+                t = math.log(scale / low) / math.log(high / low)
+                return math.exp(math.log(gains[low]) + t * (math.log(gains[high]) - math.log(gains[low])))
+
+    def score_error(self, scale: float) -> float:
+        """縮小率に対する総合スコアの誤差の目安（scale_score_error を縮小率の対数で補間）"""
+        errors = self.scale_score_error
+        points = sorted(errors)
+        if scale <= points[0]:
+            return errors[points[0]]
+        if scale >= points[-1]:
+            return errors[points[-1]]
+        for low, high in zip(points, points[1:]):
+            if low <= scale <= high:
+                t = math.log(scale / low) / math.log(high / low)
+                return errors[low] + t * (errors[high] - errors[low])
+
+    # ------------------------------------------------------------
+    # スコア化（計測値を0-100のスコアに変換）
+    # ------------------------------------------------------------
+
+    # 各項目の計算は NumPy の配列演算で書き、1枚分の値でも全写真の配列でも同じ式で計算する
+    # （rescore.py は保存済みの計測値を配列にまとめて、同じメソッドで再採点する）
+
+    @staticmethod
+    def _as_score(values: np.ndarray) -> Union[float, np.ndarray]:
+        """1枚分（0次元の配列）は float に、全写真分は配列のまま返す"""
+        return float(values) if values.ndim == 0 else values
+
+    @classmethod
+    def sharpness_score(cls, laplacian_var: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Laplacian分散値を0-100にスケーリング"""
+        # 経験則: 100以下はブレ、500以上はシャープ
+        lv = np.asarray(laplacian_var, dtype=np.float64)
+        score = np.where(lv < 100, (lv / 100) * 30,
+                         np.where(lv < 500, 30 + ((lv - 100) / 400) * 50,
+                                  np.minimum(100, 80 + ((lv - 500) / 500) * 20)))
+        return cls._as_score(score)
 
-    def evaluate_sharpness(self, image: np.ndarray) -> float:
-        """
-        シャープさを評価（Laplacian分散）
-        Returns: 0-100のスコア
-        """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    @classmethod
+    def exposure_score(cls, ratios: Union[List[float], np.ndarray]) -> Union[float, np.ndarray]:
+        """ヒストグラムの割合（[暗部, 明部, 中間調]、全写真分なら (枚数, 3) の配列）から露出スコアを計算"""
+        ratios = np.asarray(ratios, dtype=np.float64)
+        dark_ratio, bright_ratio, mid_ratio = ratios[..., 0], ratios[..., 1], ratios[..., 2]
 
-        # Laplacian分散値を0-100にスケーリング
-        # 経験則: 100以下はブレ、500以上はシャープ
-        if laplacian_var < 100:
-            return (laplacian_var / 100) * 30
-        elif laplacian_var < 500:
-            return 30 + ((laplacian_var - 100) / 400) * 50
-        else:
-            return min(100, 80 + ((laplacian_var - 500) / 500) * 20)
+        score = np.full(dark_ratio.shape, 100.0)
+
+        # 白飛びペナルティ
+        score -= np.where(bright_ratio > 0.1, np.minimum(40, (bright_ratio - 0.1) * 200), 0)
 
-    def evaluate_exposure(self, image: np.ndarray) -> float:
+        # 黒つぶれペナルティ
+        score -= np.where(dark_ratio > 0.1, np.minimum(40, (dark_ratio - 0.1) * 200), 0)
+
+        # 中間調が少ないとペナルティ
+        score -= np.where(mid_ratio < 0.5, (0.5 - mid_ratio) * 40, 0)
+
+        return cls._as_score(np.maximum(0, score))
+
+    @classmethod
+    def contrast_score(cls, contrast: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """標準偏差からコントラストスコアを計算"""
+        # 標準偏差が40-80程度が理想的（高すぎる場合は少し減点）
+        std = np.asarray(contrast, dtype=np.float64)
+        score = np.where(std < 20, (std / 20) * 40,
+                         np.where(std < 40, 40 + ((std - 20) / 20) * 30,
+                                  np.where(std < 80, 70 + ((std - 40) / 40) * 30,
+                                           np.maximum(70, 100 - ((std - 80) / 40) * 20))))
+        return cls._as_score(score)
+
+    @staticmethod
+    def eye_points(eye_counts: np.ndarray) -> np.ndarray:
+        """顔ごとの目の開閉の点数（両目検出100、片目のみ60、検出されない（閉じている可能性）20）"""
+        eye_counts = np.asarray(eye_counts)
+        return np.where(eye_counts >= 2, 100.0, np.where(eye_counts == 1, 60.0, 20.0))
+
+    @staticmethod
+    def smile_points(smiles: np.ndarray) -> np.ndarray:
+        """顔ごとの笑顔の点数（笑顔100、笑顔でなくても悪くはないので40）"""
+        return np.where(np.asarray(smiles, dtype=bool), 100.0, 40.0)
+
+    @staticmethod
+    def composition_points(faces: np.ndarray, width: np.ndarray, height: np.ndarray) -> np.ndarray:
         """
-        露出を評価（ヒストグラム分析）
-        Returns: 0-100のスコア
+        顔ごとの構図の点数（位置とサイズの平均）
+        faces: (顔の数, 4) の配列 [x, y, w, h]、width・height: 顔ごと（または共通）の画像の大きさ
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
-        hist = hist.flatten() / hist.sum()
+        faces = np.asarray(faces, dtype=np.float64).reshape(-1, 4)
+        x, y, w, h = faces[:, 0], faces[:, 1], faces[:, 2], faces[:, 3]
+
+        # 位置スコア: 中央または三分割点（1/3, 1/2, 2/3）に近いほど高スコア
+        positions = np.array([1/3, 1/2, 2/3])
+        min_x_dist = np.abs(((x + w / 2) / width)[:, None] - positions).min(axis=1)
+        min_y_dist = np.abs(((y + h / 2) / height)[:, None] - positions).min(axis=1)
+        position_score = np.clip(100 - (min_x_dist + min_y_dist) * 200, 0, 100)
+
+        # サイズスコア: 顔が画像の5-30%程度が理想（1%未満は小さすぎ、30%以上は大きすぎ）
+        face_ratio = (w * h) / (height * width)
+        size_score = np.where(
+            face_ratio < 0.01, 30,
+            np.where(face_ratio < 0.05, 50 + (face_ratio - 0.01) / 0.04 * 30,
+                     np.where(face_ratio < 0.30, 80 + (face_ratio - 0.05) / 0.25 * 20,
+                              np.maximum(60, 100 - (face_ratio - 0.30) * 100)))
+        )
+        return (position_score + size_score) / 2
+
+    @staticmethod
+    def face_size_points(max_face_ratio: np.ndarray) -> np.ndarray:
+        """最も大きい顔の面積比から顔サイズの点数を計算（顔が画像の3-25%程度が理想）"""
+        ratio = np.asarray(max_face_ratio, dtype=np.float64)
+        return np.where(
+            ratio < 0.01, 30,
+            np.where(ratio < 0.03, 30 + (ratio - 0.01) / 0.02 * 30,
+                     np.where(ratio < 0.25, 60 + (ratio - 0.03) / 0.22 * 40,
+                              np.maximum(50, 100 - (ratio - 0.25) * 100)))
+        )
 
-        # 白飛び・黒つぶれの検出
-        dark_ratio = hist[:20].sum()  # 暗すぎるピクセルの割合
-        bright_ratio = hist[235:].sum()  # 明るすぎるピクセルの割合
+    @classmethod
+    def eyes_open_score(cls, eye_counts: List[int]) -> float:
+        """顔ごとの目の検出数から目の開閉スコアを計算"""
+        if not len(eye_counts):
+            return 50  # 顔がない場合は中間値
+        return float(cls.eye_points(eye_counts).mean())
 
-        # 中間調の分布
-        mid_ratio = hist[50:200].sum()
+    @classmethod
+    def smile_score(cls, smiles: List[bool]) -> float:
+        """顔ごとの笑顔検出結果から笑顔スコアを計算"""
+        if not len(smiles):
+            return 50  # 顔がない場合は中間値
+        return float(cls.smile_points(smiles).mean())
 
-        score = 100
+    @classmethod
+    def composition_score(cls, faces: List[Tuple[int, int, int, int]], width: int, height: int) -> float:
+        """顔の位置とサイズから構図スコアを計算"""
+        if not len(faces):
+            return 50  # 顔がない場合は中間値
+        return float(cls.composition_points(faces, width, height).mean())
 
-        # 白飛びペナルティ
-        if bright_ratio > 0.1:
-            score -= min(40, (bright_ratio - 0.1) * 200)
+    @classmethod
+    def face_size_score(cls, faces: List[Tuple[int, int, int, int]], width: int, height: int) -> float:
+        """最も大きい顔の面積比から顔サイズスコアを計算"""
+        if not len(faces):
+            return 0  # 顔がない
+        faces = np.asarray(faces, dtype=np.float64).reshape(-1, 4)
+        max_face_ratio = (faces[:, 2] * faces[:, 3]).max() / (height * width)
+        return float(cls.face_size_points(max_face_ratio))
 
-        # 黒つぶれペナルティ
-        if dark_ratio > 0.1:
-            score -= min(40, (dark_ratio - 0.1) * 200)
+    @classmethod
+    def face_component_scores(cls, faces: np.ndarray, frames: np.ndarray, eyes: np.ndarray,
+                              smiles: np.ndarray, face_counts: np.ndarray) -> dict:
+        """
+        顔まわりの項目のスコアを全写真まとめて計算（顔のない写真は0点）
+        faces: 全写真の顔を順に並べた (顔の数, 4) の配列、frames: 写真ごとの (幅, 高さ)、
+        eyes・smiles: 顔ごとの目の検出数・笑顔の判定、face_counts: 写真ごとの顔の数
+        Returns: {'face_score', 'eyes_open', 'smile', 'composition'}（写真ごとの配列）
+        """
+        n = len(face_counts)
+        owner = np.repeat(np.arange(n), face_counts)
+        per_photo = np.maximum(face_counts, 1)
+        width, height = frames[owner, 0], frames[owner, 1]
+
+        def mean(points: np.ndarray) -> np.ndarray:
+            return np.bincount(owner, weights=points, minlength=n) / per_photo
+
+        max_face_ratio = np.zeros(n)
+        np.maximum.at(max_face_ratio, owner, (faces[:, 2] * faces[:, 3]) / (width * height))
+        return {
+            'face_score': np.where(face_counts > 0, cls.face_size_points(max_face_ratio), 0),
+            'eyes_open': mean(cls.eye_points(eyes)),
+            'smile': mean(cls.smile_points(smiles)),
+            'composition': mean(cls.composition_points(faces, width, height)),
+        }
 
-        # 中間調が少ないとペナルティ
-        if mid_ratio < 0.5:
-            score -= (0.5 - mid_ratio) * 40
+    def score_features(self, features: dict) -> dict:
+        """
+        計測値（measure_* や detect_* の結果）から各項目のスコアを計算
+        Returns: {'sharpness', 'exposure', 'contrast', 'face_score', 'eyes_open', 'smile', 'composition'}
+        """
+        width, height = features['frame']
+        faces = features['faces']
+        scores = {
+            'sharpness': self.sharpness_score(features['sharpness']),
+            'exposure': self.exposure_score(features['exposure']),
+            'contrast': self.contrast_score(features['contrast']),
+            'face_score': 0,
+            'eyes_open': 0,
+            'smile': 0,
+            'composition': 0,
+        }
+        if faces:
+            scores['face_score'] = self.face_size_score(faces, width, height)
+            scores['eyes_open'] = self.eyes_open_score(features['eyes'])
+            scores['smile'] = self.smile_score(features['smiles'])
+            scores['composition'] = self.composition_score(faces, width, height)
+        return scores
+
+    # ------------------------------------------------------------
+    # 評価（計測 + スコア化）
+    # ------------------------------------------------------------
+
+    def evaluate_sharpness(self, image: Union[np.ndarray, AnalysisContext]) -> float:
+        """
+        シャープさを評価（Laplacian分散）
+        Returns: 0-100のスコア
+        """
+        return self.sharpness_score(self.measure_sharpness(image))
 
-        return max(0, score)
+    def evaluate_exposure(self, image: Union[np.ndarray, AnalysisContext]) -> float:
+        """
+        露出を評価（ヒストグラム分析）
+        Returns: 0-100のスコア
+        """
+        return self.exposure_score(self.measure_exposure(image))
 
-    def evaluate_contrast(self, image: np.ndarray) -> float:
+    def evaluate_contrast(self, image: Union[np.ndarray, AnalysisContext]) -> float:
         """
         コントラストを評価
         Returns: 0-100のスコア
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        contrast = gray.std()
-
-        # 標準偏差が40-80程度が理想的
-        if contrast < 20:
-            return (contrast / 20) * 40
-        elif contrast < 40:
-            return 40 + ((contrast - 20) / 20) * 30
-        elif contrast < 80:
-            return 70 + ((contrast - 40) / 40) * 30
-        else:
-            # コントラストが高すぎる場合は少し減点
-            return max(70, 100 - ((contrast - 80) / 40) * 20)
+        return self.contrast_score(self.measure_contrast(image))
 
-    def detect_faces(self, image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    def detect_faces(self, image: Union[np.ndarray, AnalysisContext],
+                     min_face_ratio: Optional[float] = None) -> List[Tuple[int, int, int, int]]:
         """
         顔を検出（OpenCV Haar Cascade使用）
+        min_face_ratio: 探す顔の最小の面積比（省略時は self.min_face_ratio）
         Returns: 顔の位置リスト [(x, y, w, h), ...]
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        ctx = AnalysisContext.of(image)
 
-        # 顔検出
+        # 縮小画像で検出し、座標を元の解像度に戻す
+        level = self.face_detection_level(ctx.width, ctx.height, min_face_ratio)
         faces = self.face_cascade.detectMultiScale(
-            gray,
+            ctx.pyramid(level),
             scaleFactor=1.1,
             minNeighbors=5,
-            minSize=(30, 30)
+            minSize=(self.face_min_size, self.face_min_size)
         )
 
-        return list(faces) if len(faces) > 0 else []
+        return [tuple(int(v) << level for v in face) for face in faces]
 
-    def detect_eyes_in_face(self, image: np.ndarray, face: Tuple[int, int, int, int]) -> int:
+    def face_detection_level(self, width: int, height: int, min_face_ratio: Optional[float] = None) -> int:
+        """
+        顔検出に使う縮小画像の段（1/2^level）
+        面積比 min_face_ratio（省略時は self.min_face_ratio）の顔が face_min_size を下回らない範囲で最も小さくする
+        """
+        if min_face_ratio is None:
+            min_face_ratio = self.min_face_ratio
+        min_face = (min_face_ratio * width * height) ** 0.5
+        level = 0
+        while min_face / (2 ** (level + 1)) >= self.face_min_size:
+            level += 1
+        return level
+
+    def face_roi_level(self, face: Tuple[int, int, int, int]) -> int:
+        """目・笑顔の検出に使う縮小画像の段（顔の幅が face_roi_width を下回らない範囲）"""
+        level = 0
+        while face[2] / (2 ** (level + 1)) >= self.face_roi_width:
+            level += 1
+        return level
+
+    def detect_eyes_in_face(self, image: Union[np.ndarray, AnalysisContext], face: Tuple[int, int, int, int]) -> int:
         """
         顔領域内の目を検出
         Returns: 検出された目の数
         """
-        x, y, w, h = face
-        roi_gray = cv2.cvtColor(image[y:y+h, x:x+w], cv2.COLOR_BGR2GRAY)
+        # 大きな顔は縮小画像から切り出す
+        roi_gray = AnalysisContext.of(image).face_roi(face, self.face_roi_level(face))
+        h = roi_gray.shape[0]
 
         # 上半分のみで目を検出（顔の上半分に目がある）
         roi_upper = roi_gray[0:int(h*0.6), :]
@@ -142,13 +601,14 @@ class PhotoEvaluator:
 
         return len(eyes)
 
-    def detect_smile_in_face(self, image: np.ndarray, face: Tuple[int, int, int, int]) -> bool:
+    def detect_smile_in_face(self, image: Union[np.ndarray, AnalysisContext], face: Tuple[int, int, int, int]) -> bool:
         """
         顔領域内の笑顔を検出
         Returns: 笑顔が検出されたかどうか
         """
-        x, y, w, h = face
-        roi_gray = cv2.cvtColor(image[y:y+h, x:x+w], cv2.COLOR_BGR2GRAY)
+        # 大きな顔は縮小画像から切り出す
+        roi_gray = AnalysisContext.of(image).face_roi(face, self.face_roi_level(face))
+        h = roi_gray.shape[0]
 
         # 下半分で笑顔を検出（口は顔の下半分にある）
         roi_lower = roi_gray[int(h*0.5):, :]
@@ -162,128 +622,121 @@ class PhotoEvaluator:
 
         return len(smiles) > 0
 
-    def evaluate_eyes_open(self, image: np.ndarray, faces: List[Tuple[int, int, int, int]]) -> float:
+    def evaluate_eyes_open(self, image: Union[np.ndarray, AnalysisContext], faces: List[Tuple[int, int, int, int]]) -> float:
         """
         目が開いているかを評価
         Returns: 0-100のスコア
         """
-        if not faces:
-            return 50  # 顔がない場合は中間値
-
-        total_score = 0
-        for face in faces:
-            eyes_count = self.detect_eyes_in_face(image, face)
+        ctx = AnalysisContext.of(image)
+        return self.eyes_open_score([self.detect_eyes_in_face(ctx, face) for face in faces])
 
-            if eyes_count >= 2:
-                total_score += 100  # 両目検出
-            elif eyes_count == 1:
-                total_score += 60   # 片目のみ
-            else:
-                total_score += 20   # 目が検出されない（閉じている可能性）
-
-        return total_score / len(faces)
-
-    def evaluate_smile(self, image: np.ndarray, faces: List[Tuple[int, int, int, int]]) -> float:
+    def evaluate_smile(self, image: Union[np.ndarray, AnalysisContext], faces: List[Tuple[int, int, int, int]]) -> float:
         """
         笑顔度を評価
         Returns: 0-100のスコア
         """
-        if not faces:
-            return 50  # 顔がない場合は中間値
+        ctx = AnalysisContext.of(image)
+        return self.smile_score([self.detect_smile_in_face(ctx, face) for face in faces])
 
-        total_score = 0
-        for face in faces:
-            if self.detect_smile_in_face(image, face):
-                total_score += 100
-            else:
-                total_score += 40  # 笑顔でなくても悪くはない
-
-        return total_score / len(faces)
-
-    def evaluate_face_composition(self, image: np.ndarray, faces: List[Tuple[int, int, int, int]]) -> float:
+    def evaluate_face_composition(self, image: Union[np.ndarray, AnalysisContext], faces: List[Tuple[int, int, int, int]]) -> float:
         """
         顔の構図を評価（位置とサイズ）
         Returns: 0-100のスコア
         """
-        if not faces:
-            return 50  # 顔がない場合は中間値
-
         height, width = image.shape[:2]
-        image_area = height * width
-
-        total_score = 0
-        for (x, y, w, h) in faces:
-            face_center_x = x + w / 2
-            face_center_y = y + h / 2
-            face_area = w * h
-
-            # 位置スコア: 中央または三分割点に近いほど高スコア
-            x_ratio = face_center_x / width
-            y_ratio = face_center_y / height
-
-            # 三分割点（1/3, 2/3）または中央（1/2）に近いか
-            x_positions = [1/3, 1/2, 2/3]
-            y_positions = [1/3, 1/2, 2/3]
-
-            min_x_dist = min(abs(x_ratio - p) for p in x_positions)
-            min_y_dist = min(abs(y_ratio - p) for p in y_positions)
-
-            position_score = 100 - (min_x_dist + min_y_dist) * 200
-            position_score = max(0, min(100, position_score))
-
-            # サイズスコア: 顔が画像の5-30%程度が理想
-            face_ratio = face_area / image_area
-            if face_ratio < 0.01:
-                size_score = 30  # 顔が小さすぎる
-            elif face_ratio < 0.05:
-                size_score = 50 + (face_ratio - 0.01) / 0.04 * 30
-            elif face_ratio < 0.30:
-                size_score = 80 + (face_ratio - 0.05) / 0.25 * 20
-            else:
-                size_score = max(60, 100 - (face_ratio - 0.30) * 100)  # 顔が大きすぎる
-
-            total_score += (position_score + size_score) / 2
-
-        return total_score / len(faces)
+        return self.composition_score(faces, width, height)
 
-    def evaluate_face_size(self, image: np.ndarray, faces: List[Tuple[int, int, int, int]]) -> float:
+    def evaluate_face_size(self, image: Union[np.ndarray, AnalysisContext], faces: List[Tuple[int, int, int, int]]) -> float:
         """
         顔のサイズが適切かを評価
         Returns: 0-100のスコア
         """
-        if not faces:
-            return 0  # 顔がない
-
         height, width = image.shape[:2]
-        image_area = height * width
-
-        max_face_ratio = 0
-        for (x, y, w, h) in faces:
-            face_area = w * h
-            face_ratio = face_area / image_area
-            max_face_ratio = max(max_face_ratio, face_ratio)
-
-        # 顔が画像の3-25%程度が理想
-        if max_face_ratio < 0.01:
-            return 30
-        elif max_face_ratio < 0.03:
-            return 30 + (max_face_ratio - 0.01) / 0.02 * 30
-        elif max_face_ratio < 0.25:
-            return 60 + (max_face_ratio - 0.03) / 0.22 * 40
-        else:
-            return max(50, 100 - (max_face_ratio - 0.25) * 100)
+        return self.face_size_score(faces, width, height)
 
 
 class PhotoSelector:
     """写真を選定・分類するメインクラス"""
 
-    def __init__(self, input_dir: str, output_dir: str, batch_size: int = 500):
+    # 7段階の分類フォルダ（上位から順に）
+    categories = [
+        '1_最高', '2_とても良い', '3_良い', '4_普通', '5_やや悪い', '6_悪い', '7_非常に悪い'
+    ]
+    # 縮小して評価した写真の総合スコアの誤差の目安がこれを超える場合は、実行の最後に警告する（分類の幅10点の半分）
+    score_error_tolerance = 5.0
+
+    def __init__(self, input_dir: str, output_dir: str, batch_size: int = 500,
+                 workers: int = 1, analysis_size: int = 0, use_hash: bool = False,
+                 scoring_config: Optional[str] = None, dedupe: Optional[str] = None,
+                 dedupe_distance: int = 6, burst_window: float = 10.0,
+                 output_mode: str = 'copy', results_stream: Optional[IO[str]] = None,
+                 readers: int = 2, writers: int = 2, queue_depth: int = 8,
+                 coarse_size: int = 0, refine_margin: Optional[float] = None, top_k: int = 0,
+                 jpeg_preview: bool = False, identical: Optional[str] = None, job: bool = False,
+                 memory_limit: int = 0, tile_threads: int = 1, profile: bool = False,
+                 thumbnail_size: int = 0, thumbnail_dir: Optional[str] = None,
+                 thumbnail_limit: int = THUMBNAIL_LIMIT_MB):
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.batch_size = batch_size
+        self.workers = max(1, workers)
+        # 解析解像度（長辺のピクセル数、0 = 原寸カラーで読み込み）
+        self.analysis_size = analysis_size
+        # 2段階評価（0 = しない）: まず coarse_size の低解像度で全写真を採点し、
+        # 分類の境目から refine_margin 点以内の写真だけを analysis_size で評価し直す
+        # refine_margin が None の場合は、1回目の縮小率に対する総合スコアの誤差（p95、parity.py で計測）を幅にする
+        self.coarse_size = coarse_size
+        self.refine_margin = refine_margin
+        # 上位K枚だけを選ぶ（0 = すべて分類）
+        self.top_k = top_k
+        # JPEGも解析解像度以上の埋め込みプレビューがあればそれで評価する（RAWは常にプレビューを使う）
+        self.jpeg_preview = jpeg_preview
+        # 1枚の解析に使うメモリの上限（MB、0 = 上限なし）。超える画像は縮小デコードし、統計は帯ごとに計算する
+        self.memory_limit = memory_limit
+        # 帯ごとの統計を並列に計算するスレッド数（1 = 順番に計算）
+        self.tile_threads = max(1, tile_threads)
+        self._strip_pool = None
+        # 内容がまったく同じファイルの扱い（None = 別々に評価、'link' = 代表へのハードリンク、'list' = CSVに記録のみ）
+        self.identical = identical
+        self.identical_index: Optional[IdenticalFileIndex] = None
+        self._in_flight = set()  # 評価・出力が終わっていない代表ファイル
+        self._awaiting = {}      # 代表ファイル -> 代表の出力を待っている同一ファイル
+        # 代表が出力されなかった（上位K枚に入らなかった等）ため、記録しなかった同一ファイルの数
+        self.identical_skipped = 0
         self.evaluator = PhotoEvaluator()
-        self.processed_file = self.output_dir / '.processed.txt'
-        self.results = []
+        # 縮小して評価したため、総合スコアの誤差が score_error_tolerance を超えるおそれのある写真の数と誤差の最大値
+        self.inexact_photos = 0
+        self.max_score_error = 0.0
+        # 2段階評価で評価し直した写真の数と、そのうち1回目と分類が食い違った写真の数
+        self.refined_photos = 0
+        self.coarse_disagreements = 0
+        self.processed_file = self.output_dir / '.processed.txt'  # 旧形式（取り込みのみ）
+        self.cache_file = self.output_dir / '.features.db'
+        self.use_hash = use_hash
+        self._cache = None
+        # 分類フォルダへの出力方法（copy / hardlink / reflink / symlink / move）
+        self.writer = OutputWriter(self.output_dir, self.categories, mode=output_mode)
+        # 評価結果は1枚ごとにNDJSONへ追記し、最後に撮影日時順の results.csv を作る
+        self.results_writer = ResultsWriter(self.output_dir, stream=results_stream)
+        # 読み込み（先読み・デコード）→ 評価 → 出力（コピー等）を並行して動かす
+        # 読み込み・出力のスレッド数が0の場合は、その段階をメインスレッドで順番に行う
+        self.reader = PrefetchReader(self.load_inputs, threads=readers, depth=queue_depth)
+        if self.workers > 1:
+            self.evaluate_stats = StageStats('評価', threads=self.workers, unit='プロセス')
+        else:
+            self.evaluate_stats = StageStats('評価', threads=0)
+        self.output_stage = OutputStage(threads=writers, depth=queue_depth)
+        # ライブラリ全体を batch_size 枚ごとのチェックポイントを挟んで処理するジョブ（中断しても再開できる）
+        self.journal = JobJournal(self.output_dir / '.job.journal') if job else None
+        self._since_checkpoint = 0
+        # 写真ごと・段階ごとの時間計測（--profile）
+        self.profiler = Profiler(enabled=profile)
+        # 評価のためにデコードした画像から作るサムネイル（長辺のピクセル数、0 = 作らない）
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_dir = Path(thumbnail_dir) if thumbnail_dir else self.output_dir / '.thumbnails'
+        self.thumbnails: Optional[ThumbnailCache] = None
+        if thumbnail_size:
+            self.thumbnails = ThumbnailCache(self.thumbnail_dir, size=thumbnail_size, limit_mb=thumbnail_limit)
 
         # 7段階分類の閾値
         self.tier1_threshold = 75  # 最高
@@ -294,50 +747,244 @@ class PhotoSelector:
         self.tier6_threshold = 25  # 悪い
         # 25未満は「非常に悪い」
 
+        # 総合スコアの配点（重み）
+        # 顔あり: シャープさ20点、露出5点、顔サイズ5点、目の開閉15点、笑顔25点、構図30点
+        self.face_weights = {
+            'sharpness': 0.20,
+            'exposure': 0.05,
+            'face_score': 0.05,
+            'eyes_open': 0.15,
+            'smile': 0.25,
+            'composition': 0.30,
+        }
+        # 顔なし: 技術品質のみ
+        self.no_face_weights = {
+            'sharpness': 0.40,
+            'exposure': 0.35,
+            'contrast': 0.25,
+        }
+
+        if scoring_config:
+            self.load_scoring_config(scoring_config)
+
+        # ほぼ同じ写真のグループ化（None = しない、'window' = 連写のみ、'global' = 全写真）
+        self.dedupe = dedupe
+        self.dedupe_distance = dedupe_distance
+        self.burst_window = burst_window
+
+    @property
+    def thresholds(self) -> List[float]:
+        """分類の閾値（tier1〜tier6、降順）"""
+        return [
+            self.tier1_threshold, self.tier2_threshold, self.tier3_threshold,
+            self.tier4_threshold, self.tier5_threshold, self.tier6_threshold,
+        ]
+
+    @thresholds.setter
+    def thresholds(self, values: List[float]):
+        if len(values) != 6:
+            raise ValueError('閾値は6つ指定してください（tier1〜tier6）')
+        if any(a < b for a, b in zip(values, values[1:])):
+            raise ValueError('閾値は大きい順（tier1 ≧ tier2 ≧ … ≧ tier6）に指定してください')
+        (self.tier1_threshold, self.tier2_threshold, self.tier3_threshold,
+         self.tier4_threshold, self.tier5_threshold, self.tier6_threshold) = values
+
+    def load_scoring_config(self, config_path: str):
+        """
+        配点と閾値をJSONファイルから読み込む
+        例: {"face_weights": {"smile": 0.3, ...}, "no_face_weights": {...}, "thresholds": [75, 65, 55, 45, 35, 25]}
+        """
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self.apply_scoring_state(config)
+
+    def scoring_state(self) -> dict:
+        """現在の配点と閾値（load_scoring_config() と同じ形式。ワーカープロセスへの受け渡しに使う）"""
+        return {
+            'face_weights': dict(self.face_weights),
+            'no_face_weights': dict(self.no_face_weights),
+            'thresholds': self.thresholds,
+        }
+
+    def apply_scoring_state(self, config: dict):
+        """配点と閾値を設定（指定のない項目は変更しない）"""
+        for key, weights in (('face_weights', self.face_weights),
+                             ('no_face_weights', self.no_face_weights)):
+            for name, weight in config.get(key, {}).items():
+                if name not in weights:
+                    raise ValueError(f'{key} に不明な項目があります: {name}')
+                weights[name] = float(weight)
+
+        if 'thresholds' in config:
+            self.thresholds = [float(v) for v in config['thresholds']]
+
+    def categorize(self, total_score: float) -> str:
+        """総合スコアから分類（7段階）を決める"""
+        for category, threshold in zip(self.categories, self.thresholds):
+            if total_score >= threshold:
+                return category
+        return self.categories[-1]
+
     def setup_output_dirs(self):
         """出力ディレクトリを作成（7段階）"""
-        (self.output_dir / '1_最高').mkdir(parents=True, exist_ok=True)
-        (self.output_dir / '2_とても良い').mkdir(parents=True, exist_ok=True)
-        (self.output_dir / '3_良い').mkdir(parents=True, exist_ok=True)
-        (self.output_dir / '4_普通').mkdir(parents=True, exist_ok=True)
-        (self.output_dir / '5_やや悪い').mkdir(parents=True, exist_ok=True)
-        (self.output_dir / '6_悪い').mkdir(parents=True, exist_ok=True)
-        (self.output_dir / '7_非常に悪い').mkdir(parents=True, exist_ok=True)
+        for category in self.categories:
+            (self.output_dir / category).mkdir(parents=True, exist_ok=True)
+
+        # 同名ファイルの確認用に、各フォルダのファイル名一覧を1回だけ作る
+        self.writer.build_index()
+
+    def scan_image_files(self, skip_processed: bool = True) -> ImageScanner:
+        """
+        対象の画像ファイルを1回の走査で順に返すスキャナーを作成
+        （処理済みのファイルと、入力フォルダ内にある出力フォルダは走査中に除外）
+        """
+        extensions = IMAGE_EXTENSIONS + RAW_EXTENSIONS
+        if HEIF_SUPPORTED:
+            extensions += HEIF_EXTENSIONS
+        return ImageScanner(
+            self.input_dir,
+            extensions=extensions,
+            skip=self.get_processed_files() if skip_processed else None,
+            exclude_dirs=[self.output_dir],
+            # 処理済みのファイルも、後から見つかる同一ファイルの代表になる
+            on_skip=self.identical_index.add_known if self.identical_index else None
+        )
 
     def get_image_files(self) -> list:
-        """対象の画像ファイルを取得"""
-        extensions = {'.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG'}
-        files = []
-        for ext in extensions:
-            files.extend(self.input_dir.rglob(f'*{ext}'))
-        return sorted(files)
+        """対象の画像ファイルを取得（パス順）"""
+        return list(self.scan_image_files(skip_processed=False))
+
+    @property
+    def cache(self) -> FeatureCache:
+        """特徴量キャッシュ（初回アクセス時に開く。ワーカープロセスでは開かない）"""
+        if self._cache is None:
+            is_new = not self.cache_file.exists()
+            self._cache = FeatureCache(self.cache_file, use_hash=self.use_hash)
+            if is_new:
+                # 旧バージョンの処理済みリストを引き継ぐ
+                self._cache.import_processed_list(self.processed_file)
+        return self._cache
 
     def get_processed_files(self) -> set:
-        """処理済みファイルのセットを取得"""
-        if not self.processed_file.exists():
-            return set()
+        """処理済みファイル（処理後に変更されていないもの）のセットを取得"""
+        return self.cache.processed_files()
+
+    def mark_as_processed(self, file_path: str, result: Optional[dict] = None,
+                          signature: Optional[Tuple[int, int]] = None):
+        """ファイルを処理済みとしてマーク（計測値も一緒に保存）"""
+        if result is None:
+            self.cache.record(file_path, processed=True, signature=signature)
+            return
 
-        with open(self.processed_file, 'r', encoding='utf-8') as f:
-            return set(line.strip() for line in f)
+        # 計測値は評価に使った解析解像度のバージョンで保存する（2段階評価では写真ごとに異なる）
+        versions = self.metric_versions(result.get('analysis_size'))
+        features = result.get('features') or {}
+        self.cache.record(
+            file_path,
+            metrics={name: (versions[name], value) for name, value in features.items()},
+            processed=True,
+            category=result['category'],
+            total_score=result['total_score'],
+            output_path=result.get('output_path'),
+            signature=signature,
+            dup_group=result.get('dup_group'),
+            dup_best=result.get('dup_best')
+        )
+
+    def store_features(self, result: dict):
+        """計測値だけを保存（上位K枚に入らなかった写真。処理済みにはしないため、次回も選定の対象になる）"""
+        features = result.get('features')
+        if not features:
+            return
+        versions = self.metric_versions(result.get('analysis_size'))
+        self.cache.store_metrics(
+            result['file_path'],
+            {name: (versions[name], value) for name, value in features.items()}
+        )
+
+    def flush_processed(self):
+        """出力中の写真の完了を待ち、保留中の処理済み記録を書き込む"""
+        if self.thumbnails is not None:
+            self.thumbnails.flush()
+        if self.journal is not None:
+            # ジョブでは、出力がすべて成功した場合だけチェックポイントで確定する
+            # （失敗した場合は確定せず、次に再開するときに最後のチェックポイント以降の出力を取り消す）
+            self.output_stage.close()
+            self.checkpoint()
+            return
+        try:
+            self.output_stage.close()
+        finally:
+            if self._cache is not None:
+                self._cache.flush()
 
-    def mark_as_processed(self, file_path: str):
-        """ファイルを処理済みとしてマーク"""
-        with open(self.processed_file, 'a', encoding='utf-8') as f:
-            f.write(f'{file_path}\n')
+    def start_job(self) -> int:
+        """
+        ジョブを開始（前回のジョブが途中で止まっていれば、確定していない出力を取り消してから再開）
+        分類フォルダのファイル名一覧を作る前（setup_output_dirs() の前）に呼ぶ
+        Returns: 取り消した出力の数
+        """
+        # 処理済みの記録はチェックポイントでだけコミットする
+        self.cache.commit_interval = 0
+        rolled_back = 0
+        if self.journal.exists():
+            # 結果の途中経過は、最後にコミットした時点のサイズまで戻す
+            spool_size = self.cache.get_state('job_spool_size')
+            if spool_size is not None:
+                self.results_writer.rollback(int(spool_size))
+            for source, destination in self.journal.pending_outputs():
+                entry = self.cache.processed_entry(source)
+                if entry is not None and entry[2] == destination:
+                    # チェックポイントを書く直前に止まった（キャッシュにはコミット済み）
+                    continue
+                self.rollback_output(Path(source), Path(destination))
+                rolled_back += 1
+        self.journal.start()
+        self.checkpoint()
+        return rolled_back
+
+    def rollback_output(self, source: Path, destination: Path):
+        """確定していない出力を取り消す（移動モードで移動済みなら元の場所に戻す）"""
+        if not os.path.lexists(destination):
+            return
+        if self.writer.mode == 'move' and not os.path.lexists(source):
+            shutil.move(str(destination), str(source))
+        else:
+            os.unlink(destination)
 
-    def get_photo_datetime(self, file_path: Path) -> Optional[datetime]:
-        """写真の撮影日時を取得（EXIF優先、なければファイル更新日時）"""
+    def checkpoint(self):
+        """
+        ジョブのチェックポイント
+        出力の完了を待ち、結果の途中経過を fsync してから、そのサイズと処理済みの記録を
+        1回のトランザクションでコミットし、最後にジョブの記録にチェックポイントを書いて fsync する
+        """
+        self.output_stage.drain()
+        self.cache.set_state('job_spool_size', self.results_writer.sync())
+        self.cache.flush(durable=True)
+        self.journal.checkpoint()
+        self._since_checkpoint = 0
+
+    def maybe_checkpoint(self):
+        """batch_size 枚を出力するごとにチェックポイントを書く（ジョブでない場合は何もしない）"""
+        if self.journal is not None and self._since_checkpoint >= (self.batch_size or 500):
+            self.checkpoint()
+
+    def finish_job(self):
+        """ジョブの完了（最後まで処理できた場合だけ呼ぶ）"""
+        if self.journal is not None:
+            self.journal.finish()
+
+    def get_photo_datetime(self, file_path: Path, data: Optional[bytes] = None) -> Optional[datetime]:
+        """
+        写真の撮影日時を取得（EXIF優先、なければファイル更新日時）
+        data: 読み込み済みのファイル内容（省略時はヘッダー部分だけを読む）
+        """
         try:
-            with Image.open(file_path) as img:
-                exif_data = img._getexif()
-                if exif_data:
-                    for tag_id, value in exif_data.items():
-                        tag = TAGS.get(tag_id, tag_id)
-                        if tag == 'DateTimeOriginal' or tag == 'DateTime':
-                            try:
-                                return datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                            except ValueError:
-                                continue
+            if data is None:
+                data = read_file(file_path, limit=HEADER_READ_SIZE)
+            photo_datetime = exif_datetime(data)
+            if photo_datetime:
+                return photo_datetime
         except Exception:
             pass
 
@@ -353,8 +1000,430 @@ class PhotoSelector:
         datetime_prefix = photo_datetime.strftime('%Y%m%d_%H%M%S')
         return f'{datetime_prefix}_{file_path.name}'
 
-    def evaluate_photo(self, file_path: Path) -> dict:
-        """写真を評価してスコアを返す"""
+    def choose_reduction(self, file_path: Path, data: Optional[bytes] = None,
+                         analysis_size: Optional[int] = None) -> int:
+        """
+        解析解像度に合わせた縮小率を決める（1/2/4/8）
+        長辺が analysis_size を下回らない範囲で最大の縮小率を選ぶ
+        """
+        if analysis_size is None:
+            analysis_size = self.analysis_size
+        if not analysis_size:
+            return 1
+
+        size = self.image_dimensions(file_path, data)
+        if size is None:
+            return 1
+        return self.reduction_for(max(size), analysis_size)
+
+    @staticmethod
+    def image_dimensions(file_path: Path, data: Optional[bytes] = None) -> Optional[Tuple[int, int]]:
+        """ヘッダーだけを見て画像サイズ (幅, 高さ) を取得（画素はデコードしない。取得できない場合は None）"""
+        size = image_size(data) if data is not None else None
+        if size is None:
+            try:
+                with Image.open(io.BytesIO(data) if data is not None else file_path) as img:
+                    size = img.size
+            except Exception:
+                return None
+        return size
+
+    @property
+    def memory_budget(self) -> int:
+        """1枚の解析に使うメモリの上限（バイト、0 = 上限なし）"""
+        return self.memory_limit * 1024 * 1024
+
+    def memory_reduction(self, size: Optional[Tuple[int, int]]) -> int:
+        """
+        デコードしたグレースケール画像がメモリ上限の半分に収まる縮小率（1/2/4/8）
+        残りの半分は帯ごとの統計と顔検出用の縮小画像に使う
+        """
+        if not self.memory_limit or size is None:
+            return 1
+        pixels = size[0] * size[1]
+        for reduction in (1, 2, 4):
+            if pixels // (reduction * reduction) <= self.memory_budget // 2:
+                return reduction
+        return 8
+
+    def strip_rows_for(self, image: np.ndarray) -> int:
+        """
+        帯ごとの統計に使う帯の行数（0 = 画像全体を一度に計算）
+        画像全体のLaplacian（64ビット浮動小数点と分散計算の一時領域で1画素16バイト）が
+        メモリ上限の1/4に収まる場合は全体で計算し、収まらない場合は帯（1画素2バイト）をスレッド数分並べて収める
+        """
+        if not self.memory_limit:
+            return 0
+        height, width = image.shape[:2]
+        budget = self.memory_budget // 4
+        if width * height * 16 <= budget:
+            return 0
+        return min(height, max(1, budget // (width * 2 * self.tile_threads)))
+
+    @property
+    def strip_pool(self) -> Optional[ThreadPoolExecutor]:
+        """帯ごとの統計を並列に計算するスレッドプール（tile_threads が1なら None）"""
+        if self.tile_threads > 1 and self._strip_pool is None:
+            self._strip_pool = ThreadPoolExecutor(max_workers=self.tile_threads,
+                                                  thread_name_prefix='strip')
+        return self._strip_pool
+
+    @staticmethod
+    def reduction_for(long_side: int, analysis_size: int) -> int:
+        """長辺が analysis_size を下回らない範囲で最大の縮小率（1/2/4/8）"""
+        for reduction in (8, 4, 2):
+            if long_side / reduction >= analysis_size:
+                return reduction
+        return 1
+
+    def decode_source(self, file_path: Path, data: bytes,
+                      analysis_size: Optional[int] = None) -> Tuple[bytes, float]:
+        """
+        デコードに使うバイト列と、その画像の元画像に対する縮小率を決める
+        RAWは最も大きい埋め込みプレビュー（JPEG）を使う。jpeg_preview 指定時は、
+        解析解像度以上の埋め込みプレビューがあるJPEGもプレビューを使う
+        Returns: (バイト列, 縮小率)（プレビューがない場合は (data, 1.0)）
+        """
+        if analysis_size is None:
+            analysis_size = self.analysis_size
+        is_raw = file_path.suffix.lower() in RAW_EXTENSIONS
+        if not is_raw and not (self.jpeg_preview and analysis_size):
+            return data, 1.0
+
+        preview = largest_preview(data, min_long_side=0 if is_raw else analysis_size)
+        if preview is None:
+            return data, 1.0
+        size = source_size(data)
+        ratio = max(size) / preview.long_side if size else 1.0
+        return preview.data, max(1.0, ratio)
+
+    def load_image(self, file_path: Path, data: Optional[bytes] = None,
+                   analysis_size: Optional[int] = None,
+                   source: Optional[Tuple[bytes, float]] = None) -> Optional[AnalysisContext]:
+        """
+        解析用に画像を読み込む
+        data: 読み込み済みのファイル内容（省略時はここで1回だけ読む）
+        analysis_size 指定時はJPEGのDCTスケーリングでグレースケールのまま縮小デコードする
+        （省略時は self.analysis_size）
+        source: decode_source() の結果（省略時はここで決める）
+        """
+        if analysis_size is None:
+            analysis_size = self.analysis_size
+        if data is None:
+            data = read_file(file_path)
+        if source is None:
+            source = self.decode_source(file_path, data, analysis_size)
+        source_data, ratio = source
+        is_raw = file_path.suffix.lower() in RAW_EXTENSIONS
+
+        image = None
+        reduction = 1
+        # プレビューのないRAWはOpenCVで読むと小さなサムネイルになることがあるため、全体をデコードする
+        if not (is_raw and source_data is data):
+            buffer = np.frombuffer(source_data, dtype=np.uint8)
+            # メモリ上限がある場合、カラー（1画素3バイト + グレースケール変換）では収まらない画像は
+            # グレースケールのまま、必要なら縮小してデコードする
+            size = self.image_dimensions(file_path, source_data) if self.memory_limit else None
+            memory_reduction = self.memory_reduction(size)
+            fits_in_color = size is None or size[0] * size[1] * 4 <= self.memory_budget // 2
+            if not analysis_size and fits_in_color:
+                image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            else:
+                reduction = max(self.choose_reduction(file_path, source_data, analysis_size),
+                                memory_reduction)
+                flags = {
+                    1: cv2.IMREAD_GRAYSCALE,
+                    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+                }
+                image = cv2.imdecode(buffer, flags[reduction])
+
+        if image is None:
+            # OpenCVで読めない形式（HEIC・プレビューのないRAW）は全体をデコードして縮小する
+            image = decode_full(data, is_raw)
+            if image is None:
+                return None
+            ratio = 1.0
+            reduction = self.memory_reduction(image.shape[1::-1])
+            if analysis_size:
+                reduction = max(reduction, self.reduction_for(max(image.shape[:2]), analysis_size))
+            if analysis_size or reduction > 1:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                if reduction > 1:
+                    image = cv2.resize(image, (image.shape[1] // reduction, image.shape[0] // reduction),
+                                       interpolation=cv2.INTER_AREA)
+
+        # 元画像に対する縮小率（埋め込みプレビューの縮小分も含める）
+        return AnalysisContext(image, scale=reduction if ratio == 1.0 else ratio * reduction,
+                               strip_rows=self.strip_rows_for(image), strip_pool=self.strip_pool)
+
+    def metric_versions(self, analysis_size: Optional[int] = None) -> dict:
+        """
+        計測値ごとのバージョン文字列
+        解析解像度で値が変わる計測値は、解像度もバージョンに含める
+        """
+        if analysis_size is None:
+            analysis_size = self.analysis_size
+        versions = {}
+        # JPEGの埋め込みプレビューで評価した値は、主画像で評価した値と区別する
+        suffix = 'p' if self.jpeg_preview and analysis_size else ''
+        # メモリ上限を超える画像は縮小デコードするため、上限ごとに区別する
+        if self.memory_limit:
+            suffix += f'm{self.memory_limit}'
+        for name, version in self.evaluator.metric_versions.items():
+            if name == 'datetime':
+                versions[name] = str(version)
+            else:
+                versions[name] = f'{version}@{analysis_size}{suffix}'
+        return versions
+
+    def get_cached_features(self, file_path: Path) -> Optional[dict]:
+        """
+        キャッシュ済みの計測値を取得（どの解像度の値を使うかは評価時に選ぶ）
+        Returns: {計測名: (バージョン, 値)}（ファイル未登録・変更ありの場合は None）
+        """
+        return self.cache.lookup(str(file_path))
+
+    def cached_features(self, cached: Optional[dict], analysis_size: int) -> dict:
+        """キャッシュ済みの計測値のうち、指定の解析解像度のバージョンと一致するものを {計測名: 値} で取得"""
+        if not cached:
+            return {}
+        versions = self.metric_versions(analysis_size)
+        return {
+            name: value
+            for name, (version, value) in cached.items()
+            if versions.get(name) == version
+        }
+
+    def first_pass_size(self, cached: Optional[dict] = None) -> int:
+        """
+        1回目の評価に使う解析解像度
+        2段階評価では低解像度（coarse_size）。ただし詳細評価の計測値がすべてキャッシュ済みならそれを使う
+        """
+        if not self.coarse_size:
+            return self.analysis_size
+        fine = self.cached_features(cached, self.analysis_size)
+        if all(name in fine for name in self.evaluator.metric_versions):
+            return self.analysis_size
+        return self.coarse_size
+
+    def score_upper_bound(self, features: dict, large_faces: Optional[list] = None) -> float:
+        """
+        シャープさ・露出・コントラスト（と事前確認した大きな顔）から求めた総合スコアの上限
+        large_faces: 事前確認で見つかった面積比 precheck_face_ratio 以上の顔（None = 確認していない）
+        確認していない場合は、顔まわりの項目（顔サイズ・目の開閉・笑顔・構図）をすべて満点（100点）とみなす
+        確認した場合は、顔サイズ・構図を見つかった顔（とそれより小さい顔の上限）から求め、目の開閉・笑顔だけを満点とみなす
+        """
+        evaluator = self.evaluator
+        scores = {
+            'sharpness': evaluator.sharpness_score(features['sharpness']),
+            'exposure': evaluator.exposure_score(features['exposure']),
+            'contrast': evaluator.contrast_score(features['contrast']),
+        }
+        if large_faces is not None:
+            # 小さい顔が増えても、顔サイズ（最大の顔）・構図（顔ごとの平均）は次の値を超えない
+            scores.update(evaluator.small_face_scores)
+            if large_faces:
+                width, height = features['frame']
+                scores['face_score'] = max(scores['face_score'],
+                                           evaluator.face_size_score(large_faces, width, height))
+                scores['composition'] = max(scores['composition'],
+                                            evaluator.composition_score(large_faces, width, height))
+        face_total = sum(scores.get(name, 100) * weight for name, weight in self.face_weights.items())
+        no_face_total = sum(scores[name] * weight for name, weight in self.no_face_weights.items())
+        return max(face_total, no_face_total)
+
+    def skip_face_detection(self, file_path: Path, ctx: AnalysisContext, features: dict,
+                            min_score: float) -> bool:
+        """
+        総合スコアの上限が min_score 以下で、顔検出を省けるかどうか
+        顔まわりを満点とみなすと省けない場合は、大きな顔だけを粗い段で探して上限を見積もり直す
+        （見つかった顔は features['large_faces'] に入れる。計測値ではないため、保存する前に取り除くこと）
+        """
+        if self.score_upper_bound(features) <= min_score:
+            return True
+        evaluator = self.evaluator
+        ratio = evaluator.precheck_face_ratio
+        if evaluator.face_detection_level(ctx.width, ctx.height, ratio) == \
+                evaluator.face_detection_level(ctx.width, ctx.height):
+            # 小さい写真は事前確認も通常の検出と同じ段になり、時間の節約にならない
+            return False
+        with self.profiler.stage(file_path, 'face_precheck'):
+            large_faces = [list(face) for face in evaluator.detect_faces(ctx, ratio)]
+        if self.score_upper_bound(features, large_faces) > min_score:
+            return False
+        features['large_faces'] = large_faces
+        return True
+
+    def refine_width(self, scale: Optional[float]) -> float:
+        """
+        2段階評価で評価し直す、分類の境目からの点数の幅
+        scale: 1回目の縮小率（None = キャッシュの計測値を使ったため不明）
+        """
+        if self.refine_margin is not None:
+            return self.refine_margin
+        if not scale:
+            return max(self.evaluator.scale_score_error.values())
+        return self.evaluator.score_error(scale)
+
+    def near_boundary(self, total_score: float, scale: Optional[float] = None) -> bool:
+        """総合スコアが分類の境目から refine_width() 点以内かどうか"""
+        margin = self.refine_width(scale)
+        return any(abs(total_score - threshold) < margin for threshold in self.thresholds)
+
+    def load_inputs(self, file_path: Path, cached: Optional[dict] = None,
+                    analysis_size: Optional[int] = None) -> Optional[tuple]:
+        """
+        計測に必要な入力を読み込む（ファイルの読み込み・撮影日時の取得・画素のデコード）
+        ディスクI/Oとデコードだけを行うため、読み込みスレッドで先読みできる
+        cached: get_cached_features() の結果
+        analysis_size: 解析解像度（省略時は first_pass_size() の解像度）
+        Returns: (計測値, 未計算の計測名, 解析用データ, 解析解像度)（画像を読み込めない場合は None）
+        """
+        if analysis_size is None:
+            analysis_size = self.first_pass_size(cached)
+
+        def pending(size: int) -> Tuple[dict, List[str]]:
+            """指定の解像度で使えるキャッシュ済みの計測値と、未計算の計測名"""
+            features = self.cached_features(cached, size)
+            # 顔の位置が変われば、目と笑顔の検出結果も作り直す
+            if 'faces' not in features:
+                features.pop('eyes', None)
+                features.pop('smiles', None)
+            return features, [name for name in self.evaluator.metric_versions if name not in features]
+
+        features, missing = pending(analysis_size)
+        if not missing:
+            return features, missing, None, analysis_size
+
+        # ファイルは1回だけ読み、撮影日時（EXIF）と画素のデコードで同じバイト列を使う
+        # 撮影日時だけが必要な場合はヘッダー部分だけを読む
+        needs_pixels = any(name != 'datetime' for name in missing)
+        try:
+            with self.profiler.stage(file_path, 'read'):
+                data = read_file(file_path, limit=None if needs_pixels else HEADER_READ_SIZE)
+        except OSError:
+            return None
+
+        # RAWなどは埋め込みプレビューをデコードする（詳細評価の解像度で選べば、低解像度でも足りる）
+        with self.profiler.stage(file_path, 'decode'):
+            source = self.decode_source(file_path, data) if needs_pixels else None
+
+        # 2段階評価: 低解像度でも縮小率が変わらない（小さい）写真は、最初から詳細評価の解像度で計測する
+        if needs_pixels and analysis_size != self.analysis_size and \
+                self.choose_reduction(file_path, source[0], analysis_size) == \
+                self.choose_reduction(file_path, source[0], self.analysis_size):
+            analysis_size = self.analysis_size
+            features, missing = pending(analysis_size)
+            needs_pixels = any(name != 'datetime' for name in missing)
+
+        if 'datetime' in missing:
+            with self.profiler.stage(file_path, 'exif'):
+                photo_datetime = self.get_photo_datetime(file_path, data)
+            features['datetime'] = photo_datetime.isoformat() if photo_datetime else None
+        if not needs_pixels:
+            return features, missing, None, analysis_size
+
+        # 画像デコード（解析用データ（グレースケール等）は1回だけ作成して各評価で共有）
+        with self.profiler.stage(file_path, 'decode'):
+            ctx = self.load_image(file_path, data, analysis_size, source)
+        if ctx is None:
+            return None
+
+        # デコード済みの画像からサムネイルを作る（後で一覧表示などに使うときに元の写真をデコードし直さない）
+        if self.thumbnails is not None:
+            with self.profiler.stage(file_path, 'thumbnail'):
+                self.thumbnails.store(file_path, data, ctx.image)
+        return features, missing, ctx, analysis_size
+
+    def compute_features(self, file_path: Path, cached: Optional[dict] = None,
+                         inputs: Optional[Future] = None,
+                         analysis_size: Optional[int] = None,
+                         min_score: Optional[float] = None) -> Optional[dict]:
+        """
+        写真の計測値を求める（キャッシュ済みの値は再計算しない）
+        inputs: 読み込みスレッドで先読みした load_inputs() の結果（省略時はここで読み込む）
+        analysis_size: 解析解像度（load_inputs() を参照）
+        min_score: 総合スコアの上限がこの点数以下なら、顔・目・笑顔の検出を省く（計測値に 'faces' が入らない）
+        Returns: ({計測名: 値}, 計測に使った解析解像度, 元画像に対する縮小率（デコードしなかった場合は None））
+                 （画像を読み込めない場合は None）
+        """
+        if inputs is not None:
+            loaded = inputs.result()
+        else:
+            loaded = self.load_inputs(file_path, cached, analysis_size)
+        if loaded is None:
+            return None
+        features, missing, ctx, analysis_size = loaded
+        if ctx is None:
+            return features, analysis_size, None
+
+        if 'frame' in missing:
+            features['frame'] = [ctx.width, ctx.height]
+
+        # 基本品質評価
+        profiler = self.profiler
+        if 'sharpness' in missing:
+            with profiler.stage(file_path, 'sharpness'):
+                features['sharpness'] = self.evaluator.measure_sharpness(ctx)
+        if 'exposure' in missing:
+            with profiler.stage(file_path, 'exposure'):
+                features['exposure'] = self.evaluator.measure_exposure(ctx)
+        if 'contrast' in missing:
+            with profiler.stage(file_path, 'contrast'):
+                features['contrast'] = self.evaluator.measure_contrast(ctx)
+
+        # 顔まわりの項目の上限を使っても上位に入れない写真は、検出を省いて打ち切る
+        if 'faces' in missing and min_score is not None and \
+                self.skip_face_detection(file_path, ctx, features, min_score):
+            if 'dhash' in missing:
+                with profiler.stage(file_path, 'dhash'):
+                    features['dhash'] = dhash(ctx.gray)
+            for name in ('eyes', 'smiles'):
+                features.pop(name, None)
+            return features, analysis_size, ctx.scale
+
+        # 顔検出（OpenCV使用）
+        if 'faces' in missing:
+            with profiler.stage(file_path, 'faces'):
+                features['faces'] = [list(face) for face in self.evaluator.detect_faces(ctx)]
+        faces = [tuple(face) for face in features['faces']]
+        if 'eyes' in missing:
+            with profiler.stage(file_path, 'eyes'):
+                features['eyes'] = [self.evaluator.detect_eyes_in_face(ctx, face) for face in faces]
+        if 'smiles' in missing:
+            with profiler.stage(file_path, 'smiles'):
+                features['smiles'] = [self.evaluator.detect_smile_in_face(ctx, face) for face in faces]
+
+        # 重複判定用の知覚ハッシュ
+        if 'dhash' in missing:
+            with profiler.stage(file_path, 'dhash'):
+                features['dhash'] = dhash(ctx.gray)
+
+        return features, analysis_size, ctx.scale
+
+    def score_result(self, result: dict, features: dict):
+        """計測値からスコア・総合スコア・分類を計算してresultに設定"""
+        result['has_face'] = len(features['faces']) > 0
+        result.update(self.evaluator.score_features(features))
+
+        # 総合スコア（100点満点）
+        weights = self.face_weights if result['has_face'] else self.no_face_weights
+        result['total_score'] = sum(result[name] * weight for name, weight in weights.items())
+
+        # カテゴリ分類（7段階）
+        result['category'] = self.categorize(result['total_score'])
+
+    def evaluate_photo(self, file_path: Path, cached: Optional[dict] = None,
+                       inputs: Optional[Future] = None, min_score: Optional[float] = None) -> dict:
+        """
+        写真を評価してスコアを返す
+        cached: get_cached_features() で取得した計測値（あれば再計算を省く）
+        inputs: 先読み済みの入力（compute_features() を参照）
+        min_score: 上位K枚の選定で、これ以下の写真は顔検出を省く（result['pruned'] が True になり、
+                   total_score は上限値になる）
+        """
         result = {
             'file_path': str(file_path),
             'filename': file_path.name,
@@ -368,76 +1437,322 @@ class PhotoSelector:
             'smile': 0,
             'composition': 0,
             'total_score': 0,
-            'category': 'poor'
+            'category': self.categories[-1],
+            'features': None
         }
 
         try:
-            # 画像読み込み
-            image = cv2.imread(str(file_path))
-            if image is None:
+            computed = self.compute_features(file_path, cached, inputs, min_score=min_score)
+            if computed is None:
+                return result
+            features, analysis_size, scale = computed
+
+            # 撮影日時
+            if features['datetime']:
+                result['photo_datetime'] = datetime.fromisoformat(features['datetime'])
+
+            if 'faces' not in features:
+                # 上限スコアで打ち切った（顔検出をしていない）
+                large_faces = features.pop('large_faces', None)
+                result['total_score'] = self.score_upper_bound(features, large_faces)
+                result['pruned'] = True
+                result['face_prechecked'] = large_faces is not None
+                result['features'] = features
+                result['analysis_size'] = analysis_size
+                result['analysis_scale'] = scale
                 return result
 
-            # 撮影日時取得
-            photo_datetime = self.get_photo_datetime(file_path)
-            result['photo_datetime'] = photo_datetime
-
-            # 基本品質評価
-            result['sharpness'] = self.evaluator.evaluate_sharpness(image)
-            result['exposure'] = self.evaluator.evaluate_exposure(image)
-            result['contrast'] = self.evaluator.evaluate_contrast(image)
-
-            # 顔検出（OpenCV使用）
-            faces = self.evaluator.detect_faces(image)
-            result['has_face'] = len(faces) > 0
-
-            if result['has_face']:
-                # 顔あり写真の評価
-                result['face_score'] = self.evaluator.evaluate_face_size(image, faces)
-                result['eyes_open'] = self.evaluator.evaluate_eyes_open(image, faces)
-                result['smile'] = self.evaluator.evaluate_smile(image, faces)
-                result['composition'] = self.evaluator.evaluate_face_composition(image, faces)
-
-                # 顔あり写真のスコア計算（100点満点）
-                # シャープさ20点、露出5点、顔サイズ5点、目の開閉15点、笑顔25点、構図30点
-                result['total_score'] = (
-                    result['sharpness'] * 0.20 +
-                    result['exposure'] * 0.05 +
-                    result['face_score'] * 0.05 +
-                    result['eyes_open'] * 0.15 +
-                    result['smile'] * 0.25 +
-                    result['composition'] * 0.30
-                )
-            else:
-                # 顔なし写真の評価（技術品質のみ）
-                result['total_score'] = (
-                    result['sharpness'] * 0.40 +
-                    result['exposure'] * 0.35 +
-                    result['contrast'] * 0.25
-                )
+            self.score_result(result, features)
 
-            # カテゴリ分類（7段階）
-            if result['total_score'] >= self.tier1_threshold:
-                result['category'] = '1_最高'
-            elif result['total_score'] >= self.tier2_threshold:
-                result['category'] = '2_とても良い'
-            elif result['total_score'] >= self.tier3_threshold:
-                result['category'] = '3_良い'
-            elif result['total_score'] >= self.tier4_threshold:
-                result['category'] = '4_普通'
-            elif result['total_score'] >= self.tier5_threshold:
-                result['category'] = '5_やや悪い'
-            elif result['total_score'] >= self.tier6_threshold:
-                result['category'] = '6_悪い'
-            else:
-                result['category'] = '7_非常に悪い'
+            # 2段階評価: 分類の境目に近い写真だけを詳細な解像度で評価し直す
+            if analysis_size != self.analysis_size and self.near_boundary(result['total_score'], scale):
+                refined = self.compute_features(file_path, cached, analysis_size=self.analysis_size)
+                if refined is not None:
+                    features, analysis_size, scale = refined
+                    result['coarse_total_score'] = result['total_score']
+                    result['coarse_category'] = result['category']
+                    self.score_result(result, features)
+                    result['refined'] = True
+
+            result['features'] = features
+            result['analysis_size'] = analysis_size
+            result['analysis_scale'] = scale
 
         except Exception as e:
             print(f"警告: {file_path} の評価中にエラー: {e}")
 
         return result
 
-    def copy_photo(self, file_path: Path, result: dict):
-        """写真を適切なフォルダにコピー"""
+    def evaluate_photos(self, files: List[Path], min_score: Optional[Callable[[], Optional[float]]] = None):
+        """
+        写真を順番に評価する（workers > 1 の場合は複数プロセスで並列評価）
+        min_score: 評価を始める時点の打ち切り点数を返す関数（evaluate_photo() を参照）
+        Yields: (ファイルパス, 評価結果) を入力と同じ順序で返す
+        """
+        if min_score is None:
+            min_score = lambda: None
+
+        if self.workers <= 1:
+            # 読み込みスレッドが次の写真を先読み・デコードし、メインスレッドは評価だけを行う
+            # キャッシュの参照はメインスレッドで行う（SQLiteの接続はスレッド間で共有しない）
+            evaluate = self.evaluate_stats.timed(self.evaluate_photo)
+            items = ((file_path, self.get_cached_features(file_path)) for file_path in files)
+            for (file_path, cached), inputs in self.reader.map(items):
+                result = evaluate(file_path, cached, inputs, min_score())
+                self.note_analysis_scale(result)
+                self.note_refinement(result)
+                yield file_path, result
+            return
+
+        # 各ワーカーは初期化時に自分用のPhotoSelector（Haar Cascade読込済み）を1つだけ持つ
+        max_pending = self.workers * 4
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(str(self.input_dir), str(self.output_dir), self.analysis_size,
+                      self.scoring_state(), self.coarse_size, self.refine_margin, self.jpeg_preview,
+                      self.memory_limit, self.tile_threads, self.profiler.enabled,
+                      self.thumbnail_size, str(self.thumbnail_dir)),
+        ) as executor:
+            pending = deque()
+            file_iter = iter(files)
+            try:
+                for file_path in file_iter:
+                    # キャッシュはメインプロセスだけが読み書きし、計測値をワーカーに渡す
+                    cached = self.get_cached_features(file_path)
+                    pending.append((file_path, executor.submit(_evaluate_in_worker, file_path, cached, min_score())))
+                    if len(pending) >= max_pending:
+                        yield self._wait_worker(pending)
+
+                while pending:
+                    yield self._wait_worker(pending)
+
+            except BrokenProcessPool:
+                # ワーカーが異常終了した場合、結果を受け取った写真だけを確定させて中断する
+                # 未確定の写真は処理済みにならないため、次回の実行で再評価される
+                # （呼び出し側は finish_job() を呼ばずに失敗として終わる。ジョブの記録は再開に使う）
+                for _, future in pending:
+                    future.cancel()
+                raise
+
+    def _wait_worker(self, pending: deque) -> Tuple[Path, dict]:
+        """最も古いワーカーの評価結果を受け取る（待ち時間を記録）"""
+        file_path, future = pending.popleft()
+        start = time.perf_counter()
+        result = future.result()
+        self.evaluate_stats.wait += time.perf_counter() - start
+        self.evaluate_stats.items += 1
+        # ワーカープロセスで計測した段階ごとの時間を取り込む
+        timings = result.pop('profile', None)
+        if timings:
+            self.profiler.merge(file_path, timings)
+        # ワーカープロセスで作ったサムネイルの索引は、メインプロセスでまとめて書き込む
+        thumbnail_index = result.pop('thumbnail_index', None)
+        if thumbnail_index and self.thumbnails is not None:
+            self.thumbnails.add_pending(thumbnail_index)
+        self.note_analysis_scale(result)
+        self.note_refinement(result)
+        return file_path, result
+
+    def note_analysis_scale(self, result: dict):
+        """縮小して評価した写真のうち、総合スコアの誤差の目安が許容範囲を超えるものを数える"""
+        scale = result.get('analysis_scale')
+        if not scale or scale <= 1:
+            return
+        error = self.evaluator.score_error(scale)
+        if error > self.score_error_tolerance:
+            self.inexact_photos += 1
+            self.max_score_error = max(self.max_score_error, error)
+
+    def note_refinement(self, result: dict):
+        """2段階評価で評価し直した写真と、1回目と分類が食い違った写真を数える"""
+        if not result.get('refined'):
+            return
+        self.refined_photos += 1
+        if result['coarse_category'] != result['category']:
+            self.coarse_disagreements += 1
+
+    def select_top(self, files) -> Tuple[List[dict], int, int, int]:
+        """
+        総合スコアの上位 top_k 枚を選ぶ（最小ヒープでK枚だけを保持）
+        K枚そろった後は、顔まわりの上限を使ってもK位に届かない写真の顔検出を省く（skip_face_detection() を参照）
+        Returns: (上位の評価結果（スコアの高い順）, 評価した枚数, 顔検出を省いた枚数,
+                  そのうち大きな顔の事前確認で省いた枚数)
+        """
+        heap = []  # (総合スコア, -順番, 評価結果)。同点なら先に見つかった写真を残す
+        evaluated_count = 0
+        pruned = 0
+        prechecked = 0
+
+        def min_score() -> Optional[float]:
+            return heap[0][0] if len(heap) >= self.top_k else None
+
+        evaluated = self.evaluate_photos(files, min_score=min_score)
+        for seq, (file_path, result) in enumerate(tqdm(evaluated, desc="評価中")):
+            evaluated_count += 1
+            if result.get('pruned'):
+                pruned += 1
+                prechecked += bool(result.get('face_prechecked'))
+                self.store_features(result)
+                continue
+
+            entry = (result['total_score'], -seq, result)
+            if len(heap) < self.top_k:
+                heapq.heappush(heap, entry)
+                continue
+            dropped = heapq.heappushpop(heap, entry)[2]
+            self.store_features(dropped)
+
+        winners = [result for _, _, result in sorted(heap, reverse=True)]
+        return winners, evaluated_count, pruned, prechecked
+
+    def create_grouper(self) -> Optional[DuplicateGrouper]:
+        """ほぼ同じ写真のグループ化を準備（無効の場合は None）"""
+        if not self.dedupe:
+            return None
+        return DuplicateGrouper(
+            self.categories,
+            mode=self.dedupe,
+            max_distance=self.dedupe_distance,
+            window_seconds=self.burst_window,
+            first_group_id=self.cache.max_dup_group() + 1
+        )
+
+    def finalize_photo(self, result: dict):
+        """
+        評価（とグループ化）が終わった写真を出力し、処理済みとして記録
+        出力は出力スレッドで行い、完了した順（＝呼び出し順）に結果を記録する
+        """
+        file_path = Path(result['file_path'])
+        # 移動モードでは元ファイルがなくなるため、出力前にサイズと更新日時を控えておく
+        signature = FeatureCache.file_signature(file_path)
+        # 出力先の名前は呼び出し順に決める（連番の付き方がスレッドの完了順に左右されない）
+        output_path = self.reserve_output_path(file_path, result)
+        result['output_path'] = str(output_path)
+        if self.journal is not None:
+            # 出力を始める前に出力予定を記録（途中で止まった場合に取り消せるように）
+            self.journal.record_output(file_path, output_path)
+            self._since_checkpoint += 1
+
+        def on_done():
+            with self.profiler.stage(file_path, 'log'):
+                self.results_writer.write(result)
+                self.mark_as_processed(str(file_path), result, signature)
+            # この写真の出力を待っていた同一ファイルを出力
+            self._in_flight.discard(str(file_path))
+            for duplicate in self._awaiting.pop(str(file_path), ()):
+                self.finalize_identical(duplicate, str(file_path))
+
+        self.output_stage.submit(self.profiler.timed(self.writer.write, file_path, 'copy'),
+                                 (file_path, output_path), on_done)
+
+    def sort_by_capture_time(self, files, window: int = MAX_WINDOW):
+        """
+        撮影日時の順に並べ替えながら返す（windowモードのグループ化は、撮影時刻の近い写真だけを比べるため）
+        全体は並べ替えず、window 枚を最小ヒープに先読みし、最も古い写真から順に返す
+        （走査の順で window 枚以上離れた写真どうしは、撮影日時の順にならないことがある）
+        キャッシュ済みの撮影日時があれば使い、なければファイルのヘッダー部分だけを読む
+        """
+        heap = []  # (撮影日時, パス文字列, ファイルパス)
+        for file_path in files:
+            cached = self.get_cached_features(file_path) or {}
+            _, value = cached.get('datetime', (None, None))
+            photo_datetime = datetime.fromisoformat(value) if value else self.get_photo_datetime(file_path)
+            entry = (photo_datetime, str(file_path), file_path)
+            if len(heap) < window:
+                heapq.heappush(heap, entry)
+                continue
+            yield heapq.heappushpop(heap, entry)[2]
+        while heap:
+            yield heapq.heappop(heap)[2]
+
+    def unique_files(self, files):
+        """
+        内容が同じファイルのうち、最初に見つかった代表だけを返す
+        残りは評価せず、代表の出力が終わってから代表と同じ分類で記録する
+        """
+        for file_path in files:
+            canonical = self.identical_index.add(file_path)
+            if canonical is None:
+                self._in_flight.add(str(file_path))
+                yield file_path
+            elif canonical in self._in_flight:
+                self._awaiting.setdefault(canonical, []).append(file_path)
+            else:
+                self.finalize_identical(file_path, canonical)
+
+    def finalize_identical(self, file_path: Path, canonical: str):
+        """
+        代表と内容が同じファイルを、代表の評価結果のまま処理済みとして記録
+        link モードでは代表の出力先へのハードリンクを同じ分類フォルダに作る
+        """
+        entry = self.cache.processed_entry(canonical)
+        if entry is None:
+            # 代表が出力されていない（上位K枚に入らなかった等）場合は、次回の実行で改めて処理する
+            self.identical_skipped += 1
+            return
+        category, total_score, canonical_output = entry
+        # 内容が同じなので、計測値も代表のものをそのまま使える
+        cached = self.cache.lookup(canonical) or {}
+        features = {name: value for name, (_, value) in cached.items()}
+
+        result = {
+            'file_path': str(file_path),
+            'filename': file_path.name,
+            'photo_datetime': None,
+            'category': category,
+            'total_score': total_score,
+            'identical_to': canonical,
+            'output_path': '',
+        }
+        if features.get('datetime'):
+            result['photo_datetime'] = datetime.fromisoformat(features['datetime'])
+        else:
+            result['photo_datetime'] = self.get_photo_datetime(file_path)
+        if all(name in features for name in self.evaluator.metric_versions):
+            result['has_face'] = len(features['faces']) > 0
+            result.update(self.evaluator.score_features(features))
+
+        signature = FeatureCache.file_signature(file_path)
+
+        def on_done():
+            with self.profiler.stage(file_path, 'log'):
+                self.results_writer.write(result)
+                self.cache.record(
+                    str(file_path),
+                    metrics=cached,
+                    processed=True,
+                    category=category,
+                    total_score=total_score,
+                    output_path=result['output_path'] or None,
+                    signature=signature,
+                    identical_to=canonical
+                )
+
+        if self.identical == 'link' and canonical_output and os.path.exists(canonical_output):
+            output_path = self.reserve_output_path(file_path, result)
+            result['output_path'] = str(output_path)
+            if self.journal is not None:
+                self.journal.record_output(file_path, output_path)
+            self.output_stage.submit(self.profiler.timed(self.writer.write, file_path, 'copy'),
+                                     (Path(canonical_output), output_path, 'hardlink'), on_done)
+        else:
+            on_done()
+
+    def drop_awaiting_identical(self):
+        """
+        最後まで代表が出力されなかった（上位K枚に入らなかった等）同一ファイルを、記録せずに数える
+        処理済みにはならないため、次回の実行で改めて処理する
+        """
+        self.identical_skipped += sum(len(files) for files in self._awaiting.values())
+        self._awaiting.clear()
+
+    def unique_output_path(self, category_dir: Path, output_filename: str) -> Path:
+        """出力先のパスを決める（同名ファイルが存在する場合は連番を追加）"""
+        return self.writer.reserve_path(category_dir.name, output_filename)
+
+    def reserve_output_path(self, file_path: Path, result: dict) -> Path:
+        """分類フォルダ内の出力先を決めて予約"""
         category_dir = self.output_dir / result['category']
 
         if result['photo_datetime']:
@@ -447,74 +1762,33 @@ class PhotoSelector:
         else:
             output_filename = file_path.name
 
-        output_path = category_dir / output_filename
-
-        # 同名ファイルが存在する場合は連番を追加
-        counter = 1
-        while output_path.exists():
-            stem = output_path.stem
-            suffix = output_path.suffix
-            output_path = category_dir / f'{stem}_{counter}{suffix}'
-            counter += 1
+        return self.unique_output_path(category_dir, output_filename)
 
-        shutil.copy2(file_path, output_path)
+    def copy_photo(self, file_path: Path, result: dict):
+        """写真を適切なフォルダに出力（出力方法は output_mode で指定）"""
+        output_path = self.reserve_output_path(file_path, result)
+        self.writer.write(file_path, output_path)
         result['output_path'] = str(output_path)
 
-    def save_results_csv(self):
-        """結果をCSVに保存（撮影日時順・日本語ヘッダー）"""
-        if not self.results:
-            return
+    def pipeline_report(self, wall: float) -> List[str]:
+        """読み込み・評価・出力の各段階の使用率（処理した段階のみ）"""
+        return [
+            stats.summary(wall)
+            for stats in (self.reader.stats, self.evaluate_stats, self.output_stage.stats)
+            if stats.items
+        ]
 
-        # 撮影日時でソート
-        sorted_results = sorted(
-            self.results,
-            key=lambda x: x['photo_datetime'] or datetime.min
-        )
+    def evict_thumbnails(self) -> int:
+        """サムネイルのキャッシュが上限を超えていれば古いものを削除（Returns: 削除した数）"""
+        if self.thumbnails is None:
+            return 0
+        return self.thumbnails.evict()
 
+    def save_results_csv(self):
+        """結果をCSVに保存（撮影日時順・日本語ヘッダー）"""
         csv_path = self.output_dir / 'results.csv'
-
-        # 英語キーと日本語ヘッダーのマッピング
-        field_mapping = {
-            'filename': 'ファイル名',
-            'photo_datetime': '撮影日時',
-            'category': '分類',
-            'total_score': '総合スコア',
-            'has_face': '顔検出',
-            'sharpness': 'シャープさ',
-            'exposure': '露出',
-            'contrast': 'コントラスト',
-            'face_score': '顔サイズ',
-            'eyes_open': '目の開閉',
-            'smile': '笑顔',
-            'composition': '構図',
-            'file_path': '元ファイルパス',
-            'output_path': '出力先パス'
-        }
-
-        fieldnames = list(field_mapping.keys())
-        japanese_headers = list(field_mapping.values())
-
-        with open(csv_path, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            # 日本語ヘッダーを書き込み
-            writer.writerow(japanese_headers)
-
-            for result in sorted_results:
-                row = []
-                for key in fieldnames:
-                    value = result.get(key, '')
-                    if key == 'photo_datetime' and value:
-                        value = value.strftime('%Y-%m-%d %H:%M:%S')
-                    elif key == 'has_face':
-                        value = 'あり' if value else 'なし'
-                    elif key in ['total_score', 'sharpness', 'exposure', 'contrast',
-                                'face_score', 'eyes_open', 'smile', 'composition']:
-                        if isinstance(value, float):
-                            value = f'{value:.1f}'
-                    row.append(value)
-                writer.writerow(row)
-
-        print(f"\n結果を保存しました: {csv_path}")
+        if self.results_writer.write_csv(csv_path):
+            print(f"\n結果を保存しました: {csv_path}")
 
     def run(self):
         """メイン処理を実行"""
@@ -522,49 +1796,108 @@ class PhotoSelector:
         print("Photo Selector - 写真自動選定ツール")
         print("=" * 60)
 
+        # ジョブ: 前回止まったところから再開（確定していない出力は取り消す）
+        if self.journal is not None:
+            rolled_back = self.start_job()
+            if rolled_back:
+                print(f"\n前回のジョブを再開します（確定していなかった{rolled_back}枚の出力を取り消しました）")
+
         # 出力ディレクトリ作成
         self.setup_output_dirs()
 
-        # 画像ファイル取得
-        all_files = self.get_image_files()
+        # 画像ファイルを走査しながら評価する（処理済みのファイルは走査中に除外）
         print(f"\n入力フォルダ: {self.input_dir}")
-        print(f"見つかった画像: {len(all_files)}枚")
-
-        if not all_files:
-            print("処理する画像がありません。")
-            return
-
-        # 処理済みファイルを除外
-        processed = self.get_processed_files()
-        files_to_process = [f for f in all_files if str(f) not in processed]
-
-        if len(processed) > 0:
-            print(f"処理済み: {len(processed)}枚（スキップ）")
-        print(f"処理対象: {len(files_to_process)}枚")
-
-        if not files_to_process:
-            print("すべての画像が処理済みです。")
-            return
-
-        # バッチ処理
-        if self.batch_size and len(files_to_process) > self.batch_size:
-            files_to_process = files_to_process[:self.batch_size]
+        if self.identical:
+            # 移動モードでは代表ファイルが入力フォルダからなくなるため、見つけた時点でハッシュ値を計算する
+            self.identical_index = IdenticalFileIndex(eager=self.writer.mode == 'move')
+        scanner = self.scan_image_files()
+        files_to_process = self.profiler.timed_iter(scanner, 'scan')
+        if self.identical_index:
+            files_to_process = self.unique_files(files_to_process)
+
+        # バッチ処理（上位K枚の選定では、すべての写真から選ぶため区切らない）
+        if self.journal is not None:
+            print(f"ジョブ: すべての写真を処理します（{self.batch_size or 500}枚ごとに確定、中断しても再開可能）")
+        elif self.batch_size and not self.top_k:
+            files_to_process = itertools.islice(files_to_process, self.batch_size)
             print(f"バッチサイズ: {self.batch_size}枚ずつ処理")
+        if self.dedupe == 'window' and not self.top_k:
+            # 走査はフォルダ・ファイル名の順のため、撮影時刻の順に並べ替えてから連写を探す
+            # （グループ化のウィンドウと同じ枚数だけ先読みして並べ替える）
+            files_to_process = self.sort_by_capture_time(files_to_process)
 
         # カウンター（7段階）
-        counts = {
-            '1_最高': 0, '2_とても良い': 0, '3_良い': 0, '4_普通': 0,
-            '5_やや悪い': 0, '6_悪い': 0, '7_非常に悪い': 0
-        }
+        counts = {category: 0 for category in self.categories}
 
         # 処理開始
         print("\n処理中...")
-        for file_path in tqdm(files_to_process, desc="評価中"):
-            result = self.evaluate_photo(file_path)
-            self.copy_photo(file_path, result)
-            self.results.append(result)
-            self.mark_as_processed(str(file_path))
-            counts[result['category']] += 1
+        if self.workers > 1:
+            print(f"並列数: {self.workers}プロセス")
+        if self.dedupe:
+            print(f"重複グループ化: {self.dedupe}（距離 {self.dedupe_distance} 以内）")
+        if self.coarse_size:
+            if self.refine_margin is not None:
+                margin = f"{self.refine_margin:g}点"
+            else:
+                margin = "1回目の誤差の目安（縮小率に応じた総合スコアの誤差のp95）"
+            print(f"2段階評価: 長辺{self.coarse_size}pxで採点し、境目から{margin}以内を"
+                  f"{'原寸' if not self.analysis_size else f'長辺{self.analysis_size}px'}で評価し直します")
+        if self.top_k:
+            print(f"上位{self.top_k}枚を選びます（上位に入らない写真は出力しません）")
+        pruned = 0
+        prechecked = 0
+        evaluated_count = 0
+        grouper = self.create_grouper()
+        started = time.perf_counter()
+        try:
+            if self.top_k:
+                winners, evaluated_count, pruned, prechecked = self.select_top(files_to_process)
+                # 上位の写真だけを分類フォルダへ出力（スコアの高い順）
+                for rank, done in enumerate(winners, 1):
+                    done['rank'] = rank
+                    self.finalize_photo(done)
+                    counts[done['category']] += 1
+            else:
+                for file_path, result in tqdm(self.evaluate_photos(files_to_process), desc="評価中"):
+                    if grouper and grouper.mode == 'global':
+                        # 分類が決まるのは最後のため、途中で止まっても評価をやり直さずに済むよう計測値を先に保存
+                        self.store_features(result)
+                    finished = grouper.add(result) if grouper else [result]
+                    for done in finished:
+                        self.finalize_photo(done)
+                        counts[done['category']] += 1
+                    self.maybe_checkpoint()
+
+                if grouper:
+                    for done in grouper.finish():
+                        self.finalize_photo(done)
+                        counts[done['category']] += 1
+        finally:
+            self.flush_processed()
+            self.results_writer.close()
+        self.drop_awaiting_identical()
+        # 結果と処理済みの記録はチェックポイントで確定済みのため、ジョブの記録は不要になる
+        self.finish_job()
+        wall = time.perf_counter() - started
+
+        # バッチサイズで打ち切った場合、走査した範囲までの枚数になる
+        print(f"\n見つかった画像: {scanner.found}枚")
+        if scanner.skipped:
+            print(f"処理済み: {scanner.skipped}枚（スキップ）")
+        if self.identical_index and self.identical_index.duplicates:
+            print(f"同一ファイル: {self.identical_index.duplicates}枚（評価を省き、代表と同じ分類で記録）")
+            if self.identical_skipped:
+                print(f"  うち代表が出力されなかったため記録しなかった写真: {self.identical_skipped}枚"
+                      f"（次回の実行で改めて処理します）")
+
+        if sum(counts.values()) == 0:
+            if scanner.found == 0:
+                print("処理する画像がありません。")
+            else:
+                print("すべての画像が処理済みです。")
+                # 前回中断した分の結果が残っていればCSVにまとめる
+                self.save_results_csv()
+            return
 
         # 結果サマリー
         print("\n" + "=" * 60)
@@ -578,10 +1911,46 @@ class PhotoSelector:
         print(f"  6_悪い（25-34点）:        {counts['6_悪い']}枚")
         print(f"  7_非常に悪い（25点未満）: {counts['7_非常に悪い']}枚")
         print(f"  合計: {sum(counts.values())}枚")
+        if self.coarse_size:
+            print(f"  詳細評価し直した写真: {self.refined_photos}枚 / {sum(counts.values())}枚")
+            if self.refined_photos:
+                rate = self.coarse_disagreements / self.refined_photos * 100
+                print(f"  うち1回目と分類が食い違った写真: {self.coarse_disagreements}枚（{rate:.1f}%）")
+            if self.refined_photos == sum(counts.values()) and self.refine_margin is None:
+                print("  注意: 1回目の誤差が大きいため、すべての写真を評価し直しました"
+                      "（--coarse-size を大きくするか、2段階評価を使わない方が速くなります）")
+        if self.top_k:
+            print(f"  評価した写真: {evaluated_count}枚（うち顔検出を省いた写真: {pruned}枚、"
+                  f"そのうち大きな顔の事前確認で省いた写真: {prechecked}枚）")
+        if self.inexact_photos:
+            print(f"\n警告: {self.inexact_photos}枚は縮小して評価したため、原寸で評価した場合と総合スコアが"
+                  f"最大{self.max_score_error:.0f}点程度（p95）ずれ、分類が変わることがあります"
+                  f"（parity.py で確認できます。正確さを優先する場合は --analysis-size を大きくしてください）")
+
+        # 各段階の使用率（読み込み・出力の使用率が低く、評価の待ちが短ければI/Oは隠れている）
+        print(f"\n処理時間: {wall:.1f}秒")
+        for line in self.pipeline_report(wall):
+            print(f"  {line}")
+
+        # 段階ごとの時間（--profile）
+        if self.profiler.enabled:
+            profile_path = self.output_dir / 'profile.json'
+            print("\n段階ごとの処理時間（1枚あたり）:")
+            for line in self.profiler.report(wall, workers=self.workers > 1):
+                print(f"  {line}" if line else '')
+            self.profiler.save(profile_path, wall)
+            print(f"計測結果を保存しました: {profile_path}")
 
         # CSV出力
         self.save_results_csv()
 
+        if self.thumbnails is not None:
+            evicted = self.evict_thumbnails()
+            print(f"\nサムネイル: {self.thumbnail_dir}" + (f"（上限を超えたため{evicted}枚を削除）" if evicted else ""))
+
+        if self.writer.fallbacks:
+            print(f"\n注意: {self.writer.fallbacks}枚は {self.writer.mode} が使えなかったためコピーしました")
+
         # 出力先表示
         print(f"\n出力先: {self.output_dir}")
         print("  - 1_最高/       : アルバム最優先")
@@ -593,7 +1962,57 @@ class PhotoSelector:
         print("  - 7_非常に悪い/ : 除外")
 
 
+# 並列評価用のワーカー状態（プロセスごとに1つ）
+_worker_selector: Optional[PhotoSelector] = None
+
+
+def _init_worker(input_dir: str, output_dir: str, analysis_size: int = 0,
+                 scoring: Optional[dict] = None, coarse_size: int = 0, refine_margin: Optional[float] = None,
+                 jpeg_preview: bool = False, memory_limit: int = 0, tile_threads: int = 1,
+                 profile: bool = False, thumbnail_size: int = 0, thumbnail_dir: Optional[str] = None):
+    """ワーカープロセスの初期化（Haar Cascadeを1回だけ読み込む）"""
+    global _worker_selector
+    _worker_selector = PhotoSelector(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        analysis_size=analysis_size,
+        coarse_size=coarse_size,
+        refine_margin=refine_margin,
+        jpeg_preview=jpeg_preview,
+        memory_limit=memory_limit,
+        tile_threads=tile_threads,
+        profile=profile,
+        thumbnail_size=thumbnail_size,
+        thumbnail_dir=thumbnail_dir
+    )
+    # サムネイルの索引はワーカーでは書き込まず、評価結果と一緒にメインプロセスへ渡す
+    if _worker_selector.thumbnails is not None:
+        _worker_selector.thumbnails.commit_interval = 0
+    # 最初の写真を待たせないよう、初期化の時点で読み込んでおく
+    load_cascades()
+    # 配点・閾値はメインプロセスと同じものを使う
+    if scoring:
+        _worker_selector.apply_scoring_state(scoring)
+
+
+def _evaluate_in_worker(file_path: Path, cached: Optional[dict] = None,
+                        min_score: Optional[float] = None) -> dict:
+    """ワーカープロセスで写真を1枚評価"""
+    result = _worker_selector.evaluate_photo(file_path, cached, min_score=min_score)
+    if _worker_selector.profiler.enabled:
+        result['profile'] = _worker_selector.profiler.pop(file_path)
+    if _worker_selector.thumbnails is not None:
+        result['thumbnail_index'] = _worker_selector.thumbnails.take_pending()
+    return result
+
+
 def main():
+    # サブコマンド: 保存済みの計測値から再採点・再分類
+    if len(sys.argv) > 1 and sys.argv[1] == 'rescore':
+        from rescore import main as rescore_main
+        rescore_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description='写真を自動評価し、「最高」から「非常に悪い」まで7段階に分類します。'
     )
@@ -613,20 +2032,225 @@ def main():
         default=500,
         help='一度に処理する写真の枚数（デフォルト: 500）'
     )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        default=1,
+        help='並列で評価するプロセス数（デフォルト: 1、CPUコア数まで推奨）'
+    )
+    parser.add_argument(
+        '--analysis-size',
+        type=int,
+        default=0,
+        help='解析解像度（長辺のピクセル数）。指定すると縮小デコードで高速化（例: 1600、デフォルト: 0 = 原寸）'
+    )
+    parser.add_argument(
+        '--hash',
+        action='store_true',
+        help='ファイル内容のハッシュ値も記録し、更新日時だけが変わったファイルを再評価しない'
+    )
+    parser.add_argument(
+        '--config', '-c',
+        help='配点・閾値を書いたJSONファイル（省略時は標準の配点）'
+    )
+    parser.add_argument(
+        '--dedupe',
+        choices=['window', 'global'],
+        help='ほぼ同じ写真をグループ化し、最もスコアの高い1枚だけを上位に残す'
+             f'（window: 撮影時刻が近い連写のみ。走査の順で前後{MAX_WINDOW}枚以内を撮影時刻の順に並べ替えて比べる。'
+             'global: 全写真。すべての評価結果を最後までメモリに保持するため、大量の写真では --batch-size で区切ること）'
+    )
+    parser.add_argument(
+        '--dedupe-distance',
+        type=int,
+        default=6,
+        help='同じ写真とみなすハッシュの距離（0-64、デフォルト: 6）'
+    )
+    parser.add_argument(
+        '--burst-window',
+        type=float,
+        default=10.0,
+        help='windowモードで比べる撮影時刻の幅（秒、デフォルト: 10）'
+    )
+    parser.add_argument(
+        '--output-mode',
+        choices=['copy', 'hardlink', 'reflink', 'symlink', 'move'],
+        default='copy',
+        help='分類フォルダへの出力方法（デフォルト: copy）。'
+             'hardlink/reflinkは同じディスク上ならほぼ容量を使わず、使えない場合はコピーします'
+    )
+    parser.add_argument(
+        '--coarse-size',
+        type=int,
+        default=0,
+        help='2段階評価: まずこの解像度（長辺のピクセル数）で全写真を採点し、'
+             '分類の境目に近い写真だけを --analysis-size（省略時は原寸）で評価し直す（例: 512）'
+    )
+    parser.add_argument(
+        '--refine-margin',
+        type=float,
+        default=None,
+        help='2段階評価で評価し直す、分類の境目からの点数の幅'
+             '（省略時は1回目の縮小率に応じた総合スコアの誤差のp95。parity.py --fit-gains で計測した値）'
+    )
+    parser.add_argument(
+        '--job',
+        action='store_true',
+        help='すべての写真を最後まで処理する（--batch-size 枚ごとに確定し、途中で止まっても次回は続きから再開）'
+    )
+    parser.add_argument(
+        '--identical',
+        choices=['link', 'list'],
+        help='内容がまったく同じファイル（別フォルダにある同じ写真）は1回だけ評価する'
+             '（link: 代表と同じ分類フォルダにハードリンクを作る、list: results.csv に記録するだけ）'
+    )
+    parser.add_argument(
+        '--jpeg-preview',
+        action='store_true',
+        help='JPEGに解析解像度以上の埋め込みプレビューがあれば、主画像の代わりにそれで評価する'
+             '（--analysis-size と併用。RAWは指定しなくても常に埋め込みプレビューで評価）'
+    )
+    parser.add_argument(
+        '--memory-limit',
+        type=int,
+        default=0,
+        metavar='MB',
+        help='1枚の解析に使うメモリの上限（MB、デフォルト: 0 = 上限なし）。'
+             '超える巨大な画像・パノラマは縮小デコードし、シャープさ等は横長の帯ごとに計算する'
+    )
+    parser.add_argument(
+        '--tile-threads',
+        type=int,
+        default=1,
+        help='--memory-limit で帯ごとに計算する統計を並列に計算するスレッド数（デフォルト: 1）'
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=0,
+        metavar='K',
+        help='総合スコアの上位K枚だけを選んで出力する（すべての未処理の写真から選ぶ。'
+             '上位に入れない写真は顔検出を省いて高速化）'
+    )
+    parser.add_argument(
+        '--readers',
+        type=int,
+        default=2,
+        help='写真を先読み・デコードするスレッド数（デフォルト: 2、0 = 先読みしない）'
+    )
+    parser.add_argument(
+        '--writers',
+        type=int,
+        default=2,
+        help='分類フォルダへ出力するスレッド数（デフォルト: 2、0 = 評価と交互に出力）'
+    )
+    parser.add_argument(
+        '--queue-depth',
+        type=int,
+        default=8,
+        help='先読み・出力待ちにできる写真の最大枚数（デフォルト: 8）'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='段階ごと（走査・読み込み・デコード・撮影日時・各評価・顔/目/笑顔の検出・出力・記録）の'
+             '処理時間を1枚ごとに計測し、最後に表示して results.csv と同じフォルダの profile.json に保存する'
+    )
+    parser.add_argument(
+        '--thumbnails',
+        action='store_true',
+        help='評価のためにデコードした画像からサムネイル（JPEG）を作り、キャッシュに保存する'
+             '（GUI版の結果の一覧などで、元の写真をデコードし直さずに表示できる）'
+    )
+    parser.add_argument(
+        '--thumbnail-size',
+        type=int,
+        default=320,
+        help='サムネイルの長辺のピクセル数（デフォルト: 320）'
+    )
+    parser.add_argument(
+        '--thumbnail-dir',
+        help='サムネイルのキャッシュのフォルダ（デフォルト: 出力フォルダの .thumbnails。'
+             '内容が同じ写真は1つを共有するため、複数の出力フォルダで共用できる）'
+    )
+    parser.add_argument(
+        '--thumbnail-limit',
+        type=int,
+        default=THUMBNAIL_LIMIT_MB,
+        metavar='MB',
+        help=f'サムネイルのキャッシュの合計サイズの上限（デフォルト: {THUMBNAIL_LIMIT_MB}MB、0 = 上限なし）。'
+             '超えた分は最近使われていないものから削除する'
+    )
+    parser.add_argument(
+        '--ndjson',
+        metavar='PATH',
+        help='評価結果を1枚ごとにNDJSON（1行1件のJSON）で書き出すファイル。'
+             '「-」で標準出力に流す（他のツールで逐次読み込み可能）'
+    )
     args = parser.parse_args()
 
     # 入力フォルダの存在確認
     if not os.path.isdir(args.input):
         print(f"エラー: 入力フォルダが見つかりません: {args.input}")
         sys.exit(1)
+    if args.top and (args.dedupe or args.coarse_size or args.job):
+        print("エラー: --top は --dedupe・--coarse-size・--job と同時に指定できません")
+        sys.exit(1)
+    if args.dedupe == 'global' and args.job:
+        # globalモードは最後まで分類が決まらず、チェックポイントで何も確定できない
+        print("エラー: --dedupe global は --job と同時に指定できません（--dedupe window を使ってください）")
+        sys.exit(1)
+
+    results_stream = None
+    if args.ndjson == '-':
+        results_stream = sys.stdout
+    elif args.ndjson:
+        results_stream = open(args.ndjson, 'a', encoding='utf-8')
 
     # セレクター実行（閾値はクラス内で定義済み）
     selector = PhotoSelector(
         input_dir=args.input,
         output_dir=args.output,
-        batch_size=args.batch_size
+        batch_size=args.batch_size,
+        workers=args.workers,
+        analysis_size=args.analysis_size,
+        use_hash=args.hash,
+        scoring_config=args.config,
+        dedupe=args.dedupe,
+        dedupe_distance=args.dedupe_distance,
+        burst_window=args.burst_window,
+        output_mode=args.output_mode,
+        results_stream=results_stream,
+        readers=args.readers,
+        writers=args.writers,
+        queue_depth=args.queue_depth,
+        coarse_size=args.coarse_size,
+        refine_margin=args.refine_margin,
+        top_k=args.top,
+        jpeg_preview=args.jpeg_preview,
+        identical=args.identical,
+        job=args.job,
+        memory_limit=args.memory_limit,
+        tile_threads=args.tile_threads,
+        profile=args.profile,
+        thumbnail_size=args.thumbnail_size if args.thumbnails else 0,
+        thumbnail_dir=args.thumbnail_dir,
+        thumbnail_limit=args.thumbnail_limit
     )
-    selector.run()
+    try:
+        if args.ndjson == '-':
+            # 標準出力は結果専用にし、進捗やメッセージは標準エラーに出す
+            with contextlib.redirect_stdout(sys.stderr):
+                selector.run()
+        else:
+            selector.run()
+    except BrokenProcessPool:
+        print("\nエラー: ワーカープロセスが異常終了しました。結果を受け取った写真だけを確定しました"
+              "（残りの写真は次回の実行で処理されます）", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if results_stream is not None and results_stream is not sys.stdout:
+            results_stream.close()
 
 
 if __name__ == '__main__':
@@ -2,16 +2,29 @@
 """
 Photo Selector GUI - 写真自動選定ツール（GUI版）
 CustomTkinterを使用したモダンなGUIインターフェース
+評価処理（OpenCV・NumPy等）はウィンドウを表示した後に別スレッドで読み込み、起動を待たせません。
 """
 
 import os
+import sys
 import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from tkinter import filedialog
+from typing import Optional
 
 import customtkinter as ctk
 
-from photo_selector import PhotoSelector, PhotoEvaluator
+from progress import ProgressChannel, format_duration
+from results_view import ResultsView, load_results
+
+
+# 進捗・ログを画面に反映する間隔（ミリ秒）。処理スレッドは画面に触れず、この間隔でまとめて読み出す
+PROGRESS_INTERVAL_MS = 100
+# 画面のログに残す最大行数（古い行から消す。全件は出力フォルダのログファイルに残る）
+LOG_MAX_LINES = 1000
+LOG_FILE_NAME = 'photo_selector_gui.log'
 
 
 class PhotoSelectorGUI(ctk.CTk):
@@ -33,11 +46,53 @@ class PhotoSelectorGUI(ctk.CTk):
         self.input_path = ctk.StringVar()
         self.output_path = ctk.StringVar()
         self.batch_size = ctk.IntVar(value=500)
+        self.run_all = ctk.BooleanVar(value=False)
+        self.max_workers = os.cpu_count() or 1
+        self.workers = ctk.IntVar(value=1)
         self.is_running = False
+        self._results_view = None
+        # 出力フォルダ -> (サムネイルのフォルダ, ThumbnailCache の設定)。評価したときの設定で一覧を表示する
+        self._thumbnail_settings = {}
+
+        # 処理スレッドからの進捗・ログ
+        self.progress = ProgressChannel()
+        self._log_lines = 0
+
+        # 評価処理のモジュール（photo_selector）。ウィンドウの表示後に別スレッドで読み込む
+        self._engine = None
+        self._engine_error = None
+        self._engine_ready = threading.Event()
 
         # UI構築
         self._create_widgets()
 
+        # ウィンドウが描画されてから、フォルダを選んでいる間に読み込みを進める
+        self.after_idle(self._start_preload)
+
+    def _start_preload(self):
+        """評価処理の読み込みを別スレッドで開始"""
+        threading.Thread(target=self._preload, daemon=True).start()
+
+    def _preload(self):
+        """OpenCV等を含む評価処理のモジュールと、顔検出器（Haar Cascade）を読み込む"""
+        try:
+            import photo_selector
+            photo_selector.load_cascades()
+            self._engine = photo_selector
+        except Exception as e:
+            self._engine_error = e
+        finally:
+            self._engine_ready.set()
+
+    def _load_engine(self):
+        """評価処理のモジュール（読み込みが終わっていなければ待つ）"""
+        if not self._engine_ready.is_set():
+            self.progress.log("評価処理を準備しています...")
+            self._engine_ready.wait()
+        if self._engine_error is not None:
+            raise self._engine_error
+        return self._engine
+
     def _create_widgets(self):
         """UIウィジェットを作成"""
         # メインフレーム
@@ -150,6 +205,46 @@ class PhotoSelectorGUI(ctk.CTk):
         )
         self.batch_slider.pack(fill="x", pady=(5, 0))
 
+        # すべての写真を処理（バッチサイズごとに確定するジョブ）
+        ctk.CTkCheckBox(
+            batch_frame,
+            text="すべての写真を処理（バッチサイズごとに確定し、中断しても続きから再開）",
+            variable=self.run_all,
+            font=ctk.CTkFont(size=12)
+        ).pack(anchor="w", pady=(8, 0))
+
+        # 並列数設定
+        workers_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        workers_frame.pack(fill="x", pady=10)
+
+        workers_label_frame = ctk.CTkFrame(workers_frame, fg_color="transparent")
+        workers_label_frame.pack(fill="x")
+
+        ctk.CTkLabel(
+            workers_label_frame,
+            text="並列数",
+            font=ctk.CTkFont(size=14, weight="bold")
+        ).pack(side="left")
+
+        self.workers_value_label = ctk.CTkLabel(
+            workers_label_frame,
+            text="1プロセス",
+            font=ctk.CTkFont(size=14),
+            text_color="gray"
+        )
+        self.workers_value_label.pack(side="right")
+
+        self.workers_slider = ctk.CTkSlider(
+            workers_frame,
+            from_=1,
+            to=max(2, self.max_workers),
+            number_of_steps=max(1, self.max_workers - 1),
+            variable=self.workers,
+            command=self._on_workers_change,
+            height=20
+        )
+        self.workers_slider.pack(fill="x", pady=(5, 0))
+
         # プログレスバー
         progress_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
         progress_frame.pack(fill="x", pady=20)
@@ -176,6 +271,17 @@ class PhotoSelectorGUI(ctk.CTk):
         )
         self.run_button.pack(fill="x", pady=10)
 
+        # 評価結果の一覧（results.csv をサムネイルで表示）
+        self.results_button = ctk.CTkButton(
+            main_frame,
+            text="結果を一覧で見る",
+            height=32,
+            fg_color="transparent",
+            border_width=1,
+            command=self._open_results
+        )
+        self.results_button.pack(fill="x")
+
         # ログエリア
         log_frame = ctk.CTkFrame(main_frame)
         log_frame.pack(fill="both", expand=True, pady=(10, 0))
@@ -209,10 +315,23 @@ class PhotoSelectorGUI(ctk.CTk):
         """バッチサイズ変更時のコールバック"""
         self.batch_value_label.configure(text=f"{int(value)}枚")
 
+    def _on_workers_change(self, value):
+        """並列数変更時のコールバック"""
+        self.workers_value_label.configure(text=f"{int(value)}プロセス")
+
     def _log(self, message: str):
-        """ログを追加"""
+        """ログを追加（UIスレッド専用。処理スレッドからは self.progress.log() を使う）"""
+        self._append_log(message.split("\n"))
+
+    def _append_log(self, lines):
+        """ログをまとめて追加し、LOG_MAX_LINES 行を超えた分を古い行から消す"""
         self.log_text.configure(state="normal")
-        self.log_text.insert("end", message + "\n")
+        self.log_text.insert("end", "\n".join(lines) + "\n")
+        self._log_lines += len(lines)
+        if self._log_lines > LOG_MAX_LINES:
+            excess = self._log_lines - LOG_MAX_LINES
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+            self._log_lines = LOG_MAX_LINES
         self.log_text.see("end")
         self.log_text.configure(state="disabled")
 
@@ -221,15 +340,33 @@ class PhotoSelectorGUI(ctk.CTk):
         self.log_text.configure(state="normal")
         self.log_text.delete("1.0", "end")
         self.log_text.configure(state="disabled")
-
-    def _update_progress(self, current: int, total: int, message: str = ""):
-        """プログレスバーを更新"""
-        progress = current / total if total > 0 else 0
-        self.progress_bar.set(progress)
-        if message:
-            self.progress_label.configure(text=message)
+        self._log_lines = 0
+
+    def _update_progress(self, snapshot):
+        """プログレスバーを更新（処理の速さと残り時間の目安も表示）"""
+        current, total = snapshot.current, snapshot.total
+        self.progress_bar.set(current / total if total > 0 else 0)
+        if snapshot.message:
+            self.progress_label.configure(text=snapshot.message)
+            return
+        text = f"{current}/{total}枚 処理完了"
+        if snapshot.rate:
+            text += f"（{snapshot.rate:.1f}枚/秒"
+            if snapshot.eta is not None:
+                text += f"、残り約 {format_duration(snapshot.eta)}"
+            text += "）"
+        self.progress_label.configure(text=text)
+
+    def _poll_progress(self):
+        """処理スレッドの進捗とログを一定の間隔で画面に反映（UIスレッド）"""
+        snapshot = self.progress.snapshot()
+        if snapshot.logs:
+            self._append_log(snapshot.logs)
+        self._update_progress(snapshot)
+        if snapshot.finished:
+            self._finish_processing()
         else:
-            self.progress_label.configure(text=f"{current}/{total}枚 処理完了")
+            self.after(PROGRESS_INTERVAL_MS, self._poll_progress)
 
     def _run_selector(self):
         """写真選定を実行"""
@@ -256,119 +393,208 @@ class PhotoSelectorGUI(ctk.CTk):
         self.is_running = True
         self.run_button.configure(state="disabled", text="処理中...")
         self._clear_log()
+        self.progress.start(log_path=Path(output_dir) / LOG_FILE_NAME)
 
-        # バックグラウンドで実行
+        # バックグラウンドで実行（画面は _poll_progress() で更新する）
         thread = threading.Thread(
             target=self._process_photos,
-            args=(input_dir, output_dir, self.batch_size.get()),
+            args=(input_dir, output_dir, self.batch_size.get(), self.workers.get(), self.run_all.get()),
             daemon=True
         )
         thread.start()
+        self.after(PROGRESS_INTERVAL_MS, self._poll_progress)
 
-    def _process_photos(self, input_dir: str, output_dir: str, batch_size: int):
+    def _process_photos(self, input_dir: str, output_dir: str, batch_size: int,
+                        workers: int = 1, job: bool = False):
         """写真を処理（バックグラウンドスレッド）"""
         try:
-            self._log("=" * 50)
-            self._log("Photo Selector - 写真自動選定ツール")
-            self._log("=" * 50)
-
-            # セレクター初期化
-            selector = PhotoSelector(
+            self.progress.log("=" * 50)
+            self.progress.log("Photo Selector - 写真自動選定ツール")
+            self.progress.log("=" * 50)
+
+            # セレクター初期化（結果の一覧に使うサムネイルは評価のついでに作る）
+            engine = self._load_engine()
+            from thumbnails import THUMBNAIL_SIZE
+            selector = engine.PhotoSelector(
                 input_dir=input_dir,
                 output_dir=output_dir,
-                batch_size=batch_size
+                batch_size=batch_size,
+                workers=workers,
+                job=job,
+                thumbnail_size=THUMBNAIL_SIZE
             )
+            cache = selector.thumbnails
+            self._thumbnail_settings[str(Path(output_dir))] = (
+                cache.root, {'size': cache.size, 'limit_mb': cache.limit_mb})
+
+            # ジョブ: 前回止まったところから再開（確定していない出力は取り消す）
+            if job:
+                rolled_back = selector.start_job()
+                if rolled_back:
+                    self.progress.log(f"前回のジョブを再開します（確定していなかった{rolled_back}枚の出力を取り消しました）")
 
             # 出力ディレクトリ作成
             selector.setup_output_dirs()
 
-            # 画像ファイル取得
-            all_files = selector.get_image_files()
-            self._log(f"\n入力フォルダ: {input_dir}")
-            self._log(f"見つかった画像: {len(all_files)}枚")
-
-            if not all_files:
-                self._log("処理する画像がありません。")
-                self._finish_processing()
+            # 処理する画像がない場合も、出力中の写真と保留中の記録を書き込んでからジョブの記録を片付ける
+            try:
+                counts = self._evaluate_all(selector, input_dir, batch_size, workers, job)
+            finally:
+                selector.flush_processed()
+            # 結果と処理済みの記録はチェックポイントで確定済みのため、ジョブの記録は不要になる
+            selector.finish_job()
+            if counts is None:
                 return
 
-            # 処理済みファイルを除外
-            processed = selector.get_processed_files()
-            files_to_process = [f for f in all_files if str(f) not in processed]
-
-            if len(processed) > 0:
-                self._log(f"処理済み: {len(processed)}枚（スキップ）")
-            self._log(f"処理対象: {len(files_to_process)}枚")
-
-            if not files_to_process:
-                self._log("すべての画像が処理済みです。")
-                self._finish_processing()
-                return
-
-            # バッチ処理
-            if batch_size and len(files_to_process) > batch_size:
-                files_to_process = files_to_process[:batch_size]
-                self._log(f"バッチサイズ: {batch_size}枚ずつ処理")
-
-            # カウンター
-            counts = {
-                '1_最高': 0, '2_とても良い': 0, '3_良い': 0, '4_普通': 0,
-                '5_やや悪い': 0, '6_悪い': 0, '7_非常に悪い': 0
-            }
-
-            total = len(files_to_process)
-            self._log("\n処理中...")
-            self.after(0, lambda: self._update_progress(0, total, "処理開始..."))
-
-            # 処理実行
-            for i, file_path in enumerate(files_to_process):
-                result = selector.evaluate_photo(file_path)
-                selector.copy_photo(file_path, result)
-                selector.results.append(result)
-                selector.mark_as_processed(str(file_path))
-                counts[result['category']] += 1
-
-                # プログレス更新（UIスレッドで実行）
-                current = i + 1
-                self.after(0, lambda c=current, t=total: self._update_progress(c, t))
-
             # 結果サマリー
-            self._log("\n" + "=" * 50)
-            self._log("処理完了")
-            self._log("=" * 50)
-            self._log(f"  1_最高（75点以上）:       {counts['1_最高']}枚")
-            self._log(f"  2_とても良い（65-74点）:  {counts['2_とても良い']}枚")
-            self._log(f"  3_良い（55-64点）:        {counts['3_良い']}枚")
-            self._log(f"  4_普通（45-54点）:        {counts['4_普通']}枚")
-            self._log(f"  5_やや悪い（35-44点）:    {counts['5_やや悪い']}枚")
-            self._log(f"  6_悪い（25-34点）:        {counts['6_悪い']}枚")
-            self._log(f"  7_非常に悪い（25点未満）: {counts['7_非常に悪い']}枚")
-            self._log(f"  合計: {sum(counts.values())}枚")
+            self.progress.log("\n" + "=" * 50)
+            self.progress.log("処理完了")
+            self.progress.log("=" * 50)
+            self.progress.log(f"  1_最高（75点以上）:       {counts['1_最高']}枚")
+            self.progress.log(f"  2_とても良い（65-74点）:  {counts['2_とても良い']}枚")
+            self.progress.log(f"  3_良い（55-64点）:        {counts['3_良い']}枚")
+            self.progress.log(f"  4_普通（45-54点）:        {counts['4_普通']}枚")
+            self.progress.log(f"  5_やや悪い（35-44点）:    {counts['5_やや悪い']}枚")
+            self.progress.log(f"  6_悪い（25-34点）:        {counts['6_悪い']}枚")
+            self.progress.log(f"  7_非常に悪い（25点未満）: {counts['7_非常に悪い']}枚")
+            self.progress.log(f"  合計: {sum(counts.values())}枚")
 
             # CSV出力
             selector.save_results_csv()
-            self._log(f"\n結果を保存しました: {selector.output_dir / 'results.csv'}")
+            self.progress.log(f"\n結果を保存しました: {selector.output_dir / 'results.csv'}")
+            selector.evict_thumbnails()
 
             # 出力先表示
-            self._log(f"\n出力先: {output_dir}")
+            self.progress.log(f"\n出力先: {output_dir}")
+
+            self.progress.set_message("完了")
 
-            self.after(0, lambda: self._update_progress(total, total, "完了"))
+        except BrokenProcessPool:
+            # 確定した写真の記録とジョブの記録は残っているため、もう一度実行すると続きから処理される
+            self.progress.log("\nエラー: ワーカープロセスが異常終了しました。結果を受け取った写真だけを確定しました"
+                              "（もう一度実行すると残りの写真を処理します）")
 
         except Exception as e:
-            self._log(f"\nエラーが発生しました: {e}")
+            self.progress.log(f"\nエラーが発生しました: {e}")
 
         finally:
-            self._finish_processing()
+            self.progress.finish()
+
+    def _evaluate_all(self, selector, input_dir: str, batch_size: int, workers: int,
+                      job: bool) -> Optional[dict]:
+        """
+        画像を走査して評価・出力（バックグラウンドスレッド）
+        Returns: 分類ごとの枚数（処理する画像がなかった場合は None）
+        """
+        # 画像ファイル取得（1回の走査で、処理済みのファイルは走査中に除外）
+        scanner = selector.scan_image_files()
+        files_to_process = list(scanner)
+        self.progress.log(f"\n入力フォルダ: {input_dir}")
+        self.progress.log(f"見つかった画像: {scanner.found}枚")
+
+        if not scanner.found:
+            self.progress.log("処理する画像がありません。")
+            return None
+
+        if scanner.skipped:
+            self.progress.log(f"処理済み: {scanner.skipped}枚（スキップ）")
+        self.progress.log(f"処理対象: {len(files_to_process)}枚")
+
+        if not files_to_process:
+            self.progress.log("すべての画像が処理済みです。")
+            return None
+
+        # バッチ処理（ジョブではすべて処理し、バッチサイズごとに確定する）
+        if job:
+            self.progress.log(f"ジョブ: {batch_size}枚ごとに確定しながらすべて処理します")
+        elif batch_size and len(files_to_process) > batch_size:
+            files_to_process = files_to_process[:batch_size]
+            self.progress.log(f"バッチサイズ: {batch_size}枚ずつ処理")
+
+        # カウンター
+        counts = {category: 0 for category in selector.categories}
+
+        total = len(files_to_process)
+        self.progress.log("\n処理中...")
+        if workers > 1:
+            self.progress.log(f"並列数: {workers}プロセス")
+        self.progress.set_total(total, "処理開始...")
+
+        # 処理実行
+        grouper = selector.create_grouper()
+        for file_path, result in selector.evaluate_photos(files_to_process):
+            finished = grouper.add(result) if grouper else [result]
+            for done in finished:
+                selector.finalize_photo(done)
+                counts[done['category']] += 1
+            selector.maybe_checkpoint()
+
+            # 件数を加算するだけ（画面への反映はUIスレッドが一定の間隔でまとめて行う）
+            self.progress.advance()
+
+        if grouper:
+            for done in grouper.finish():
+                selector.finalize_photo(done)
+                counts[done['category']] += 1
+        return counts
+
+    def _open_results(self):
+        """出力フォルダの results.csv をサムネイルの一覧で表示"""
+        output_dir = self.output_path.get().strip()
+        if not output_dir:
+            self._log("エラー: 出力フォルダを選択してください")
+            return
+        csv_path = Path(output_dir) / 'results.csv'
+        if not csv_path.exists():
+            self._log(f"エラー: 評価結果が見つかりません: {csv_path}")
+            return
+
+        if self._results_view is not None and self._results_view.winfo_exists():
+            self._results_view.destroy()
+        try:
+            entries = load_results(csv_path)
+        except (OSError, ValueError) as e:
+            self._log(f"エラー: 評価結果を読み込めません: {e}")
+            return
+        thumbnail_dir, cache_options = self._thumbnail_settings.get(str(Path(output_dir)), (None, None))
+        self._results_view = ResultsView(self, Path(output_dir), entries, thumbnail_dir, cache_options)
+        self._results_view.focus()
 
     def _finish_processing(self):
-        """処理完了時の後処理"""
+        """処理完了時の後処理（UIスレッド）"""
         self.is_running = False
-        self.after(0, lambda: self.run_button.configure(state="normal", text="実行"))
+        self.run_button.configure(state="normal", text="実行")
+
+
+def startup_check(app: PhotoSelectorGUI):
+    """
+    起動時間の計測用（--startup-check）
+    ウィンドウを表示した時刻と評価処理の読み込みが終わった時刻（time.time()）を出力して終了する
+    """
+    def on_shown(event):
+        if event.widget is not app:
+            return
+        app.unbind('<Map>')
+        print(f"window_shown {time.time():.6f}", flush=True)
+        wait_engine()
+
+    def wait_engine():
+        if not app._engine_ready.is_set():
+            app.after(20, wait_engine)
+            return
+        print(f"engine_ready {time.time():.6f}", flush=True)
+        if app._engine_error is not None:
+            print(f"engine_error {app._engine_error}", flush=True)
+        app.destroy()
+
+    app.bind('<Map>', on_shown)
 
 
 def main():
     """メイン関数"""
     app = PhotoSelectorGUI()
+    if '--startup-check' in sys.argv[1:]:
+        startup_check(app)
     app.mainloop()
 
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Pipeline - 読み込み・評価・出力の並行処理
+読み込みスレッドが次の写真を先読み・デコードし、評価（メインスレッド）と並行して動かします。
+分類フォルダへの出力も出力スレッドで行い、ディスクの待ち時間を評価の計算と重ねます。
+キューの長さには上限があり、メモリ使用量は一定です。
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+
+class StageStats:
+    """処理段階ごとの作業時間・待ち時間の集計"""
+
+    def __init__(self, name: str, threads: int = 1, unit: str = 'スレッド'):
+        self.name = name
+        self.threads = threads  # 0 = メインスレッドで実行
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0  # 作業していた時間の合計（秒、全スレッド分）
+        self.wait = 0.0  # この段階を待ってメインスレッドが止まっていた時間（秒）
+        self._lock = threading.Lock()
+
+    def timed(self, fn: Callable) -> Callable:
+        """fn の実行時間を作業時間として記録するラッパー"""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.busy += elapsed
+                    self.items += 1
+        return wrapper
+
+    def utilization(self, wall: float) -> float:
+        """使用率（0〜1）= 作業時間 / (経過時間 × スレッド数)"""
+        if wall <= 0:
+            return 0.0
+        return min(1.0, self.busy / (wall * max(1, self.threads)))
+
+    def summary(self, wall: float) -> str:
+        parts = [f'{self.threads}{self.unit}' if self.threads else 'メインスレッド', f'{self.items}件']
+        if self.wait >= 0.05:
+            parts.append(f'待ち {self.wait:.1f}秒')
+        # 別プロセスで動く段階は作業時間を測れないため、待ち時間だけを表示
+        usage = f'{self.utilization(wall) * 100:.0f}%' if self.busy else '-'
+        return f"{self.name}: 使用率 {usage}（{'、'.join(parts)}）"
+
+
+class PrefetchReader:
+    """
+    入力を読み込みスレッドで先読みするクラス
+    結果は投入した順に返し、先読みは depth 件までに制限する
+    """
+
+    def __init__(self, load: Callable, threads: int = 2, depth: int = 8):
+        self.threads = max(0, threads)
+        self.depth = max(1, depth)
+        self.stats = StageStats('読み込み', self.threads)
+        self.load = self.stats.timed(load)
+
+    def map(self, items: Iterable[Tuple]) -> Iterator[Tuple[Tuple, Future]]:
+        """
+        items の各要素を load(*item) で読み込む
+        Yields: (要素, 完了済みのFuture) を入力と同じ順序で返す（例外はFutureの中に保持）
+        """
+        if self.threads == 0:
+            # 先読みなし（その場で読み込む）
+            for item in items:
+                future = Future()
+                try:
+                    future.set_result(self.load(*item))
+                except Exception as e:
+                    future.set_exception(e)
+                yield item, future
+            return
+
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='reader') as executor:
+            pending = deque()
+            try:
+                for item in items:
+                    pending.append((item, executor.submit(self.load, *item)))
+                    if len(pending) >= self.depth:
+                        yield self._next(pending)
+                while pending:
+                    yield self._next(pending)
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def _next(self, pending: deque) -> Tuple[Tuple, Future]:
+        item, future = pending.popleft()
+        if not future.done():
+            start = time.perf_counter()
+            future.exception()  # 完了を待つ（例外は送出しない）
+            self.stats.wait += time.perf_counter() - start
+        return item, future
+
+
+class OutputStage:
+    """
+    出力（コピー等）を出力スレッドで行うクラス
+    完了時の処理（結果の記録）は投入した順にメインスレッドで実行し、未完了は depth 件までに制限する
+    """
+
+    def __init__(self, threads: int = 2, depth: int = 8):
+        self.threads = max(0, threads)
+        self.depth = max(1, depth)
+        self.stats = StageStats('出力', self.threads)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = deque()
+
+    def submit(self, fn: Callable, args: tuple, on_done: Callable[[], None]):
+        """fn(*args) を出力スレッドで実行し、完了後に on_done() をメインスレッドで呼ぶ"""
+        if self.threads == 0:
+            self.stats.timed(fn)(*args)
+            on_done()
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='writer')
+        self.pending.append((self._executor.submit(self.stats.timed(fn), *args), on_done))
+
+        # 完了したものから順に確定し、上限を超えたら最も古いものの完了を待つ
+        while self.pending and (self.pending[0][0].done() or len(self.pending) > self.depth):
+            self._complete_oldest()
+
+    def _complete_oldest(self):
+        future, on_done = self.pending.popleft()
+        if not future.done():
+            start = time.perf_counter()
+            future.exception()
+            self.stats.wait += time.perf_counter() - start
+        future.result()  # 出力に失敗した場合は例外を送出
+        on_done()
+
+    def drain(self):
+        """未完了の出力をすべて待って確定"""
+        while self.pending:
+            self._complete_oldest()
+
+    def close(self):
+        """残りを確定してスレッドを終了（例外時も未完了の出力は待つ）"""
+        try:
+            self.drain()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Preview - 埋め込みプレビューの取り出し
+RAW（DNG/CR2/NEF/ARWなどTIFF形式）やJPEGに埋め込まれたJPEGプレビューを、
+TIFF/EXIFのIFDとMPF（マルチピクチャー）をたどって見つけ、本体をデコードせずに取り出します。
+プレビューがない場合は、インストールされていれば rawpy（RAW）や pillow-heif（HEIC）で全体をデコードします。
+"""
+
+import io
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from ingest import is_tiff, jpeg_frame
+
+try:
+    import rawpy
+except ImportError:
+    rawpy = None
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+# 埋め込みプレビューから評価するRAW形式
+RAW_EXTENSIONS = ('.dng', '.cr2', '.nef', '.nrw', '.arw', '.orf', '.rw2', '.pef', '.srw', '.raf')
+HEIF_EXTENSIONS = ('.heic', '.heif')
+
+# TIFFのタグ番号
+TAG_IMAGE_WIDTH = 0x0100
+TAG_IMAGE_LENGTH = 0x0101
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201         # JPEGInterchangeFormat（IFD1のサムネイルなど）
+TAG_JPEG_LENGTH = 0x0202         # JPEGInterchangeFormatLength
+TAG_JPG_FROM_RAW = 0x002E        # Panasonic（RW2）の埋め込みJPEG
+TAG_EXIF_IFD = 0x8769
+TAG_MP_ENTRY = 0xB002            # MPFの画像一覧
+
+# JPEG圧縮を表すCompressionの値（6 = 旧JPEG、7 = JPEG）
+JPEG_COMPRESSIONS = (6, 7)
+# デコードできるJPEG（ベースライン・拡張・プログレッシブ）。ロスレスJPEG（RAW本体）は除く
+DECODABLE_SOF = (0xC0, 0xC1, 0xC2)
+
+# 壊れたファイルで無限に辿らないための上限
+MAX_IFDS = 32
+MAX_VALUES = 4096
+
+# SHORT・LONG・IFDの値の大きさ（バイト）
+_TYPE_SIZES = {3: 2, 4: 4, 13: 4}
+
+
+class EmbeddedPreview(NamedTuple):
+    """埋め込みプレビュー（JPEGのバイト列と画像サイズ）"""
+    data: bytes
+    width: int
+    height: int
+
+    @property
+    def long_side(self) -> int:
+        return max(self.width, self.height)
+
+
+class _TiffReader:
+    """TIFF構造（RAW本体・EXIF・MPF）のIFDをたどり、埋め込みJPEGの位置と画像サイズを集める"""
+
+    def __init__(self, tiff: bytes, base: int = 0, data: Optional[bytes] = None):
+        self.tiff = tiff
+        # MPFの画像位置はTIFFヘッダーからの相対位置のため、元のバイト列と開始位置も持つ
+        self.base = base
+        self.data = data if data is not None else tiff
+        self.endian = '<' if tiff[:2] == b'II' else '>'
+        self.jpegs: List[Tuple[int, int]] = []   # (元のバイト列での開始位置, 長さ)
+        self.sizes: List[Tuple[int, int]] = []   # IFDに記録された画像サイズ
+        self._visited = set()
+
+    def entries(self, offset: int) -> dict:
+        """IFDのエントリを {タグ: (型, 個数, エントリ位置)} で取得"""
+        tiff = self.tiff
+        if offset <= 0 or offset + 2 > len(tiff):
+            return {}
+        count = struct.unpack_from(self.endian + 'H', tiff, offset)[0]
+        found = {}
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            if entry + 12 > len(tiff):
+                break
+            tag, value_type, value_count = struct.unpack_from(self.endian + 'HHI', tiff, entry)
+            found[tag] = (value_type, value_count, entry)
+        return found
+
+    def values(self, field: Tuple[int, int, int]) -> List[int]:
+        """SHORT・LONG型の値（配列）を取得"""
+        value_type, count, entry = field
+        size = _TYPE_SIZES.get(value_type)
+        if size is None or count == 0 or count > MAX_VALUES:
+            return []
+        if size * count <= 4:
+            offset = entry + 8
+        else:
+            offset = struct.unpack_from(self.endian + 'I', self.tiff, entry + 8)[0]
+        if offset + size * count > len(self.tiff):
+            return []
+        return list(struct.unpack_from(self.endian + ('H' if size == 2 else 'I') * count, self.tiff, offset))
+
+    def first(self, ifd: dict, tag: int) -> Optional[int]:
+        values = self.values(ifd[tag]) if tag in ifd else []
+        return values[0] if values else None
+
+    def walk(self, offset: int):
+        """IFDの連鎖（IFD0 → IFD1 → ...）とSubIFD・Exif IFDをたどる"""
+        while offset and offset not in self._visited and len(self._visited) < MAX_IFDS:
+            self._visited.add(offset)
+            ifd = self.entries(offset)
+            if not ifd:
+                return
+            self.read_ifd(ifd)
+
+            for sub_offset in self.values(ifd[TAG_SUB_IFDS]) if TAG_SUB_IFDS in ifd else []:
+                self.walk(sub_offset)
+            if TAG_EXIF_IFD in ifd:
+                self.walk(self.first(ifd, TAG_EXIF_IFD))
+
+            next_pos = offset + 2 + len(ifd) * 12
+            if next_pos + 4 > len(self.tiff):
+                return
+            offset = struct.unpack_from(self.endian + 'I', self.tiff, next_pos)[0]
+
+    def read_ifd(self, ifd: dict):
+        """1つのIFDから画像サイズと埋め込みJPEGを取り出す"""
+        width = self.first(ifd, TAG_IMAGE_WIDTH)
+        height = self.first(ifd, TAG_IMAGE_LENGTH)
+        if width and height:
+            self.sizes.append((width, height))
+
+        # EXIFのサムネイル（IFD1）やNEF・ARWのプレビュー
+        if TAG_JPEG_OFFSET in ifd and TAG_JPEG_LENGTH in ifd:
+            self.add_jpeg(self.first(ifd, TAG_JPEG_OFFSET), self.first(ifd, TAG_JPEG_LENGTH))
+
+        # CR2・DNGのプレビュー（JPEG圧縮の1ストリップ画像）
+        if self.first(ifd, TAG_COMPRESSION) in JPEG_COMPRESSIONS and TAG_STRIP_OFFSETS in ifd:
+            offsets = self.values(ifd[TAG_STRIP_OFFSETS])
+            lengths = self.values(ifd[TAG_STRIP_BYTE_COUNTS]) if TAG_STRIP_BYTE_COUNTS in ifd else []
+            if len(offsets) == 1 and len(lengths) == 1:
+                self.add_jpeg(offsets[0], lengths[0])
+
+        # RW2の埋め込みJPEG（UNDEFINED型でJPEGそのものが入っている）
+        if TAG_JPG_FROM_RAW in ifd:
+            _, count, entry = ifd[TAG_JPG_FROM_RAW]
+            if count > 4:
+                self.add_jpeg(struct.unpack_from(self.endian + 'I', self.tiff, entry + 8)[0], count)
+
+    def read_mp_entries(self):
+        """MPF（APP2）の画像一覧から、主画像以外（大きいプレビュー）を取り出す"""
+        ifd0_offset = struct.unpack_from(self.endian + 'I', self.tiff, 4)[0]
+        ifd = self.entries(ifd0_offset)
+        if TAG_MP_ENTRY not in ifd:
+            return
+        _, count, entry = ifd[TAG_MP_ENTRY]
+        offset = struct.unpack_from(self.endian + 'I', self.tiff, entry + 8)[0]
+        for i in range(count // 16):
+            pos = offset + i * 16
+            if pos + 16 > len(self.tiff):
+                break
+            _, size, image_offset = struct.unpack_from(self.endian + 'III', self.tiff, pos)
+            # 位置0は主画像（ファイルそのもの）
+            if image_offset:
+                self.add_jpeg(image_offset, size)
+
+    def add_jpeg(self, offset: Optional[int], length: Optional[int]):
+        if not offset or not length:
+            return
+        start = self.base + offset
+        if start + length <= len(self.data) and self.data[start:start + 2] == b'\xff\xd8':
+            self.jpegs.append((start, length))
+
+
+def _tiff_readers(data: bytes) -> List[_TiffReader]:
+    """バイト列に含まれるTIFF構造（RAW本体、JPEGのEXIF・MPF）を解析"""
+    readers = []
+    try:
+        if is_tiff(data):
+            reader = _TiffReader(data)
+            reader.walk(struct.unpack_from(reader.endian + 'I', data, 4)[0])
+            readers.append(reader)
+
+        elif data[:2] == b'\xff\xd8':
+            # JPEG: 画像データ（SOS）までのAPP1（EXIF）とAPP2（MPF）を解析
+            offset = 2
+            while offset + 4 <= len(data):
+                if data[offset] != 0xFF:
+                    break
+                marker = data[offset + 1]
+                if marker == 0xFF:
+                    offset += 1
+                    continue
+                if marker == 0xDA or marker == 0xD9:
+                    break
+                length = struct.unpack_from('>H', data, offset + 2)[0]
+                segment_end = offset + 2 + length
+                if marker == 0xE1 and data[offset + 4:offset + 10] == b'Exif\x00\x00':
+                    # EXIFの位置はTIFFヘッダーからの相対位置で、サムネイルもAPP1の中にある
+                    tiff = data[offset + 10:segment_end]
+                    if is_tiff(tiff):
+                        reader = _TiffReader(tiff, base=offset + 10, data=data)
+                        reader.walk(struct.unpack_from(reader.endian + 'I', tiff, 4)[0])
+                        readers.append(reader)
+                elif marker == 0xE2 and data[offset + 4:offset + 8] == b'MPF\x00':
+                    # MPFのプレビューはファイルの後ろ（主画像の後）にある
+                    tiff = data[offset + 8:segment_end]
+                    if is_tiff(tiff):
+                        reader = _TiffReader(tiff, base=offset + 8, data=data)
+                        reader.read_mp_entries()
+                        readers.append(reader)
+                offset = segment_end
+
+    except struct.error:
+        pass
+    return readers
+
+
+def embedded_previews(data: bytes) -> List[EmbeddedPreview]:
+    """埋め込まれたデコード可能なJPEGプレビューを、大きい順に取得（本体の画素はデコードしない）"""
+    previews = []
+    seen = set()
+    for reader in _tiff_readers(data):
+        for start, length in reader.jpegs:
+            if start in seen:
+                continue
+            seen.add(start)
+            jpeg = data[start:start + length]
+            frame = jpeg_frame(jpeg)
+            if frame is None or frame[0] not in DECODABLE_SOF:
+                continue
+            previews.append(EmbeddedPreview(jpeg, frame[1], frame[2]))
+    previews.sort(key=lambda p: p.width * p.height, reverse=True)
+    return previews
+
+
+def largest_preview(data: bytes, min_long_side: int = 0) -> Optional[EmbeddedPreview]:
+    """
+    最も大きい埋め込みプレビューを取得
+    min_long_side: 長辺がこれより小さいプレビューしかない場合は None
+    """
+    previews = embedded_previews(data)
+    if not previews or previews[0].long_side < min_long_side:
+        return None
+    return previews[0]
+
+
+def source_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    元画像の大きさ（幅, 高さ）を推定（プレビューの縮小率を求めるために使う）
+    JPEGは主画像、RAWはIFDに記録された最も大きい画像（センサーの画素数）
+    """
+    frame = jpeg_frame(data)
+    if frame is not None:
+        return frame[1:]
+    sizes = [size for reader in _tiff_readers(data) for size in reader.sizes]
+    if not sizes:
+        return None
+    return max(sizes, key=lambda size: size[0] * size[1])
+
+
+def decode_full(data: bytes, is_raw: bool = False) -> Optional[np.ndarray]:
+    """
+    埋め込みプレビューが使えない場合に全体をデコード（BGR）
+    RAWは rawpy、それ以外（HEICなど）は Pillow（pillow-heif）を使う。使えない場合は None
+    """
+    if is_raw:
+        if rawpy is None:
+            return None
+        try:
+            with rawpy.imread(io.BytesIO(data)) as raw:
+                rgb = raw.postprocess(use_camera_wb=True)
+        except Exception:
+            return None
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            rgb = np.asarray(img.convert('RGB'))
+    except Exception:
+        return None
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
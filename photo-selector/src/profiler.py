@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Profiler - 処理段階ごとの時間計測
+写真1枚ごとに、走査・読み込み・デコード・撮影日時・各評価・顔/目/笑顔の検出・出力・記録の
+経過時間とCPU時間を計測します。実行の最後に段階ごとの p50/p95/p99 と時間のかかったファイルを表示し、
+JSONに保存します（遅い原因がディスク・デコード・検出・コピーのどれかを切り分ける）。
+写真ごとの記録は処理中の分だけを持ち、段階ごとの集計（件数・合計・リザーバーサンプル）と
+時間のかかったファイルの上位（ヒープ）に畳み込むため、写真の枚数が増えてもメモリは一定です。
+"""
+
+import contextlib
+import heapq
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# 計測する段階（表示順）
+STAGES = [
+    'scan',       # 入力フォルダの走査
+    'read',       # ファイルの読み込み
+    'decode',     # 画素のデコード（埋め込みプレビューの取り出し・縮小を含む）
+    'exif',       # 撮影日時の取得
+    'sharpness',  # シャープさ
+    'exposure',   # 露出
+    'contrast',   # コントラスト
+    'face_precheck',  # 大きな顔だけの事前確認（上位K枚の選定）
+    'faces',      # 顔検出
+    'eyes',       # 目の検出
+    'smiles',     # 笑顔の検出
+    'dhash',      # 重複判定用のハッシュ
+    'thumbnail',  # サムネイルの作成（--thumbnails）
+    'copy',       # 分類フォルダへの出力
+    'log',        # 評価結果・処理済みの記録
+]
+
+_NOT_PROFILING = contextlib.nullcontext()
+
+# 処理中として写真ごとに持つ記録の最大数（超えたら古い写真から集計に畳み込む）
+PENDING_FILES = 1024
+# 段階ごとに p50/p95/p99 の計算用に残すサンプル数（これ以下の枚数なら正確な値になる）
+RESERVOIR_SIZE = 10000
+# 時間のかかったファイルとして残す数
+SLOWEST_FILES = 10
+
+
+def peak_rss_mb(who: int = 0) -> Optional[float]:
+    """
+    最大メモリ使用量（MB）
+    who: 0 = このプロセス、1 = 終了した子プロセス（並列評価のワーカー）の最大値
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if who else resource.RUSAGE_SELF)
+    # Linuxはキロバイト、macOSはバイト単位
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / divisor
+
+
+class StageStats:
+    """
+    1つの段階の集計（1枚あたりの経過時間・CPU時間）
+    件数・合計・最大は正確に、分位点はリザーバーサンプリングで残した最大 RESERVOIR_SIZE 件から求める
+    """
+
+    def __init__(self, seed: int = 0):
+        self.count = 0
+        self.wall_total = 0.0
+        self.cpu_total = 0.0
+        self.max = 0.0
+        self.samples: List[float] = []
+        self._random = random.Random(seed)
+
+    def add(self, wall: float, cpu: float):
+        self.count += 1
+        self.wall_total += wall
+        self.cpu_total += cpu
+        self.max = max(self.max, wall)
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(wall)
+            return
+        # それまでの全件から等しい確率で RESERVOIR_SIZE 件を残す
+        index = self._random.randrange(self.count)
+        if index < RESERVOIR_SIZE:
+            self.samples[index] = wall
+
+    def summary(self) -> dict:
+        p50, p95, p99 = np.percentile(self.samples, [50, 95, 99])
+        return {
+            'count': self.count,
+            'wall_total': self.wall_total,
+            'cpu_total': self.cpu_total,
+            'p50': float(p50),
+            'p95': float(p95),
+            'p99': float(p99),
+            'max': self.max,
+        }
+
+
+class Profiler:
+    """
+    写真ごと・段階ごとの経過時間とCPU時間（秒）を集計するクラス
+    enabled が False の場合は何も記録しない（計測のコストもかからない）
+    """
+
+    def __init__(self, enabled: bool = True, pending_limit: int = PENDING_FILES):
+        self.enabled = enabled
+        # 処理中の写真の記録: ファイルパス -> {段階: [経過時間, CPU時間]}（同じ段階を複数回通った場合は合計）
+        # pending_limit を超えたら古い写真から集計に畳み込む（globalモードの重複グループ化のように、
+        # 出力が最後にまとめて行われる写真は、出力の段階だけが別の1枚として数えられることがある）
+        self.records: Dict[str, Dict[str, List[float]]] = {}
+        self.pending_limit = pending_limit
+        self.stages: Dict[str, StageStats] = {}
+        self._slowest: List[tuple] = []  # (経過時間の合計, パス, 最も時間のかかった段階, その経過時間) の最小ヒープ
+        self._lock = threading.Lock()
+
+    def stage(self, file_path, name: str):
+        """段階の時間を計測するコンテキストマネージャー（CPU時間は計測したスレッドの分だけ）"""
+        if not self.enabled:
+            return _NOT_PROFILING
+        return self._measure(str(file_path), name)
+
+    @contextlib.contextmanager
+    def _measure(self, file_path: str, name: str):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(file_path, name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def timed(self, fn: Callable, file_path, name: str) -> Callable:
+        """fn の実行時間を段階の時間として記録するラッパー（出力スレッドなどに渡す処理用）"""
+        if not self.enabled:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            with self.stage(file_path, name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def timed_iter(self, items: Iterable, name: str) -> Iterator:
+        """イテレーターが次の要素を返すまでの時間を、返した要素（ファイルパス）の段階の時間として記録"""
+        if not self.enabled:
+            yield from items
+            return
+        iterator = iter(items)
+        while True:
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(str(item), name, time.perf_counter() - wall, time.thread_time() - cpu)
+            yield item
+
+    def add(self, file_path: str, name: str, wall: float, cpu: float):
+        with self._lock:
+            timings = self.records.get(file_path)
+            if timings is None:
+                timings = self.records[file_path] = {}
+                while len(self.records) > self.pending_limit:
+                    oldest = next(iter(self.records))
+                    self._fold(oldest, self.records.pop(oldest))
+            timing = timings.setdefault(name, [0.0, 0.0])
+            timing[0] += wall
+            timing[1] += cpu
+
+    def _fold(self, file_path: str, timings: Dict[str, List[float]]):
+        """1枚分の記録を段階ごとの集計と時間のかかったファイルに畳み込む（ロックを取った状態で呼ぶ）"""
+        if not timings:
+            return
+        for name, (wall, cpu) in timings.items():
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(seed=len(self.stages))
+            stats.add(wall, cpu)
+        total = sum(wall for wall, _ in timings.values())
+        slowest_stage = max(timings, key=lambda name: timings[name][0])
+        entry = (total, file_path, slowest_stage, timings[slowest_stage][0])
+        if len(self._slowest) < SLOWEST_FILES:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    def flush(self):
+        """処理中の記録をすべて集計に畳み込む（集計を表示・保存する前に呼ぶ）"""
+        with self._lock:
+            for file_path, timings in self.records.items():
+                self._fold(file_path, timings)
+            self.records.clear()
+
+    def pop(self, file_path) -> Dict[str, List[float]]:
+        """1枚分の記録を取り出す（ワーカープロセスからメインプロセスへ渡す）"""
+        with self._lock:
+            return self.records.pop(str(file_path), {})
+
+    def merge(self, file_path, timings: Dict[str, List[float]]):
+        """ワーカープロセスで計測した1枚分の記録を取り込む"""
+        for name, (wall, cpu) in timings.items():
+            self.add(str(file_path), name, wall, cpu)
+
+    def stage_summary(self) -> Dict[str, dict]:
+        """段階ごとの件数・合計時間・経過時間の p50/p95/p99（秒）"""
+        self.flush()
+        names = STAGES + sorted(set(self.stages) - set(STAGES))
+        return {name: self.stages[name].summary() for name in names if name in self.stages}
+
+    def slowest_files(self, count: int = SLOWEST_FILES) -> List[dict]:
+        """全段階の経過時間の合計が長いファイル（最も時間のかかった段階つき）"""
+        self.flush()
+        return [
+            {'file_path': path, 'wall': total, 'slowest_stage': stage, 'slowest_stage_wall': stage_wall}
+            for total, path, stage, stage_wall in heapq.nlargest(count, self._slowest)
+        ]
+
+    def report(self, wall: float, workers: bool = False) -> List[str]:
+        """計測結果の表（段階ごとの時間・時間のかかったファイル・最大メモリ使用量）"""
+        lines = [f"{'段階':10s} {'件数':>4s} {'合計':>6s} {'CPU':>8s} {'p50':>8s} {'p95':>8s} {'p99':>8s}"]
+        for name, stats in self.stage_summary().items():
+            lines.append(
+                f"{name:12s} {stats['count']:6d} {stats['wall_total']:7.2f}s {stats['cpu_total']:7.2f}s "
+                f"{stats['p50'] * 1000:6.1f}ms {stats['p95'] * 1000:6.1f}ms {stats['p99'] * 1000:6.1f}ms"
+            )
+
+        slowest = self.slowest_files()
+        if slowest:
+            lines.append('')
+            lines.append('時間のかかったファイル:')
+            for item in slowest:
+                lines.append(f"  {item['wall'] * 1000:8.1f}ms  {Path(item['file_path']).name}"
+                             f"（{item['slowest_stage']} {item['slowest_stage_wall'] * 1000:.1f}ms）")
+
+        main_rss = peak_rss_mb()
+        if main_rss is not None:
+            lines.append('')
+            rss = f"最大メモリ使用量: {main_rss:.0f}MB"
+            if workers:
+                rss += f"（ワーカープロセス: {peak_rss_mb(1):.0f}MB）"
+            lines.append(rss)
+        lines.append(f"処理時間: {wall:.2f}秒")
+        return lines
+
+    def save(self, path: Path, wall: float):
+        """集計をJSONに保存（段階ごとの件数・合計・分位点（秒）と時間のかかったファイル）"""
+        data = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'wall_seconds': wall,
+            'peak_rss_mb': {'main': peak_rss_mb(), 'workers': peak_rss_mb(1)},
+            'stages': self.stage_summary(),
+            'slowest_files': self.slowest_files(),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Progress - 処理スレッドから画面への進捗の受け渡し
+処理スレッドは件数とログを書き込むだけで、画面（Tk）には触れません。
+画面側は一定の間隔で最新の状態をまとめて読み出すため、写真が何万枚あってもイベントが溢れません。
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+
+class ProgressSnapshot(NamedTuple):
+    """読み出した時点の進捗"""
+    current: int
+    total: int
+    message: str
+    rate: Optional[float]   # 処理の速さ（枚/秒、直近 rate_window 秒の平均。計測前は None）
+    eta: Optional[float]    # 残り時間の目安（秒、速さが分からない場合は None）
+    logs: List[str]         # 前回の読み出し以降に追加されたログ
+    finished: bool
+
+
+def format_duration(seconds: float) -> str:
+    """秒数を「1:02:03」「2:03」形式にする"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes}:{seconds:02d}'
+
+
+class ProgressChannel:
+    """
+    処理スレッドと画面の間で進捗を受け渡すクラス（スレッドセーフ）
+    件数は加算するだけで、画面側が snapshot() で読み出した時点の値をまとめて表示する
+    ログは画面に表示する分（max_pending 件まで）を保持し、log_path を指定すると全件をファイルにも書き出す
+    """
+
+    def __init__(self, rate_window: float = 10.0, max_pending: int = 1000):
+        self.rate_window = rate_window
+        self._lock = threading.Lock()
+        self._current = 0
+        self._total = 0
+        self._message = ''
+        self._finished = True
+        # 画面にまだ表示していないログ（画面が追いつかない場合は古いものから捨てる。ファイルには残る）
+        self._pending = deque(maxlen=max_pending)
+        # 速さの計算用の (時刻, 件数)（直近 rate_window 秒分）
+        self._samples = deque()
+        self._log_file = None
+
+    def start(self, log_path: Optional[Path] = None):
+        """新しい処理を開始（件数とログをリセットし、ログファイルを開く）"""
+        with self._lock:
+            self._current = 0
+            self._total = 0
+            self._message = ''
+            self._finished = False
+            self._pending.clear()
+            self._samples.clear()
+            self._close_log_file()
+            if log_path is not None:
+                log_path.parent.mkdir(parents=True, exist_ok=True)
+                self._log_file = open(log_path, 'a', encoding='utf-8')
+
+    def set_total(self, total: int, message: str = ''):
+        """処理する件数を設定（件数は0に戻る）"""
+        with self._lock:
+            self._total = total
+            self._current = 0
+            self._message = message
+            self._samples.clear()
+
+    def advance(self, count: int = 1):
+        """処理済みの件数を加算"""
+        with self._lock:
+            self._current += count
+            self._message = ''
+
+    def set_message(self, message: str):
+        with self._lock:
+            self._message = message
+
+    def log(self, message: str):
+        """ログを追加（画面には次の読み出しで表示される）"""
+        with self._lock:
+            for line in message.split('\n'):
+                self._pending.append(line)
+                if self._log_file is not None:
+                    self._log_file.write(f"{datetime.now().isoformat(timespec='seconds')} {line}\n")
+            if self._log_file is not None:
+                self._log_file.flush()
+
+    def finish(self, message: str = ''):
+        """処理の終了（ログファイルを閉じる）"""
+        with self._lock:
+            self._finished = True
+            if message:
+                self._message = message
+            self._close_log_file()
+
+    def _close_log_file(self):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def snapshot(self) -> ProgressSnapshot:
+        """最新の進捗と、前回の読み出し以降のログを読み出す（画面側から一定の間隔で呼ぶ）"""
+        now = time.monotonic()
+        with self._lock:
+            current, total = self._current, self._total
+            logs = list(self._pending)
+            self._pending.clear()
+
+            # 直近 rate_window 秒の件数の増え方から速さを求める
+            self._samples.append((now, current))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= self.rate_window:
+                self._samples.popleft()
+            start_time, start_count = self._samples[0]
+            rate = None
+            if now - start_time >= 1.0 and current > start_count:
+                rate = (current - start_count) / (now - start_time)
+
+            eta = (total - current) / rate if rate and total >= current else None
+            return ProgressSnapshot(current, total, self._message, rate, eta, logs, self._finished)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Rescore - 再採点・再分類ツール
+特徴量キャッシュ（.features.db）に保存済みの計測値から、配点や閾値を変えて
+総合スコアと7段階の分類を計算し直します。画像の読み込みや顔検出は行いません。
+"""
+
+import argparse
+import os
+import shutil
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from dedupe import DEMOTE_TO
+from photo_selector import PhotoSelector
+
+
+class Rescorer:
+    """保存済みの計測値からまとめて再採点・再分類するクラス"""
+
+    def __init__(self, selector: PhotoSelector):
+        self.selector = selector
+        self.paths: List[str] = []
+        self.output_paths: List[Optional[str]] = []
+        # 内容がまったく同じ代表ファイル（--identical で評価を省いた写真。それ以外は None）
+        self.identical_to: List[Optional[str]] = []
+        # ほぼ同じ写真のグループ番号（--dedupe でグループ化された写真。それ以外は None）
+        self.dup_groups: List[Optional[int]] = []
+        self.dup_best: List[Optional[bool]] = []
+        self.datetimes: List[Optional[str]] = []
+        self.skipped = 0
+        self.scores: Dict[str, np.ndarray] = {}
+
+    def load(self):
+        """キャッシュから計測値を読み込み、配列にまとめる"""
+        required = {'datetime', 'frame', 'sharpness', 'exposure', 'contrast', 'faces', 'eyes', 'smiles'}
+
+        sharpness, exposure, contrast, frames = [], [], [], []
+        faces, eyes, smiles, face_counts = [], [], [], []
+
+        for path, entry, metrics in self.selector.cache.iter_processed():
+            if not required.issubset(metrics):
+                # 計測値がない（旧形式から取り込んだ）ファイルは再採点できない
+                self.skipped += 1
+                continue
+
+            self.paths.append(path)
+            self.output_paths.append(entry['output_path'])
+            self.identical_to.append(entry['identical_to'])
+            self.dup_groups.append(entry['dup_group'])
+            self.dup_best.append(entry['dup_best'])
+            self.datetimes.append(metrics['datetime'])
+            sharpness.append(metrics['sharpness'])
+            exposure.append(metrics['exposure'])
+            contrast.append(metrics['contrast'])
+            frames.append(metrics['frame'])
+            faces.extend(metrics['faces'])
+            eyes.extend(metrics['eyes'])
+            smiles.extend(metrics['smiles'])
+            face_counts.append(len(metrics['faces']))
+
+        self.sharpness = np.asarray(sharpness, dtype=np.float64)
+        self.exposure = np.asarray(exposure, dtype=np.float64).reshape(-1, 3)
+        self.contrast = np.asarray(contrast, dtype=np.float64)
+        self.frames = np.asarray(frames, dtype=np.float64).reshape(-1, 2)
+        self.faces = np.asarray(faces, dtype=np.float64).reshape(-1, 4)
+        self.eyes = np.asarray(eyes, dtype=np.int64)
+        self.smiles = np.asarray(smiles, dtype=bool)
+        self.face_counts = np.asarray(face_counts, dtype=np.int64)
+
+    def compute_component_scores(self):
+        """
+        各項目のスコアを全写真まとめて計算
+        PhotoEvaluator の *_score と同じメソッドに、1枚分の値の代わりに全写真の配列を渡す
+        """
+        evaluator = self.selector.evaluator
+        self.scores = {
+            'has_face': self.face_counts > 0,
+            'sharpness': evaluator.sharpness_score(self.sharpness),
+            'exposure': evaluator.exposure_score(self.exposure),
+            'contrast': evaluator.contrast_score(self.contrast),
+        }
+        self.scores.update(evaluator.face_component_scores(
+            self.faces, self.frames, self.eyes, self.smiles, self.face_counts))
+
+    def compute_totals(self):
+        """配点から総合スコアを、閾値から分類（0〜6）を計算"""
+        has_face = self.scores['has_face']
+
+        face_total = np.zeros(len(self.paths))
+        for name, weight in self.selector.face_weights.items():
+            face_total = face_total + self.scores[name] * weight
+        no_face_total = np.zeros(len(self.paths))
+        for name, weight in self.selector.no_face_weights.items():
+            no_face_total = no_face_total + self.scores[name] * weight
+
+        self.total_score = np.where(has_face, face_total, no_face_total)
+
+        # 閾値（降順）を下回った数 = 分類の番号
+        self.category_index = np.zeros(len(self.paths), dtype=np.int64)
+        for threshold in self.selector.thresholds:
+            self.category_index += self.total_score < threshold
+
+        self.apply_dedupe()
+        self.apply_identical()
+
+    def apply_dedupe(self):
+        """
+        ほぼ同じ写真のグループごとに、新しい総合スコアで代表を選び直し、
+        代表以外を上位の分類から外す（評価のときの DuplicateGrouper と同じ扱い）
+        """
+        groups: Dict[int, List[int]] = {}
+        for i, group_id in enumerate(self.dup_groups):
+            if group_id is not None:
+                groups.setdefault(group_id, []).append(i)
+
+        demote_index = self.selector.categories.index(DEMOTE_TO)
+        for members in groups.values():
+            best = max(members, key=lambda i: self.total_score[i])
+            for i in members:
+                self.dup_best[i] = i == best
+                if i != best:
+                    self.category_index[i] = max(self.category_index[i], demote_index)
+
+    def apply_identical(self):
+        """内容がまったく同じファイルは、代表と同じ総合スコア・分類にする（評価のときと同じ扱い）"""
+        index_of = {path: i for i, path in enumerate(self.paths)}
+        for i, canonical in enumerate(self.identical_to):
+            j = index_of.get(canonical) if canonical else None
+            if j is not None:
+                self.total_score[i] = self.total_score[j]
+                self.category_index[i] = self.category_index[j]
+
+    def relocate(self, index: int, category: str) -> Optional[str]:
+        """
+        出力ファイルを新しい分類フォルダに移動（出力ファイルがない場合は元ファイルからリンク）
+        内容がまったく同じファイルは、出力ファイル（link モードのハードリンク）があるときだけ移動し、
+        ない場合（list モード）は新しく作らない
+        """
+        category_dir = self.selector.output_dir / category
+        old_output = self.output_paths[index]
+
+        if old_output and os.path.exists(old_output):
+            if Path(old_output).parent == category_dir:
+                return old_output
+            new_output = self.selector.unique_output_path(category_dir, Path(old_output).name)
+            shutil.move(old_output, new_output)
+            self.selector.writer.release_path(Path(old_output))
+            return str(new_output)
+
+        if self.identical_to[index]:
+            return old_output
+
+        source = Path(self.paths[index])
+        if not source.exists():
+            return old_output
+
+        photo_datetime = self.datetimes[index]
+        if photo_datetime:
+            output_filename = self.selector.generate_output_filename(
+                source, datetime.fromisoformat(photo_datetime)
+            )
+        else:
+            output_filename = source.name
+        new_output = self.selector.unique_output_path(category_dir, output_filename)
+        try:
+            os.link(source, new_output)
+        except OSError:
+            shutil.copy2(source, new_output)
+        return str(new_output)
+
+    def apply(self) -> int:
+        """分類が変わった写真を移動し、キャッシュと results.csv を更新"""
+        self.selector.setup_output_dirs()
+        categories = self.selector.categories
+
+        moved = 0
+        updates = []
+        # キャッシュにある全写真で results.csv を作り直す（前回中断した分の途中経過も含まれる）
+        results_writer = self.selector.results_writer
+        results_writer.reset()
+        for i, path in enumerate(self.paths):
+            category = categories[self.category_index[i]]
+            output_path = self.relocate(i, category)
+            if output_path != self.output_paths[i]:
+                moved += 1
+
+            total_score = float(self.total_score[i])
+            updates.append((path, total_score, category, output_path, self.dup_best[i]))
+
+            result = {
+                'file_path': path,
+                'filename': Path(path).name,
+                'photo_datetime': datetime.fromisoformat(self.datetimes[i]) if self.datetimes[i] else None,
+                'category': category,
+                'total_score': total_score,
+                'output_path': output_path or '',
+            }
+            if self.identical_to[i]:
+                result['identical_to'] = self.identical_to[i]
+            if self.dup_groups[i] is not None:
+                result['dup_group'] = self.dup_groups[i]
+                result['dup_best'] = self.dup_best[i]
+            for name, values in self.scores.items():
+                result[name] = bool(values[i]) if name == 'has_face' else float(values[i])
+            results_writer.write(result)
+
+        self.selector.cache.update_results(updates)
+        self.selector.save_results_csv()
+        return moved
+
+    def run(self, dry_run: bool = False):
+        """再採点・再分類を実行"""
+        print("=" * 60)
+        print("Photo Selector - 再採点・再分類")
+        print("=" * 60)
+
+        self.load()
+        print(f"\n出力フォルダ: {self.selector.output_dir}")
+        print(f"再採点の対象: {len(self.paths)}枚")
+        if self.skipped:
+            print(f"計測値がないためスキップ: {self.skipped}枚")
+
+        if not self.paths:
+            print("再採点できる写真がありません。")
+            return
+
+        self.compute_component_scores()
+        self.compute_totals()
+
+        counts = np.bincount(self.category_index, minlength=len(self.selector.categories))
+        print("\n" + "=" * 60)
+        print("新しい分類" + ("（確認のみ）" if dry_run else ""))
+        print("=" * 60)
+        for category, count in zip(self.selector.categories, counts):
+            print(f"  {category}: {count}枚")
+
+        if dry_run:
+            return
+
+        moved = self.apply()
+        print(f"\n移動したファイル: {moved}枚")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog='photo_selector.py rescore',
+        description='保存済みの計測値から、配点・閾値を変えて再採点・再分類します（画像は読み込みません）。'
+    )
+    parser.add_argument(
+        '--output', '-o',
+        required=True,
+        help='出力フォルダのパス（前回の分類結果と .features.db があるフォルダ）'
+    )
+    parser.add_argument(
+        '--config', '-c',
+        help='配点・閾値を書いたJSONファイル'
+    )
+    parser.add_argument(
+        '--thresholds',
+        help='分類の閾値6つをカンマ区切りで指定（例: 80,70,60,50,40,30）'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='ファイルを移動せず、新しい分類の枚数だけを表示'
+    )
+    args = parser.parse_args(argv)
+
+    if not (Path(args.output) / '.features.db').exists():
+        print(f"エラー: 計測値のキャッシュが見つかりません: {Path(args.output) / '.features.db'}")
+        sys.exit(1)
+
+    # 再採点では入力フォルダは使わない（元ファイルのパスはキャッシュに記録済み）
+    selector = PhotoSelector(
+        input_dir=args.output,
+        output_dir=args.output,
+        scoring_config=args.config
+    )
+    if args.thresholds:
+        selector.thresholds = [float(v) for v in args.thresholds.split(',')]
+
+    Rescorer(selector).run(dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
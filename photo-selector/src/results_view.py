@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Results View - 評価結果のサムネイル一覧（GUI版）
+results.csv の写真をサムネイルで一覧表示し、分類での絞り込みとスコア・撮影日時での並べ替えができます。
+画面に見えている行のサムネイルだけを別スレッドで読み込み（評価のときに作ったディスクキャッシュから。なければ作る）、
+メモリ上には最近表示した一定数だけを残すため、5万枚の結果でも軽く、メモリ使用量も増え続けません。
+"""
+
+import csv
+import operator
+import os
+import subprocess
+import sys
+import threading
+import tkinter as tk
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import customtkinter as ctk
+
+from results_writer import FIELD_MAPPING
+
+# 一覧のマス目の大きさ（ピクセル）と、サムネイルの下に表示する文字の高さ
+CELL_SIZE = 176
+THUMBNAIL_DISPLAY_SIZE = 160
+LABEL_HEIGHT = 34
+# メモリ上に残すサムネイルの数（見えている分の数倍。古いものから捨てる）
+MEMORY_THUMBNAILS = 300
+# 読み込んだサムネイルを画面に反映する間隔（ミリ秒）
+LOAD_INTERVAL_MS = 50
+THUMBNAIL_DIR_NAME = '.thumbnails'
+
+ALL_CATEGORIES = 'すべて'
+# 並べ替えの表示名 -> (並べ替える項目, 降順かどうか)
+SORT_ORDERS = {
+    'スコアの高い順': ('total_score', True),
+    'スコアの低い順': ('total_score', False),
+    '撮影日時の古い順': ('photo_datetime', False),
+    '撮影日時の新しい順': ('photo_datetime', True),
+}
+
+
+class ResultEntry(NamedTuple):
+    """results.csv の1行（一覧の表示に使う項目だけ）"""
+    filename: str
+    photo_datetime: str
+    category: str
+    total_score: float
+    file_path: str
+    output_path: str
+
+    @property
+    def image_path(self) -> str:
+        """サムネイルを作る写真（元の写真がなければ出力先。move で出力した場合など）"""
+        if self.file_path and os.path.exists(self.file_path):
+            return self.file_path
+        return self.output_path or self.file_path
+
+
+def load_results(csv_path: Path) -> List[ResultEntry]:
+    """results.csv を読み込む（日本語ヘッダー）"""
+    columns = {key: FIELD_MAPPING[key] for key in ResultEntry._fields}
+    entries = []
+    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            try:
+                score = float(row.get(columns['total_score']) or 0)
+            except ValueError:
+                score = 0.0
+            entries.append(ResultEntry(
+                filename=row.get(columns['filename'], ''),
+                photo_datetime=row.get(columns['photo_datetime'], ''),
+                category=row.get(columns['category'], ''),
+                total_score=score,
+                file_path=row.get(columns['file_path'], ''),
+                output_path=row.get(columns['output_path'], ''),
+            ))
+    return entries
+
+
+def open_file(path: str):
+    """OS標準のアプリで写真を開く"""
+    if sys.platform == 'darwin':
+        subprocess.Popen(['open', path])
+    elif sys.platform == 'win32':
+        os.startfile(path)
+    else:
+        subprocess.Popen(['xdg-open', path])
+
+
+class ThumbnailLoader:
+    """
+    サムネイルを読み込む別スレッド
+    画面側は見えている写真だけを request() で依頼し、読み込んだ画像を drain() でまとめて受け取る
+    （スクロールで見えなくなった写真の依頼は、新しい依頼で置き換えて読み込まない）
+    """
+
+    def __init__(self, cache_dir: Path, cache_options: Optional[dict] = None,
+                 display_size: int = THUMBNAIL_DISPLAY_SIZE):
+        self.cache_dir = cache_dir
+        # ThumbnailCache の設定（大きさ・容量の上限。評価のときと同じ値にすると、作り直さずに使える）
+        self.cache_options = cache_options or {}
+        self.display_size = display_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._requests: deque = deque()
+        self._loaded: deque = deque()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, paths: List[str]):
+        """読み込む写真を置き換える（前回の依頼のうち、まだ読み込んでいないものは捨てる）"""
+        with self._lock:
+            self._requests = deque(paths)
+        self._wake.set()
+
+    def drain(self) -> list:
+        """読み込み済みの (写真のパス, PIL画像) を取り出す（読み込めなかった写真は画像が None）"""
+        with self._lock:
+            loaded = list(self._loaded)
+            self._loaded.clear()
+        return loaded
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+
+    def _run(self):
+        # OpenCV・Pillowはこのスレッドで読み込む（画面を待たせない）
+        from PIL import Image
+        from thumbnails import ThumbnailCache
+
+        cache = ThumbnailCache(self.cache_dir, **self.cache_options)
+        while not self._closed:
+            with self._lock:
+                path = self._requests.popleft() if self._requests else None
+            if path is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            image = None
+            try:
+                thumbnail = cache.ensure(Path(path))
+                if thumbnail is not None:
+                    with Image.open(thumbnail) as img:
+                        img.thumbnail((self.display_size, self.display_size))
+                        image = img.convert('RGB')
+            except Exception:
+                image = None
+            with self._lock:
+                self._loaded.append((path, image))
+        # 一覧で新しく作ったサムネイルの分も含めて、容量の上限を超えていれば古いものから削除
+        try:
+            cache.evict()
+        finally:
+            cache.close()
+
+
+class ResultsView(ctk.CTkToplevel):
+    """評価結果のサムネイル一覧のウィンドウ"""
+
+    def __init__(self, master, output_dir: Path, entries: List[ResultEntry],
+                 thumbnail_dir: Optional[Path] = None, cache_options: Optional[dict] = None):
+        """
+        thumbnail_dir: サムネイルのキャッシュのフォルダ（省略時は出力フォルダの .thumbnails）
+        cache_options: ThumbnailCache の設定（評価したときの大きさ・容量の上限）
+        """
+        super().__init__(master)
+        self.title(f"評価結果 - {output_dir}")
+        self.geometry("1000x720")
+        self.minsize(600, 400)
+
+        self.entries = entries
+        self.visible: List[ResultEntry] = []
+        self.categories = sorted({entry.category for entry in entries})
+        self.filter = ctk.StringVar(value=ALL_CATEGORIES)
+        self.sort_order = ctk.StringVar(value=next(iter(SORT_ORDERS)))
+
+        # 一覧の表示位置（先頭からのピクセル数）と列数
+        self.offset = 0
+        self.columns = 1
+        self.selected: Optional[int] = None
+
+        # 最近表示したサムネイル（写真のパス -> PhotoImage、古いものから捨てる）
+        self.thumbnails: OrderedDict = OrderedDict()
+        # 読み込めなかった写真（同じく最近のものだけを残す。捨てた写真は次に見えたときに読み込み直す）
+        self.failed: OrderedDict = OrderedDict()
+        self.loader = ThumbnailLoader(thumbnail_dir or output_dir / THUMBNAIL_DIR_NAME, cache_options)
+        # 画面のマス目ごとに使い回すキャンバスの図形（見えている分だけ作る）
+        self._cells: List[Dict[str, int]] = []
+
+        self._create_widgets()
+        self._apply_filter()
+        self._poll_id = self.after(LOAD_INTERVAL_MS, self._poll_thumbnails)
+
+    def _create_widgets(self):
+        """UIウィジェットを作成"""
+        toolbar = ctk.CTkFrame(self, fg_color="transparent")
+        toolbar.pack(fill="x", padx=10, pady=(10, 5))
+
+        ctk.CTkLabel(toolbar, text="分類").pack(side="left")
+        counts = {category: 0 for category in self.categories}
+        for entry in self.entries:
+            counts[entry.category] += 1
+        self._filter_labels = {f"{ALL_CATEGORIES}（{len(self.entries)}枚）": ALL_CATEGORIES}
+        for category in self.categories:
+            self._filter_labels[f"{category}（{counts[category]}枚）"] = category
+        ctk.CTkOptionMenu(
+            toolbar,
+            values=list(self._filter_labels),
+            command=self._on_filter_change,
+            width=200
+        ).pack(side="left", padx=(5, 20))
+
+        ctk.CTkLabel(toolbar, text="並べ替え").pack(side="left")
+        ctk.CTkOptionMenu(
+            toolbar,
+            values=list(SORT_ORDERS),
+            variable=self.sort_order,
+            command=lambda _: self._apply_filter(),
+            width=170
+        ).pack(side="left", padx=5)
+
+        self.count_label = ctk.CTkLabel(toolbar, text="", text_color="gray")
+        self.count_label.pack(side="right")
+
+        grid_frame = ctk.CTkFrame(self)
+        grid_frame.pack(fill="both", expand=True, padx=10, pady=5)
+
+        self.canvas = tk.Canvas(grid_frame, highlightthickness=0, background="#2b2b2b")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar = ctk.CTkScrollbar(grid_frame, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.canvas.bind("<Configure>", lambda _: self._redraw())
+        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind("<Button-4>", lambda _: self._scroll_by(-CELL_SIZE // 2))
+        self.canvas.bind("<Button-5>", lambda _: self._scroll_by(CELL_SIZE // 2))
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<Double-Button-1>", self._on_double_click)
+
+        self.detail_label = ctk.CTkLabel(
+            self,
+            text="写真をクリックすると詳細を表示します（ダブルクリックで開く）",
+            text_color="gray",
+            anchor="w"
+        )
+        self.detail_label.pack(fill="x", padx=10, pady=(0, 10))
+
+    # --- 絞り込み・並べ替え ---
+
+    def _on_filter_change(self, label: str):
+        self.filter.set(self._filter_labels[label])
+        self._apply_filter()
+
+    def _apply_filter(self):
+        """分類で絞り込み、並べ替えて先頭から表示"""
+        category = self.filter.get()
+        if category == ALL_CATEGORIES:
+            visible = list(self.entries)
+        else:
+            visible = [entry for entry in self.entries if entry.category == category]
+        field, reverse = SORT_ORDERS[self.sort_order.get()]
+        key = operator.attrgetter(field)
+        if field == 'photo_datetime':
+            # 撮影日時のない写真は、どちらの順でも最後にする
+            dated = [entry for entry in visible if entry.photo_datetime]
+            undated = [entry for entry in visible if not entry.photo_datetime]
+            visible = sorted(dated, key=key, reverse=reverse) + undated
+        else:
+            visible.sort(key=key, reverse=reverse)
+        self.visible = visible
+        self.offset = 0
+        self.selected = None
+        self.count_label.configure(text=f"{len(visible)}枚")
+        self._redraw()
+
+    # --- スクロール ---
+
+    def _content_height(self) -> int:
+        rows = (len(self.visible) + self.columns - 1) // self.columns
+        return rows * CELL_SIZE
+
+    def _max_offset(self) -> int:
+        return max(0, self._content_height() - self.canvas.winfo_height())
+
+    def _scroll_to(self, offset: float):
+        self.offset = int(min(max(0, offset), self._max_offset()))
+        self._redraw()
+
+    def _scroll_by(self, pixels: int):
+        self._scroll_to(self.offset + pixels)
+
+    def _on_mousewheel(self, event):
+        # Windowsは1目盛り120、macOSは1〜数
+        delta = event.delta if sys.platform == 'darwin' else event.delta // 120
+        self._scroll_by(-delta * CELL_SIZE // 2)
+
+    def _on_scrollbar(self, action: str, value, unit: Optional[str] = None):
+        if action == 'moveto':
+            self._scroll_to(float(value) * self._content_height())
+        elif action == 'scroll':
+            step = self.canvas.winfo_height() if unit == 'pages' else CELL_SIZE // 2
+            self._scroll_by(int(value) * step)
+
+    # --- 描画 ---
+
+    def _redraw(self):
+        """見えている行のマス目だけを描画し、足りないサムネイルの読み込みを依頼"""
+        width = max(1, self.canvas.winfo_width())
+        height = max(1, self.canvas.winfo_height())
+        self.columns = max(1, width // CELL_SIZE)
+        self.offset = min(self.offset, self._max_offset())
+
+        first_row = self.offset // CELL_SIZE
+        last_row = (self.offset + height) // CELL_SIZE
+        first = first_row * self.columns
+        last = min(len(self.visible), (last_row + 1) * self.columns)
+        slots = max(0, last - first)
+        self._ensure_cells(slots)
+
+        missing = []
+        for slot, cell in enumerate(self._cells):
+            index = first + slot
+            if index >= last:
+                for item in cell.values():
+                    self.canvas.itemconfigure(item, state="hidden")
+                continue
+            entry = self.visible[index]
+            row, column = divmod(index, self.columns)
+            x = column * CELL_SIZE
+            y = row * CELL_SIZE - self.offset
+            center_x = x + CELL_SIZE // 2
+            image_center_y = y + (CELL_SIZE - LABEL_HEIGHT) // 2 + 4
+
+            self.canvas.coords(cell['frame'], x + 2, y + 2, x + CELL_SIZE - 2, y + CELL_SIZE - 2)
+            self.canvas.itemconfigure(
+                cell['frame'], state="normal",
+                outline="#1f6aa5" if index == self.selected else "#3a3a3a"
+            )
+            self.canvas.coords(cell['image'], center_x, image_center_y)
+            self.canvas.coords(cell['label'], center_x, y + CELL_SIZE - LABEL_HEIGHT // 2 - 2)
+            self.canvas.itemconfigure(
+                cell['label'], state="normal",
+                text=f"{entry.total_score:.1f}点 {entry.category.split('_')[0]}\n{entry.filename[:22]}"
+            )
+
+            path = entry.image_path
+            photo = self.thumbnails.get(path)
+            if photo is not None:
+                self.thumbnails.move_to_end(path)
+                self.canvas.itemconfigure(cell['image'], image=photo, state="normal")
+                self.canvas.itemconfigure(cell['placeholder'], state="hidden")
+            else:
+                self.canvas.itemconfigure(cell['image'], image="", state="hidden")
+                self.canvas.coords(cell['placeholder'], center_x, image_center_y)
+                self.canvas.itemconfigure(
+                    cell['placeholder'], state="normal",
+                    text="読み込めません" if path in self.failed else "読み込み中..."
+                )
+                if path not in self.failed:
+                    missing.append(path)
+
+        self.loader.request(missing)
+        self._update_scrollbar(height)
+
+    def _ensure_cells(self, count: int):
+        """マス目の図形を必要な数だけ作る（作った図形は削除せずに使い回す）"""
+        while len(self._cells) < count:
+            self._cells.append({
+                'frame': self.canvas.create_rectangle(0, 0, 0, 0, outline="#3a3a3a", width=2),
+                'image': self.canvas.create_image(0, 0, anchor="center"),
+                'placeholder': self.canvas.create_text(0, 0, fill="gray", text=""),
+                'label': self.canvas.create_text(0, 0, fill="#dce4ee", justify="center",
+                                                 font=("TkDefaultFont", 10), text=""),
+            })
+
+    def _update_scrollbar(self, height: int):
+        total = self._content_height()
+        if total <= height:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + height) / total)
+
+    def _poll_thumbnails(self):
+        """読み込み済みのサムネイルを画面に反映（UIスレッド）"""
+        loaded = self.loader.drain()
+        if loaded:
+            from PIL import ImageTk
+            for path, image in loaded:
+                if image is None:
+                    self.failed[path] = True
+                    self.failed.move_to_end(path)
+                    continue
+                self.thumbnails[path] = ImageTk.PhotoImage(image)
+                self.thumbnails.move_to_end(path)
+            # 見えている分は残し、古いものから捨てる
+            limit = max(MEMORY_THUMBNAILS, len(self._cells) * 2)
+            for recent in (self.thumbnails, self.failed):
+                while len(recent) > limit:
+                    recent.popitem(last=False)
+            self._redraw()
+        self._poll_id = self.after(LOAD_INTERVAL_MS, self._poll_thumbnails)
+
+    # --- 選択 ---
+
+    def _index_at(self, x: int, y: int) -> Optional[int]:
+        column = x // CELL_SIZE
+        if column >= self.columns:
+            return None
+        index = (y + self.offset) // CELL_SIZE * self.columns + column
+        return index if index < len(self.visible) else None
+
+    def _on_click(self, event):
+        index = self._index_at(event.x, event.y)
+        self.selected = index
+        if index is not None:
+            entry = self.visible[index]
+            text = f"{entry.filename}  {entry.category}  {entry.total_score:.1f}点"
+            if entry.photo_datetime:
+                text += f"  {entry.photo_datetime}"
+            text += f"  {entry.output_path or entry.file_path}"
+            self.detail_label.configure(text=text)
+        self._redraw()
+
+    def _on_double_click(self, event):
+        index = self._index_at(event.x, event.y)
+        if index is None:
+            return
+        entry = self.visible[index]
+        path = entry.output_path if entry.output_path and os.path.exists(entry.output_path) else entry.file_path
+        try:
+            open_file(path)
+        except OSError as e:
+            self.detail_label.configure(text=f"開けませんでした: {e}")
+
+    def destroy(self):
+        """ウィンドウを閉じる（読み込みスレッドを止め、サムネイルを捨てる）"""
+        self.after_cancel(self._poll_id)
+        self.loader.close()
+        self.thumbnails.clear()
+        self.failed.clear()
+        super().destroy()
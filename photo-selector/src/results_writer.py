@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Results Writer - 評価結果の逐次保存
+評価結果を1枚ごとにNDJSON（1行1件のJSON）として追記し、途中で止まっても結果が残るようにします。
+最後に、メモリ使用量を一定に保つ外部マージソートで撮影日時順の results.csv を作成します。
+"""
+
+import csv
+import heapq
+import itertools
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Iterator, List, Optional
+
+# 英語キーと日本語ヘッダーのマッピング
+FIELD_MAPPING = {
+    'filename': 'ファイル名',
+    'photo_datetime': '撮影日時',
+    'category': '分類',
+    'total_score': '総合スコア',
+    'rank': '順位',
+    'has_face': '顔検出',
+    'sharpness': 'シャープさ',
+    'exposure': '露出',
+    'contrast': 'コントラスト',
+    'face_score': '顔サイズ',
+    'eyes_open': '目の開閉',
+    'smile': '笑顔',
+    'composition': '構図',
+    'dup_group': '重複グループ',
+    'dup_best': '重複の代表',
+    'identical_to': '同一ファイルの元',
+    'file_path': '元ファイルパス',
+    'output_path': '出力先パス'
+}
+
+SCORE_KEYS = {'total_score', 'sharpness', 'exposure', 'contrast',
+              'face_score', 'eyes_open', 'smile', 'composition'}
+
+
+def _sort_key(record: dict) -> str:
+    """撮影日時の並べ替えキー（ISO形式の文字列は辞書順 = 時刻順。日時なしは先頭）"""
+    return record.get('photo_datetime') or ''
+
+
+class ResultsWriter:
+    """評価結果をNDJSONで逐次保存し、撮影日時順のCSVを作成するクラス"""
+
+    def __init__(self, output_dir: Path, stream: Optional[IO[str]] = None, chunk_size: int = 50000):
+        self.output_dir = Path(output_dir)
+        # 途中経過の保存先（CSVを作成し終えるまで残す。前回中断した分も引き継ぐ）
+        self.spool_path = self.output_dir / '.results.ndjson'
+        # 追加の出力先（--ndjson で指定したファイルや標準出力）
+        self.stream = stream
+        # 外部ソートで1度にメモリに載せる件数
+        self.chunk_size = chunk_size
+        self._spool = None
+        self.count = 0
+
+    @staticmethod
+    def to_record(result: dict) -> dict:
+        """評価結果をJSONに変換できる形にする（計測値の詳細は含めない）"""
+        record = {key: result[key] for key in FIELD_MAPPING if key in result}
+        photo_datetime = record.get('photo_datetime')
+        if isinstance(photo_datetime, datetime):
+            record['photo_datetime'] = photo_datetime.isoformat()
+        return record
+
+    def write(self, result: dict):
+        """評価結果を1件追記（すぐにファイルへ書き出す）"""
+        line = json.dumps(self.to_record(result), ensure_ascii=False) + '\n'
+
+        if self._spool is None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._spool = open(self.spool_path, 'a', encoding='utf-8')
+        self._spool.write(line)
+        self._spool.flush()
+
+        if self.stream is not None:
+            try:
+                self.stream.write(line)
+                self.stream.flush()
+            except OSError as e:
+                # 読み手が先に終了した（`| head` など）・書き込めなくなった場合は、追加の出力先への書き出しだけをやめる
+                # （途中経過と results.csv は引き続き保存する）
+                self._drop_stream(e)
+        self.count += 1
+
+    def _drop_stream(self, error: OSError):
+        """追加の出力先への書き出しをやめる"""
+        stream, self.stream = self.stream, None
+        if isinstance(error, BrokenPipeError):
+            # 書き残したバッファを終了時に書き出そうとして再びエラーにならないよう、
+            # 出力先を /dev/null に差し替える
+            try:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, stream.fileno())
+                os.close(devnull)
+            except (OSError, ValueError, AttributeError):
+                pass
+        else:
+            print(f"警告: 評価結果の出力先に書き込めなくなったため、出力をやめます: {error}", file=sys.stderr)
+
+    def sync(self) -> int:
+        """
+        途中経過をディスクに同期（fsync）
+        Returns: 途中経過のファイルサイズ（バイト）
+        """
+        if self._spool is not None:
+            self._spool.flush()
+            os.fsync(self._spool.fileno())
+        try:
+            return self.spool_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def rollback(self, size: int):
+        """途中経過を指定のサイズまで切り詰める（最後に確定した時点より後の行を捨てる）"""
+        self.close()
+        try:
+            if self.spool_path.stat().st_size > size:
+                os.truncate(self.spool_path, size)
+        except FileNotFoundError:
+            pass
+
+    def reset(self):
+        """途中経過を破棄して最初から書き直す"""
+        self.close()
+        if self.spool_path.exists():
+            self.spool_path.unlink()
+        self.count = 0
+
+    def close(self):
+        """途中経過のファイルを閉じる"""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def _read_spool(self) -> Iterator[dict]:
+        with open(self.spool_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で止まった最後の行は読み飛ばす
+                    continue
+
+    def _sorted_records(self, temp_dir: str) -> Iterator[dict]:
+        """途中経過を撮影日時順に並べ替えて返す（chunk_size件ずつソートしてからマージ）"""
+        chunk_files: List[str] = []
+        chunk: List[dict] = []
+
+        def flush_chunk():
+            chunk.sort(key=_sort_key)
+            path = os.path.join(temp_dir, f'chunk_{len(chunk_files):05d}.ndjson')
+            with open(path, 'w', encoding='utf-8') as f:
+                for record in chunk:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            chunk_files.append(path)
+            chunk.clear()
+
+        for record in self._read_spool():
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                flush_chunk()
+
+        if not chunk_files:
+            # 1チャンクに収まる場合はメモリ上で並べ替える
+            chunk.sort(key=_sort_key)
+            yield from chunk
+            return
+        if chunk:
+            flush_chunk()
+
+        def read_chunk(path: str) -> Iterator[dict]:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+
+        # heapq.merge は同じキーなら先のチャンクを優先するため、元の順序が保たれる
+        yield from heapq.merge(*(read_chunk(path) for path in chunk_files), key=_sort_key)
+
+    @staticmethod
+    def format_row(record: dict) -> list:
+        """CSVの1行分に整形"""
+        row = []
+        for key in FIELD_MAPPING:
+            value = record.get(key, '')
+            if key == 'photo_datetime' and value:
+                value = datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+            elif key == 'has_face':
+                value = 'あり' if value else 'なし'
+            elif key == 'dup_best' and value != '':
+                value = '○' if value else ''
+            elif key in SCORE_KEYS:
+                # 整数（満点・読み込めなかった写真の0点など）も小数点以下1桁にそろえる
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    value = f'{value:.1f}'
+            row.append(value)
+        return row
+
+    def write_csv(self, csv_path: Path) -> int:
+        """
+        撮影日時順の results.csv を作成し、途中経過のファイルを削除
+        Returns: 書き込んだ件数
+        """
+        self.close()
+        if not self.spool_path.exists():
+            return 0
+
+        written = 0
+        tmp_path = csv_path.with_name(csv_path.name + '.tmp')
+        with tempfile.TemporaryDirectory(dir=self.output_dir, prefix='.sort_') as temp_dir:
+            with open(tmp_path, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.writer(f)
+                # 日本語ヘッダーを書き込み
+                writer.writerow(list(FIELD_MAPPING.values()))
+                # 中断後の再評価で同じ写真が2回記録されている場合は後の結果を使う
+                # （同じ写真は撮影日時も同じなので、日時が同じ範囲の中だけを比べればよい）
+                for _, same_time in itertools.groupby(self._sorted_records(temp_dir), key=_sort_key):
+                    latest = {}
+                    for record in same_time:
+                        latest[record.get('file_path')] = record
+                    for record in latest.values():
+                        writer.writerow(self.format_row(record))
+                        written += 1
+
+        if written == 0:
+            tmp_path.unlink()
+            return 0
+
+        # 書き終えてから置き換える（途中で止まっても前回のCSVは壊れない）
+        os.replace(tmp_path, csv_path)
+        self.spool_path.unlink()
+        self.count = 0
+        return written
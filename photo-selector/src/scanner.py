@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Scanner - 入力フォルダの走査
+os.scandir でフォルダを1回だけたどり、対象の画像ファイルを見つけた順に返します。
+拡張子は大文字・小文字を区別せずに判定し、処理済みのファイルは走査中に除外します。
+"""
+
+import os
+from pathlib import Path
+from typing import Callable, Collection, Iterable, Iterator, List, Optional, Set, Tuple
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class ImageScanner:
+    """
+    入力フォルダ以下の画像ファイルを順に返すクラス（ジェネレーターとして使う）
+    各フォルダ内は名前順にたどるため、全体の順序はパスを並べ替えた場合と同じになる
+    """
+
+    def __init__(self, root: Path, extensions: Iterable[str] = IMAGE_EXTENSIONS,
+                 skip: Optional[Collection[str]] = None, exclude_dirs: Iterable[Path] = (),
+                 on_skip: Optional[Callable[[str], None]] = None):
+        self.root = Path(root)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        # 処理済みのファイル（パスの文字列）
+        self.skip = skip if skip is not None else set()
+        # たどらないフォルダ（入力フォルダ内に出力フォルダがある場合など）
+        self.exclude_dirs = {os.path.realpath(d) for d in exclude_dirs}
+        # 処理済みとして除外したファイルごとに呼ぶ関数（同一ファイルの検出などに使う）
+        self.on_skip = on_skip
+        self.found = 0    # 見つかった画像の数
+        self.skipped = 0  # 処理済みとして除外した数
+
+    def _scan_dir(self, path: str) -> List[Tuple[str, str, bool]]:
+        """フォルダ内の (名前, パス, フォルダかどうか) を名前順に取得"""
+        entries = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            entries.append((entry.name, entry.path, True))
+                        elif entry.name.lower().endswith(self.extensions) and entry.is_file():
+                            entries.append((entry.name, entry.path, False))
+                    except OSError:
+                        continue
+        except OSError:
+            # 読めないフォルダは飛ばす
+            return []
+        entries.sort()
+        return entries
+
+    def __iter__(self) -> Iterator[Path]:
+        visited: Set[Tuple[int, int]] = set()
+
+        def enter(path: str) -> bool:
+            """フォルダに入ってよいか（除外対象・シンボリックリンクの循環を避ける）"""
+            if self.exclude_dirs and os.path.realpath(path) in self.exclude_dirs:
+                return False
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            key = (st.st_dev, st.st_ino)
+            if key in visited:
+                return False
+            visited.add(key)
+            return True
+
+        if not enter(str(self.root)):
+            return
+
+        stack = [iter(self._scan_dir(str(self.root)))]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+            _, path, is_dir = item
+            if is_dir:
+                if enter(path):
+                    stack.append(iter(self._scan_dir(path)))
+                continue
+
+            self.found += 1
+            if path in self.skip:
+                self.skipped += 1
+                if self.on_skip is not None:
+                    self.on_skip(path)
+                continue
+            yield Path(path)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Startup Report - GUI版の起動時間の確認
+python -X importtime と同じ方法でモジュールごとの読み込み時間を計測し、ウィンドウが表示されるまでの時間が
+基準（--budget 秒）に収まっているかを確認します。OpenCV・NumPy等の重いモジュールがウィンドウの表示前に
+読み込まれるようになっていないかも確認します（評価処理はウィンドウの表示後に別スレッドで読み込む）。
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+SRC_DIR = Path(__file__).resolve().parent
+
+# ウィンドウの表示前に読み込まれてはいけないモジュール（評価処理の読み込みで初めて必要になる）
+HEAVY_MODULES = ['cv2', 'numpy', 'PIL', 'tqdm', 'photo_selector']
+
+
+class ImportTime(NamedTuple):
+    """-X importtime の1行（時間はマイクロ秒）"""
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(output: str) -> List[ImportTime]:
+    """-X importtime の出力（'import time: self [us] | cumulative | imported package'）を解析"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            # 見出しの行
+            continue
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        entries.append(ImportTime(stripped.rstrip(), self_us, cumulative_us, depth))
+    return entries
+
+
+def import_report(module: str) -> Optional[dict]:
+    """
+    新しいプロセスで module を読み込み、読み込み時間と、その間に読み込まれたモジュールを調べる
+    Returns: {'cumulative': 秒, 'children': [(モジュール名, 秒), ...], 'modules': [モジュール名, ...]}
+             （読み込めない場合は {'error': メッセージ}）
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SRC_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else f'終了コード {result.returncode}'}
+
+    # 出力は読み込みが終わった順（子が先、親が後）。module の行までの、直前の最上位の行より後が module の読み込み分
+    entries = parse_importtime(result.stderr)
+    start = 0
+    for index, entry in enumerate(entries):
+        if entry.depth == 0 and entry.name == module:
+            own = entries[start:index]
+            children = sorted((e for e in own if e.depth == 1), key=lambda e: e.cumulative_us, reverse=True)
+            return {
+                'cumulative': entry.cumulative_us / 1e6,
+                'children': [(e.name, e.cumulative_us / 1e6) for e in children],
+                'modules': [e.name for e in own] + [module],
+            }
+        if entry.depth == 0:
+            start = index + 1
+    return {'error': f'{module} の読み込み時間が見つかりません'}
+
+
+def cascade_load_time() -> Optional[float]:
+    """顔検出器（Haar Cascade）の読み込み時間（秒、評価処理の読み込み後）"""
+    code = (
+        'import time, photo_selector\n'
+        'start = time.perf_counter()\n'
+        'photo_selector.load_cascades()\n'
+        'print(time.perf_counter() - start)\n'
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=SRC_DIR, capture_output=True, text=True)
+    try:
+        return float(result.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return None
+
+
+def window_report(timeout: float = 60) -> Dict[str, object]:
+    """
+    GUIを起動し、ウィンドウが表示されるまでと、評価処理の読み込みが終わるまでの時間を計測
+    （プロセスの起動から。画面のない環境やCustomTkinterがない場合は {'error': ...}）
+    """
+    launched = time.time()
+    try:
+        result = subprocess.run(
+            [sys.executable, str(SRC_DIR / 'photo_selector_gui.py'), '--startup-check'],
+            cwd=SRC_DIR, capture_output=True, text=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return {'error': f'{timeout:.0f}秒以内にウィンドウが表示されませんでした'}
+
+    times = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition(' ')
+        if key in ('window_shown', 'engine_ready'):
+            times[key] = float(value) - launched
+        elif key == 'engine_error':
+            times['engine_error'] = value
+    if 'window_shown' not in times:
+        lines = result.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else 'ウィンドウを表示できませんでした'}
+    return times
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description='GUI版の起動時間（モジュールの読み込み時間・ウィンドウが表示されるまでの時間）を確認します。'
+    )
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=2.0,
+        help='ウィンドウが表示されるまでの時間の基準（秒、デフォルト: 2.0）。超えると終了コード1で終わる'
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=10,
+        help='表示する読み込み時間の長いモジュールの数（デフォルト: 10）'
+    )
+    parser.add_argument(
+        '--no-window',
+        action='store_true',
+        help='GUIを起動せず、モジュールの読み込み時間だけを確認する'
+    )
+    parser.add_argument(
+        '--output', '-o',
+        help='結果を保存するJSONファイル'
+    )
+    args = parser.parse_args(argv)
+
+    failures = []
+    report = {'budget': args.budget}
+
+    # ウィンドウの表示前に必要な読み込み（GUIのモジュール）
+    gui = import_report('photo_selector_gui')
+    report['gui_import'] = gui
+    print("ウィンドウの表示前の読み込み（photo_selector_gui）:")
+    if 'error' in gui:
+        print(f"  読み込めません: {gui['error']}")
+        failures.append('GUIのモジュールを読み込めません')
+    else:
+        print(f"  合計: {gui['cumulative'] * 1000:.0f}ms")
+        for name, seconds in gui['children'][:args.top]:
+            print(f"    {seconds * 1000:8.1f}ms  {name}")
+        heavy = [name for name in HEAVY_MODULES if name in gui['modules']]
+        if heavy:
+            print(f"  注意: ウィンドウの表示前に重いモジュールを読み込んでいます: {', '.join(heavy)}")
+            failures.append(f"ウィンドウの表示前に {', '.join(heavy)} を読み込んでいます")
+
+    # ウィンドウの表示後に別スレッドで行う読み込み（評価処理・顔検出器）
+    engine = import_report('photo_selector')
+    cascades = cascade_load_time()
+    report['engine_import'] = engine
+    report['cascade_load'] = cascades
+    print("\nウィンドウの表示後の読み込み（別スレッド）:")
+    if 'error' in engine:
+        print(f"  読み込めません: {engine['error']}")
+    else:
+        print(f"  評価処理（photo_selector）: {engine['cumulative'] * 1000:.0f}ms")
+        for name, seconds in engine['children'][:args.top]:
+            print(f"    {seconds * 1000:8.1f}ms  {name}")
+    if cascades is not None:
+        print(f"  顔検出器（Haar Cascade）: {cascades * 1000:.0f}ms")
+
+    # ウィンドウが表示されるまでの時間（プロセスの起動から）
+    if not args.no_window:
+        window = window_report()
+        report['window'] = window
+        print("\nGUIの起動:")
+        if 'error' in window:
+            print(f"  計測できません: {window['error']}")
+            failures.append('ウィンドウが表示されるまでの時間を計測できません')
+        else:
+            print(f"  ウィンドウが表示されるまで: {window['window_shown']:.2f}秒（基準 {args.budget:.2f}秒）")
+            if 'engine_ready' in window:
+                print(f"  評価処理の準備が終わるまで: {window['engine_ready']:.2f}秒")
+            if window['window_shown'] > args.budget:
+                failures.append(f"ウィンドウの表示に {window['window_shown']:.2f}秒かかりました（基準 {args.budget:.2f}秒）")
+
+    report['failures'] = failures
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+    if failures:
+        print("\n不合格:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n合格")
+
+
+if __name__ == '__main__':
+    main()
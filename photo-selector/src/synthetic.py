@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Synthetic - ベンチマーク用の合成写真の生成
+乱数の種から毎回同じ写真（解像度・ぼけ・露出・コントラスト・顔のような図形の数を変えたもの）を作ります。
+実際の写真を用意しなくても、変更の前後で評価の速さや結果を同じ条件で比べられます。
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+
+# 生成する写真の条件の候補（写真ごとに乱数の種から選ぶ）
+BLUR_SIGMAS = (0.0, 0.0, 1.5, 4.0)        # ぼけ（長辺1024px相当のガウスぼかしのσ）
+EXPOSURES = (-1.5, -0.5, 0.0, 0.0, 0.7)   # 露出（EV。明るさを 2^EV 倍）
+CONTRASTS = (0.4, 1.0, 1.0, 1.4)          # コントラスト（中間の明るさを中心に何倍に広げるか）
+FACE_COUNTS = (0, 0, 1, 1, 2, 3)          # 顔のような図形の数
+
+# 撮影日時の代わりに使う更新日時（ファイルの並び順を毎回同じにする）
+BASE_MTIME = 1700000000
+
+
+class SyntheticPhoto(NamedTuple):
+    """合成写真1枚の生成条件"""
+    name: str
+    width: int
+    height: int
+    blur: float
+    exposure: float
+    contrast: float
+    faces: int
+
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    """'1024x768,4032x3024' 形式の解像度の指定を [(幅, 高さ), ...] に変換"""
+    sizes = []
+    for item in text.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def draw_face(image: np.ndarray, center: Tuple[int, int], width: int, rng: np.random.Generator):
+    """正面を向いた顔のような図形（肌・髪・眉・目・鼻・口）を描く"""
+    cx, cy = center
+    height = int(width * 1.3)
+    skin = tuple(int(v) for v in rng.integers([120, 150, 190], [160, 190, 235]))
+    hair = tuple(int(v) for v in rng.integers(10, 60, 3))
+
+    # 髪（顔より少し大きな楕円を先に描き、下半分を肌で覆う）
+    cv2.ellipse(image, (cx, cy - height // 10), (width * 6 // 10, height * 6 // 10), 0, 0, 360, hair, -1)
+    cv2.ellipse(image, (cx, cy), (width // 2, height // 2), 0, 0, 360, skin, -1)
+
+    eye_y = cy - height // 10
+    eye_dx = width // 5
+    eye_w = max(2, width // 9)
+    eye_h = max(1, width // 20)
+    for side in (-1, 1):
+        ex = cx + side * eye_dx
+        # 眉・白目・黒目
+        cv2.line(image, (ex - eye_w, eye_y - eye_h * 3), (ex + eye_w, eye_y - eye_h * 3 - side * eye_h // 2),
+                 hair, max(1, width // 30))
+        cv2.ellipse(image, (ex, eye_y), (eye_w, eye_h), 0, 0, 360, (235, 235, 235), -1)
+        cv2.circle(image, (ex, eye_y), max(1, eye_h), (30, 25, 20), -1)
+
+    # 鼻の影と口（笑顔の弧）
+    shadow = tuple(int(v * 0.8) for v in skin)
+    cv2.line(image, (cx, eye_y + eye_h * 2), (cx - width // 20, cy + height // 10), shadow, max(1, width // 40))
+    mouth_y = cy + height // 4
+    cv2.ellipse(image, (cx, mouth_y - height // 20), (width // 5, height // 12), 0, 20, 160,
+                (60, 50, 150), max(1, width // 25))
+
+
+def render(photo: SyntheticPhoto, seed: int) -> np.ndarray:
+    """生成条件から合成写真（BGR）を描く（同じ条件・種なら毎回同じ画素になる）"""
+    rng = np.random.default_rng(seed)
+    width, height = photo.width, photo.height
+
+    # 背景: 低周波のなめらかな色の変化に、図形の輪郭と細かな質感を重ねる
+    base = rng.integers(40, 220, (6, 8, 3)).astype(np.uint8)
+    image = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(12):
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(min(width, height) // 20, min(width, height) // 4))
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x, y), (x + size, y + size * 2 // 3), color, -1)
+        else:
+            cv2.circle(image, (x, y), size // 2, color, -1)
+    texture = rng.normal(0, 6, (height, width, 1)).astype(np.float32)
+    image = np.clip(image.astype(np.float32) + texture, 0, 255).astype(np.uint8)
+
+    # 顔のような図形（短辺の15〜25%の幅で、重ならないよう横に並べる）
+    for index in range(photo.faces):
+        face_w = int(min(width, height) * rng.uniform(0.15, 0.25))
+        slot = width // (photo.faces + 1)
+        cx = slot * (index + 1) + int(rng.integers(-slot // 8, slot // 8 + 1))
+        cy = int(height * rng.uniform(0.35, 0.6))
+        draw_face(image, (cx, cy), face_w, rng)
+
+    if photo.blur:
+        sigma = photo.blur * max(width, height) / 1024
+        image = cv2.GaussianBlur(image, (0, 0), sigma)
+
+    # コントラスト・露出（中間の明るさを中心に広げてから明るさを変える）
+    pixels = image.astype(np.float32)
+    pixels = (pixels - 128) * photo.contrast + 128
+    pixels *= 2 ** photo.exposure
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+class SyntheticCorpus:
+    """
+    ベンチマーク用の合成写真のフォルダ
+    生成条件を manifest.json に保存し、同じ条件ならもう一度作らずにそのまま使う
+    """
+
+    manifest_name = 'manifest.json'
+
+    def __init__(self, root: Path, sizes: Sequence[Tuple[int, int]] = ((1024, 768), (2048, 1536), (4032, 3024)),
+                 count: int = 12, seed: int = 0, quality: int = 92):
+        self.root = Path(root)
+        self.sizes = [tuple(size) for size in sizes]
+        self.count = count  # 解像度ごとの枚数
+        self.seed = seed
+        self.quality = quality
+
+    @property
+    def settings(self) -> dict:
+        return {
+            'sizes': [f'{width}x{height}' for width, height in self.sizes],
+            'count': self.count,
+            'seed': self.seed,
+            'quality': self.quality,
+        }
+
+    def plan(self) -> List[SyntheticPhoto]:
+        """生成する写真の条件の一覧（乱数の種が同じなら毎回同じ）"""
+        rng = np.random.default_rng(self.seed)
+        photos = []
+        for width, height in self.sizes:
+            for index in range(self.count):
+                photos.append(SyntheticPhoto(
+                    name=f'syn_{width}x{height}_{index:03d}.jpg',
+                    width=width,
+                    height=height,
+                    blur=float(rng.choice(BLUR_SIGMAS)),
+                    exposure=float(rng.choice(EXPOSURES)),
+                    contrast=float(rng.choice(CONTRASTS)),
+                    faces=int(rng.choice(FACE_COUNTS)),
+                ))
+        return photos
+
+    def load_manifest(self) -> Dict:
+        try:
+            with open(self.root / self.manifest_name, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def files(self) -> List[Path]:
+        """合成写真のパス一覧（生成順）"""
+        return [self.root / photo.name for photo in self.plan()]
+
+    def ensure(self) -> List[Path]:
+        """
+        合成写真を用意する（条件が変わった場合や欠けている場合だけ生成する）
+        Returns: 合成写真のパス一覧
+        """
+        photos = self.plan()
+        manifest = self.load_manifest()
+        if manifest.get('settings') == self.settings and \
+                all((self.root / photo.name).exists() for photo in photos):
+            return self.files()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        for index, photo in enumerate(photos):
+            path = self.root / photo.name
+            image = render(photo, seed=self.seed * 100003 + index)
+            cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            # 撮影日時がないため更新日時で並ぶ。生成順に1分ずつずらす
+            mtime = BASE_MTIME + index * 60
+            os.utime(path, (mtime, mtime))
+
+        with open(self.root / self.manifest_name, 'w', encoding='utf-8') as f:
+            json.dump({
+                'settings': self.settings,
+                'photos': [photo._asdict() for photo in photos],
+            }, f, ensure_ascii=False, indent=2)
+        return self.files()
+
+    def photos(self) -> Dict[str, SyntheticPhoto]:
+        """ファイル名 -> 生成条件"""
+        return {photo.name: photo for photo in self.plan()}
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Thumbnails - サムネイルのディスクキャッシュ
+評価のためにデコードした画像から小さなJPEGを作り、ファイル内容のハッシュ値をキーにして保存します
+（同じ内容の写真はフォルダや名前が違っても1つのサムネイルを共有する）。
+写真のパスからの検索は、パス・サイズ・更新日時の索引（SQLite）で行うため、元の写真を読み直しません。
+合計サイズが上限を超えたら、最近使われていないものから削除します。
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ingest import image_size, read_file
+from preview import RAW_EXTENSIONS, decode_full, largest_preview
+
+# サムネイルの長辺のピクセル数とJPEGの画質
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 80
+# キャッシュの合計サイズの上限（MB）
+THUMBNAIL_LIMIT_MB = 1024
+# サムネイルの作り方を変えたら上げる（キーに含めるため、古い作り方のサムネイルは使わずに作り直す）
+THUMBNAIL_VERSION = 2
+INDEX_FILE_NAME = 'index.db'
+
+
+def make_thumbnail(image: np.ndarray, size: int = THUMBNAIL_SIZE) -> np.ndarray:
+    """長辺が size ピクセルになるように縮小（小さい画像は拡大しない）"""
+    height, width = image.shape[:2]
+    long_side = max(height, width)
+    if long_side <= size:
+        return image
+    # 原寸の画像全体を INTER_AREA で縮小すると遅いため、先に間引いて目標の2倍程度にしておく
+    step = long_side // (size * 2)
+    if step > 1:
+        image = image[::step, ::step]
+        height, width = image.shape[:2]
+        long_side = max(height, width)
+    scale = size / long_side
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+class ThumbnailCache:
+    """
+    写真のサムネイル（JPEG）を保存するディスクキャッシュ
+    キーはファイル内容のハッシュ値（BLAKE2b）とサムネイルの大きさ。写真のパスからは索引で引く
+    （複数のプロセス・スレッドから同時に書き込んでよい）
+    """
+
+    def __init__(self, root: Path, size: int = THUMBNAIL_SIZE, quality: int = THUMBNAIL_QUALITY,
+                 limit_mb: int = THUMBNAIL_LIMIT_MB, commit_interval: int = 200):
+        self.root = Path(root)
+        self.size = size
+        self.quality = quality
+        # 合計サイズの上限（MB、0 = 上限なし）
+        self.limit_mb = limit_mb
+        # 索引はこの件数ごとにまとめてコミット（1件ずつ書き込まない。0 = flush() を呼ぶまでコミットしない）
+        self.commit_interval = commit_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        # まだ索引に書き込んでいない対応（パス -> (サイズ, 更新日時, キー)）
+        self._pending: Dict[str, Tuple[int, int, str]] = {}
+
+    @property
+    def index(self) -> sqlite3.Connection:
+        """パス -> キーの索引（最初に使うときに開く。並列評価ではワーカーごとに開く）"""
+        if self._conn is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.root / INDEX_FILE_NAME), timeout=30, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    key TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS files_key ON files (key);
+            ''')
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        """保留中の索引を書き込んで閉じる"""
+        with self._lock:
+            self._flush_locked()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def flush(self):
+        """保留中の索引をまとめて書き込む"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        self.index.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns, key) VALUES (?, ?, ?, ?)',
+                               [(path, *entry) for path, entry in self._pending.items()])
+        self.index.commit()
+        self._pending.clear()
+
+    def take_pending(self) -> List[Tuple[str, int, int, str]]:
+        """
+        保留中の索引を取り出す（書き込まずに渡す。並列評価のワーカーからメインプロセスへ送るときに使う）
+        Returns: [(パス, サイズ, 更新日時, キー), ...]
+        """
+        with self._lock:
+            rows = [(path, *entry) for path, entry in self._pending.items()]
+            self._pending.clear()
+        return rows
+
+    def add_pending(self, rows: Iterable[Tuple[str, int, int, str]]):
+        """ほかのプロセスで作った索引を保留中の書き込みに加える（take_pending() の結果を渡す）"""
+        with self._lock:
+            for path, size, mtime_ns, key in rows:
+                self._pending[path] = (size, mtime_ns, key)
+            self._maybe_flush_locked()
+
+    def _maybe_flush_locked(self):
+        if self.commit_interval and len(self._pending) >= self.commit_interval:
+            self._flush_locked()
+
+    @property
+    def key_suffix(self) -> str:
+        """キーの末尾（サムネイルの大きさと作り方のバージョン）"""
+        return f'_{self.size}_v{THUMBNAIL_VERSION}'
+
+    def key(self, data: bytes) -> str:
+        """ファイル内容に対応するキー（内容のハッシュ値・サムネイルの大きさ・作り方のバージョン）"""
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        return digest + self.key_suffix
+
+    def path_for(self, key: str) -> Path:
+        """キーに対応するファイル（1つのフォルダにファイルが集中しないよう、先頭2文字で分ける）"""
+        return self.root / key[:2] / f'{key}.jpg'
+
+    @staticmethod
+    def _signature(file_path: Path) -> Optional[Tuple[str, int, int]]:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+    def _record(self, file_path: Path, key: str):
+        """写真のパスとキーの対応を索引に記録（commit_interval件ごとにまとめて書き込む）"""
+        signature = self._signature(file_path)
+        if signature is None:
+            return
+        path, size, mtime_ns = signature
+        with self._lock:
+            self._pending[path] = (size, mtime_ns, key)
+            self._maybe_flush_locked()
+
+    def _touch(self, path: Path) -> bool:
+        """使われたサムネイルの更新日時を今にする（削除の順番に使う）。なければ False"""
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def lookup(self, file_path: Path, read_content: bool = True) -> Optional[Path]:
+        """
+        写真のサムネイルを検索（元の写真はデコードしない）
+        索引にない場合（別の名前・別のフォルダに移動した写真など）は、read_content が True なら
+        ファイル内容のハッシュ値から探す
+        Returns: サムネイルのファイル（なければ None）
+        """
+        file_path = Path(file_path)
+        signature = self._signature(file_path)
+        if signature is None:
+            return None
+        with self._lock:
+            row = self._pending.get(signature[0])
+            if row is None:
+                row = self.index.execute('SELECT size, mtime_ns, key FROM files WHERE path = ?',
+                                         (signature[0],)).fetchone()
+        # 大きさや作り方の違うサムネイルを指している場合は使わない
+        if row is not None and tuple(row[:2]) == signature[1:] and row[2].endswith(self.key_suffix):
+            path = self.path_for(row[2])
+            if self._touch(path):
+                return path
+        if not read_content:
+            return None
+
+        try:
+            key = self.key(read_file(file_path))
+        except OSError:
+            return None
+        path = self.path_for(key)
+        if not self._touch(path):
+            return None
+        self._record(file_path, key)
+        return path
+
+    def put(self, key: str, image: np.ndarray) -> Optional[Path]:
+        """画像を縮小してサムネイルとして保存（書き終えてから置き換えるため、途中で止まっても壊れない）"""
+        ok, encoded = cv2.imencode('.jpg', make_thumbnail(image, self.size),
+                                   [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return None
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp_', suffix='.jpg')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded.tobytes())
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return None
+        return path
+
+    def store(self, file_path: Path, data: bytes, image: np.ndarray) -> Optional[Path]:
+        """
+        デコード済みの画像からサムネイルを作って保存（評価のついでに呼ぶ）
+        data: 写真のファイル内容（キーの計算に使う）、image: デコード済みの画像（BGRまたはグレースケール）
+        同じ内容のサムネイルがすでにあれば作り直さない
+        評価用に縮小・グレースケール化された画像（--analysis-size・--coarse-size・--memory-limit）は
+        サムネイルには使わず、元の写真をデコードし直す
+        """
+        key = self.key(data)
+        path = self.path_for(key)
+        if not self._touch(path):
+            if image is None or image.ndim != 3 or max(image.shape[:2]) < self.size:
+                image = self.decode_original(Path(file_path), data)
+                if image is None:
+                    return None
+            path = self.put(key, image)
+            if path is None:
+                return None
+        self._record(file_path, key)
+        return path
+
+    def decode_original(self, file_path: Path, data: bytes) -> Optional[np.ndarray]:
+        """
+        元の写真をサムネイルに必要な大きさでデコード（BGR）
+        RAWは埋め込みプレビュー、JPEGはDCTスケーリングで縮小したままデコードする
+        """
+        is_raw = file_path.suffix.lower() in RAW_EXTENSIONS
+        source = data
+        if is_raw:
+            preview = largest_preview(data)
+            if preview is not None:
+                source = preview.data
+
+        image = None
+        if not (is_raw and source is data):
+            # 長辺がサムネイルの大きさを下回らない範囲で、できるだけ小さくデコードする
+            size = image_size(source)
+            reduction = 1
+            if size:
+                for candidate in (8, 4, 2):
+                    if max(size) // candidate >= self.size:
+                        reduction = candidate
+                        break
+            flags = {
+                1: cv2.IMREAD_COLOR,
+                2: cv2.IMREAD_REDUCED_COLOR_2,
+                4: cv2.IMREAD_REDUCED_COLOR_4,
+                8: cv2.IMREAD_REDUCED_COLOR_8,
+            }
+            image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flags[reduction])
+        if image is None:
+            # OpenCVで読めない形式（HEIC・プレビューのないRAW）
+            image = decode_full(data, is_raw)
+        return image
+
+    def ensure(self, file_path: Path) -> Optional[Path]:
+        """サムネイルを取得（評価の時に作られていなければ元の写真から作る。読めない写真は None）"""
+        file_path = Path(file_path)
+        path = self.lookup(file_path, read_content=False)
+        if path is not None:
+            return path
+        try:
+            data = read_file(file_path)
+        except OSError:
+            return None
+        key = self.key(data)
+        path = self.path_for(key)
+        if not self._touch(path):
+            image = self.decode_original(file_path, data)
+            if image is None:
+                return None
+            path = self.put(key, image)
+            if path is None:
+                return None
+        self._record(file_path, key)
+        return path
+
+    def evict(self, limit_mb: Optional[int] = None) -> int:
+        """
+        合計サイズが上限を超えていれば、最近使われていない（更新日時の古い）サムネイルから削除
+        （上限の9割まで減らし、毎回少しずつ削除し続けないようにする）
+        Returns: 削除したサムネイルの数
+        """
+        if limit_mb is None:
+            limit_mb = self.limit_mb
+        if not limit_mb or not self.root.is_dir():
+            return 0
+
+        entries = []
+        total = 0
+        for directory in os.scandir(self.root):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if not entry.name.endswith('.jpg'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.startswith('.tmp_'):
+                    # 書き込み途中で止まったファイル（1時間以上前のものだけ消す）
+                    if stat.st_mtime < time.time() - 3600:
+                        os.unlink(entry.path)
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+
+        limit = limit_mb * 1024 * 1024
+        if total <= limit:
+            return 0
+        entries.sort()
+        removed = []
+        for _, size, path in entries:
+            if total <= limit * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed.append(Path(path).stem)
+
+        # 削除したサムネイルを指している索引も消す
+        with self._lock:
+            self._flush_locked()
+            self.index.executemany('DELETE FROM files WHERE key = ?', ((key,) for key in removed))
+            self.index.commit()
+        return len(removed)
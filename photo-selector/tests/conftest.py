@@ -0,0 +1,6 @@
+"""テスト共通の設定（src のモジュールを import できるようにする）"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
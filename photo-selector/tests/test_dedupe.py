@@ -0,0 +1,173 @@
+"""dedupe（連写・ほぼ同じ写真のグループ化）のテスト。windowモードとglobalモードの違いを確認する"""
+
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from dedupe import BKTree, DuplicateGrouper, dhash, hamming_distance
+
+CATEGORIES = ['1_最高', '2_とても良い', '3_良い', '4_普通', '5_やや悪い', '6_悪い', '7_非常に悪い']
+BASE = datetime(2024, 1, 1, 12, 0, 0)
+HASH_A = 0x0123456789ABCDEF
+HASH_B = ~HASH_A & (2 ** 64 - 1)   # HASH_A とすべてのビットが異なる
+
+
+def photo(name, seconds, value, score=80.0, category='1_最高'):
+    return {
+        'filename': name,
+        'photo_datetime': BASE + timedelta(seconds=seconds),
+        'total_score': score,
+        'category': category,
+        'features': {'dhash': value},
+    }
+
+
+def run(grouper, photos):
+    """追加した順に確定した結果を集め、最後に残りを確定する"""
+    finished = []
+    for result in photos:
+        finished.extend(grouper.add(result))
+    finished.extend(grouper.finish())
+    return finished
+
+
+def groups(results):
+    """グループ番号ごとのファイル名の集合（グループにならなかった写真は含めない）"""
+    found = {}
+    for result in results:
+        if 'dup_group' in result:
+            found.setdefault(result['dup_group'], set()).add(result['filename'])
+    return sorted(found.values(), key=sorted)
+
+
+def same_hashes_far_apart():
+    """同じ写真を1時間あけて2回ずつ撮ったもの（間に別の写真がある）"""
+    return [
+        photo('a1', 0, HASH_A, score=70.0),
+        photo('a2', 2, HASH_A ^ 0b1, score=90.0),
+        photo('b1', 600, HASH_B),
+        photo('a3', 3600, HASH_A ^ 0b11, score=60.0),
+        photo('a4', 3601, HASH_A, score=65.0),
+    ]
+
+
+def test_window_groups_only_nearby_shots():
+    results = run(DuplicateGrouper(CATEGORIES, mode='window', window_seconds=10), same_hashes_far_apart())
+    assert len(results) == 5
+    assert groups(results) == [{'a1', 'a2'}, {'a3', 'a4'}]
+
+
+def test_global_groups_regardless_of_time():
+    results = run(DuplicateGrouper(CATEGORIES, mode='global'), same_hashes_far_apart())
+    assert len(results) == 5
+    assert groups(results) == [{'a1', 'a2', 'a3', 'a4'}]
+
+
+def test_global_returns_nothing_until_finish():
+    grouper = DuplicateGrouper(CATEGORIES, mode='global')
+    assert all(grouper.add(result) == [] for result in same_hashes_far_apart())
+    assert len(grouper.finish()) == 5
+
+
+def test_window_releases_groups_once_out_of_window():
+    """時間枠から外れたグループは、次の写真を追加した時点で確定して返る"""
+    grouper = DuplicateGrouper(CATEGORIES, mode='window', window_seconds=10)
+    assert grouper.add(photo('a1', 0, HASH_A)) == []
+    assert grouper.add(photo('a2', 5, HASH_A)) == []
+    released = grouper.add(photo('b1', 100, HASH_B))
+    assert {result['filename'] for result in released} == {'a1', 'a2'}
+    assert [result['filename'] for result in grouper.finish()] == ['b1']
+
+
+def test_window_max_size_evicts_oldest():
+    """同じ時刻の写真が max_window 枚を超えたら、古い写真から確定して返す（ウィンドウを無制限に溜めない）"""
+    grouper = DuplicateGrouper(CATEGORIES, mode='window', window_seconds=10, max_window=4)
+    released = []
+    for index in range(10):
+        released.extend(grouper.add(photo(f'p{index}', 0, HASH_A if index % 2 else HASH_B)))
+        assert len(grouper.window) <= 4
+    released.extend(grouper.finish())
+    assert sorted(result['filename'] for result in released) == sorted(f'p{index}' for index in range(10))
+
+
+def test_best_shot_kept_and_others_demoted():
+    results = run(DuplicateGrouper(CATEGORIES, mode='window'), [
+        photo('a1', 0, HASH_A, score=70.0, category='2_とても良い'),
+        photo('a2', 1, HASH_A, score=90.0, category='1_最高'),
+        photo('a3', 2, HASH_A, score=40.0, category='5_やや悪い'),
+    ])
+    by_name = {result['filename']: result for result in results}
+    assert by_name['a2']['dup_best'] and by_name['a2']['category'] == '1_最高'
+    assert not by_name['a1']['dup_best'] and by_name['a1']['category'] == '4_普通'
+    # もともと DEMOTE_TO より下の分類はそのまま
+    assert by_name['a3']['category'] == '5_やや悪い'
+
+
+def test_photos_without_hash_are_passed_through():
+    grouper = DuplicateGrouper(CATEGORIES, mode='window')
+    result = {'filename': 'broken.jpg', 'total_score': 0, 'category': '7_非常に悪い', 'features': None}
+    assert grouper.add(result) == [result]
+    assert 'dup_group' not in result
+
+
+def test_group_ids_continue_from_first_group_id():
+    results = run(DuplicateGrouper(CATEGORIES, mode='window', first_group_id=41), same_hashes_far_apart())
+    assert sorted({result['dup_group'] for result in results if 'dup_group' in result}) == [41, 42]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        DuplicateGrouper(CATEGORIES, mode='everything')
+
+
+def test_bk_tree_matches_linear_search():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    values += [value ^ (1 << rng.randrange(64)) for value in values[:50]]
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    for query in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        expected = {index for index, value in enumerate(values) if hamming_distance(query, value) <= 6}
+        assert set(tree.search(query, 6)) == expected
+
+
+def test_dhash_is_stable_under_small_changes():
+    gray = np.tile(np.arange(64, dtype=np.uint8) * 4, (48, 1))
+    brighter = np.clip(gray.astype(np.int16) + 10, 0, 255).astype(np.uint8)
+    assert hamming_distance(dhash(gray), dhash(brighter)) <= 6
+    assert hamming_distance(dhash(gray), dhash(gray[:, ::-1].copy())) > 6
+
+
+class _Selector:
+    """sort_by_capture_time に必要な部分だけを持つ PhotoSelector の代わり"""
+
+    def __init__(self, datetimes):
+        self.datetimes = datetimes
+
+    def get_cached_features(self, file_path):
+        return None
+
+    def get_photo_datetime(self, file_path):
+        return self.datetimes[file_path]
+
+
+def test_sort_by_capture_time_within_window():
+    """先読みの枚数の範囲で前後している写真は、撮影日時の順に並べ替えて返す"""
+    from photo_selector import PhotoSelector
+    rng = random.Random(1)
+    order = list(range(100))
+    # 走査の順は撮影日時の順から、最大3枚ずれている
+    for start in range(0, 100, 4):
+        block = order[start:start + 4]
+        rng.shuffle(block)
+        order[start:start + 4] = block
+    files = [f'IMG_{index:04d}.jpg' for index in order]
+    selector = _Selector({f'IMG_{index:04d}.jpg': BASE + timedelta(seconds=index) for index in range(100)})
+    assert list(PhotoSelector.sort_by_capture_time(selector, files, window=4)) == \
+        [f'IMG_{index:04d}.jpg' for index in range(100)]
+    # 先読みの枚数より大きくずれた写真は並べ替えきれないが、すべて1回ずつ返す
+    reversed_files = files[::-1]
+    assert sorted(PhotoSelector.sort_by_capture_time(selector, reversed_files, window=4)) == sorted(files)
@@ -0,0 +1,106 @@
+"""ingest（撮影日時の読み取り）のテスト。壊れた・変わったEXIFでも例外を出さないこと"""
+
+import struct
+from datetime import datetime
+
+import pytest
+
+from ingest import TAG_DATETIME, TAG_DATETIME_ORIGINAL, TAG_EXIF_IFD, exif_datetime, is_tiff
+
+DATETIME = b'2024:05:06 07:08:09\x00'
+
+
+def tiff_bytes(endian='<', datetime_original=DATETIME, datetime_ifd0=None, exif_pointer=None):
+    """IFD0（DateTime・Exif IFDへのポインタ）とExif IFD（DateTimeOriginal）を持つTIFFを作る"""
+    mark = b'II' if endian == '<' else b'MM'
+    header = mark + struct.pack(endian + 'HI', 42, 8)
+    ifd0_entries = []
+    ifd0_size = 2 + 12 * (1 + (datetime_ifd0 is not None)) + 4
+    exif_offset = 8 + ifd0_size
+    exif_size = 2 + 12 + 4
+    data_offset = exif_offset + exif_size
+    payload = b''
+
+    if datetime_ifd0 is not None:
+        ifd0_entries.append(struct.pack(endian + 'HHII', TAG_DATETIME, 2, len(datetime_ifd0),
+                                        data_offset + len(payload)))
+        payload += datetime_ifd0
+    ifd0_entries.append(struct.pack(endian + 'HHII', TAG_EXIF_IFD, 4, 1,
+                                    exif_offset if exif_pointer is None else exif_pointer))
+    ifd0 = struct.pack(endian + 'H', len(ifd0_entries)) + b''.join(ifd0_entries) + b'\x00' * 4
+
+    exif = (struct.pack(endian + 'H', 1)
+            + struct.pack(endian + 'HHII', TAG_DATETIME_ORIGINAL, 2, len(datetime_original),
+                          data_offset + len(payload))
+            + b'\x00' * 4)
+    payload += datetime_original
+    return header + ifd0 + exif + payload
+
+
+def jpeg_with_exif(tiff):
+    """APP1（EXIF）だけを持つJPEGのヘッダー部分を作る"""
+    body = b'Exif\x00\x00' + tiff
+    return b'\xff\xd8\xff\xe1' + struct.pack('>H', len(body) + 2) + body + b'\xff\xda\x00\x02'
+
+
+def png_with_exif(tiff):
+    """eXIfチャンクを持つPNGのヘッダー部分を作る"""
+    return (b'\x89PNG\r\n\x1a\n'
+            + struct.pack('>I4s', len(tiff), b'eXIf') + tiff + b'\x00' * 4
+            + struct.pack('>I4s', 0, b'IEND') + b'\x00' * 4)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_reads_datetime_original(endian):
+    tiff = tiff_bytes(endian)
+    expected = datetime(2024, 5, 6, 7, 8, 9)
+    assert is_tiff(tiff)
+    assert exif_datetime(tiff) == expected
+    assert exif_datetime(jpeg_with_exif(tiff)) == expected
+    assert exif_datetime(png_with_exif(tiff)) == expected
+
+
+def test_falls_back_to_ifd0_datetime():
+    tiff = tiff_bytes(datetime_original=b'0000:00:00 00:00:00\x00', datetime_ifd0=b'2020:01:02 03:04:05\x00')
+    assert exif_datetime(jpeg_with_exif(tiff)) == datetime(2020, 1, 2, 3, 4, 5)
+
+
+def test_truncated_at_every_length_does_not_raise():
+    """ヘッダーの途中で切れたファイル（書き込み途中・壊れたファイル）"""
+    for data in (tiff_bytes(), jpeg_with_exif(tiff_bytes()), png_with_exif(tiff_bytes())):
+        for end in range(len(data)):
+            assert exif_datetime(data[:end]) in (None, datetime(2024, 5, 6, 7, 8, 9))
+
+
+@pytest.mark.parametrize('pointer', [0, 3, 0xFFFF, 0xFFFFFFFF])
+def test_bad_exif_ifd_pointer(pointer):
+    assert exif_datetime(jpeg_with_exif(tiff_bytes(exif_pointer=pointer))) is None
+
+
+def test_self_referencing_exif_ifd_pointer():
+    """Exif IFDへのポインタがIFD0自身を指している"""
+    assert exif_datetime(tiff_bytes(exif_pointer=8)) is None
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'\xff\xd8',
+    b'\xff\xd8\xff\xe1\x00',
+    b'\xff\xd8\xff\xe1\x00\x00Exif\x00\x00',           # 長さ0のAPP1（同じ位置を読み続けないこと）
+    b'\xff\xd8\xff\xe1\xff\xffExif\x00\x00II*\x00',     # 長さがファイルより長いAPP1
+    b'\xff\xd8\xff\xe1\x00\x10Exif\x00\x00XX*\x00\x08\x00\x00\x00',  # バイト順の印が不正
+    b'\xff\xd8\x00\x00\x00\x00',                       # マーカーでないバイト
+    b'\xff\xd8' + b'\xff' * 64,                         # 埋め草だけ
+    b'\x89PNG\r\n\x1a\n\x00\x00',
+    b'\x89PNG\r\n\x1a\n\xff\xff\xff\xffeXIf',          # 長さがファイルより長いeXIf
+    b'II*\x00\xff\xff\xff\xff',
+    b'MM\x00*\x00\x00\x00\x08\xff\xff',                # エントリ数がファイルより大きい
+    b'not an image at all',
+])
+def test_malformed_headers_return_none(data):
+    assert exif_datetime(data) is None
+
+
+def test_invalid_datetime_strings():
+    for value in (b'\xff\xfe\xfd', b'2024-05-06 07:08:09\x00', b'\x00', b'    :  :     :  :  \x00'):
+        assert exif_datetime(tiff_bytes(datetime_original=value)) is None
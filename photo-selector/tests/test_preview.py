@@ -0,0 +1,141 @@
+"""preview（埋め込みプレビューの取り出し）のテスト。壊れた・変わったTIFF/MPFでも例外を出さないこと"""
+
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from preview import (TAG_COMPRESSION, TAG_IMAGE_LENGTH, TAG_IMAGE_WIDTH, TAG_JPEG_LENGTH, TAG_JPEG_OFFSET,
+                     TAG_MP_ENTRY, TAG_STRIP_BYTE_COUNTS, TAG_STRIP_OFFSETS, TAG_SUB_IFDS,
+                     embedded_previews, largest_preview, source_size)
+
+IFD0_OFFSET = 8
+
+
+def make_jpeg(width, height):
+    ok, encoded = cv2.imencode('.jpg', np.full((height, width, 3), 128, dtype=np.uint8))
+    assert ok
+    return encoded.tobytes()
+
+
+THUMB = make_jpeg(160, 120)
+PREVIEW = make_jpeg(640, 480)
+
+
+def ifd(entries, next_offset=0):
+    """IFDを作る（entries: (タグ, 型, 個数, 値またはオフセット) のリスト。リトルエンディアン）"""
+    return (struct.pack('<H', len(entries))
+            + b''.join(struct.pack('<HHII', *entry) for entry in entries)
+            + struct.pack('<I', next_offset))
+
+
+def ifd_size(count):
+    return 2 + 12 * count + 4
+
+
+def make_raw(sub_ifd_pointer=None, ifd1_next=0):
+    """
+    RAW（TIFF）風のファイルを作る
+    IFD0: センサーの画素数とSubIFDへのポインタ → SubIFD: JPEG圧縮の1ストリップ画像（大きいプレビュー）
+    IFD0の次（IFD1）: JPEGInterchangeFormatのサムネイル
+    """
+    sub_offset = IFD0_OFFSET + ifd_size(3)
+    ifd1_offset = sub_offset + ifd_size(3)
+    thumb_offset = ifd1_offset + ifd_size(2)
+    preview_offset = thumb_offset + len(THUMB)
+
+    ifd0 = ifd([(TAG_IMAGE_WIDTH, 4, 1, 6000), (TAG_IMAGE_LENGTH, 4, 1, 4000),
+                (TAG_SUB_IFDS, 4, 1, sub_offset if sub_ifd_pointer is None else sub_ifd_pointer)],
+               next_offset=ifd1_offset)
+    sub = ifd([(TAG_COMPRESSION, 3, 1, 7), (TAG_STRIP_OFFSETS, 4, 1, preview_offset),
+               (TAG_STRIP_BYTE_COUNTS, 4, 1, len(PREVIEW))])
+    ifd1 = ifd([(TAG_JPEG_OFFSET, 4, 1, thumb_offset), (TAG_JPEG_LENGTH, 4, 1, len(THUMB))],
+               next_offset=ifd1_next)
+    return b'II*\x00' + struct.pack('<I', IFD0_OFFSET) + ifd0 + sub + ifd1 + THUMB + PREVIEW
+
+
+def make_mpf_jpeg(entry_offset=None, entry_count=2, image_offset=None):
+    """主画像の後ろに大きいプレビューを持つMPF（APP2）付きのJPEGを作る"""
+    main = make_jpeg(32, 24)
+    # MPFのTIFF: ヘッダー(8) + IFD(1エントリ) + MPエントリ（16バイト × 2）
+    mp_entries_offset = 8 + ifd_size(1)
+    segment_size = 2 + 4 + mp_entries_offset + 16 * 2
+    # 主画像のSOIの後ろにAPP2を差し込む。MPFの位置はAPP2内のTIFFヘッダーからの相対位置
+    tiff_start = 2 + 4 + 4
+    file_size = len(main) + 2 + segment_size
+    preview_offset = file_size - tiff_start
+    tiff = (b'II*\x00' + struct.pack('<I', 8)
+            + ifd([(TAG_MP_ENTRY, 7, 16 * entry_count,
+                    mp_entries_offset if entry_offset is None else entry_offset)])
+            + struct.pack('<III', 0x030000, len(main), 0) + b'\x00' * 4
+            + struct.pack('<III', 0x010002, len(PREVIEW),
+                          preview_offset if image_offset is None else image_offset) + b'\x00' * 4)
+    app2 = b'\xff\xe2' + struct.pack('>H', segment_size) + b'MPF\x00' + tiff
+    return main[:2] + app2 + main[2:] + PREVIEW
+
+
+def test_raw_previews_largest_first():
+    data = make_raw()
+    previews = embedded_previews(data)
+    assert [(p.width, p.height) for p in previews] == [(640, 480), (160, 120)]
+    assert largest_preview(data).data == PREVIEW
+    assert largest_preview(data, min_long_side=1000) is None
+    assert source_size(data) == (6000, 4000)
+
+
+def test_mpf_preview_after_main_image():
+    data = make_mpf_jpeg()
+    assert largest_preview(data).data == PREVIEW
+    assert source_size(data) == (32, 24)
+
+
+@pytest.mark.parametrize('data', [make_raw(), make_mpf_jpeg()])
+def test_truncated_at_every_length_does_not_raise(data):
+    """途中で切れたファイル。切れた位置より後ろのプレビューは返さない"""
+    for end in range(len(data)):
+        truncated = data[:end]
+        for preview in embedded_previews(truncated):
+            assert truncated.find(preview.data) >= 0
+        source_size(truncated)
+
+
+def test_self_referencing_ifds_terminate():
+    """SubIFD・次のIFDへのポインタがIFD0自身を指していても無限に辿らない"""
+    data = make_raw(sub_ifd_pointer=IFD0_OFFSET, ifd1_next=IFD0_OFFSET)
+    assert [(p.width, p.height) for p in embedded_previews(data)] == [(160, 120)]
+
+
+@pytest.mark.parametrize('pointer', [1, 0xFFFF, 0xFFFFFFF0])
+def test_bad_sub_ifd_pointer(pointer):
+    assert [(p.width, p.height) for p in embedded_previews(make_raw(sub_ifd_pointer=pointer))] == [(160, 120)]
+
+
+@pytest.mark.parametrize('kwargs, found', [
+    ({'entry_offset': 0xFFFFFFF0}, False),
+    ({'entry_offset': 3}, False),
+    ({'entry_count': 0x0FFFFFFF}, True),   # 個数が大きすぎても、読める範囲のエントリは使う
+    ({'image_offset': 0xFFFFFFF0}, False),
+    ({'image_offset': 1}, False),
+])
+def test_bad_mpf_entries(kwargs, found):
+    data = make_mpf_jpeg(**kwargs)
+    assert [p.data for p in embedded_previews(data)] == ([PREVIEW] if found else [])
+    assert source_size(data) == (32, 24)
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'II*\x00',
+    b'II*\x00\xff\xff\xff\xff',
+    b'MM\x00*\x00\x00\x00\x08\xff\xff',                      # エントリ数がファイルより大きい
+    b'II*\x00\x08\x00\x00\x00\x01\x00\x4a\x01\x04\x00\xff\xff\xff\xff\x00\x00\x00\x00',  # SubIFDの個数が不正
+    b'\xff\xd8\xff\xe1\x00\x00Exif\x00\x00',
+    b'\xff\xd8\xff\xe1\xff\xffExif\x00\x00II*\x00\x08\x00\x00\x00',
+    b'\xff\xd8\xff\xe2\x00\x0eMPF\x00II*\x00\x08\x00',
+    b'\xff\xd8' + b'\xff' * 64,
+    b'not an image at all',
+])
+def test_malformed_headers_return_nothing(data):
+    assert embedded_previews(data) == []
+    assert largest_preview(data) is None
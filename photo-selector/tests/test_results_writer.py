@@ -0,0 +1,88 @@
+"""results_writer（NDJSONの逐次保存と外部ソートによる results.csv の作成）のテスト"""
+
+import csv
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from results_writer import FIELD_MAPPING, ResultsWriter
+
+BASE = datetime(2024, 1, 1, 12, 0, 0)
+HEADERS = list(FIELD_MAPPING.values())
+
+
+def result(index, seconds, score=50.0):
+    return {
+        'filename': f'IMG_{index:04d}.jpg',
+        'file_path': f'/photos/IMG_{index:04d}.jpg',
+        'photo_datetime': BASE + timedelta(seconds=seconds) if seconds is not None else None,
+        'category': '4_普通',
+        'total_score': score,
+        'has_face': False,
+    }
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == HEADERS
+    return [dict(zip(HEADERS, row)) for row in rows[1:]]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1000])
+def test_sorted_by_datetime_across_spill_files(tmp_path, chunk_size):
+    """chunk_size が小さく、複数のチャンクファイルに分けてマージしても撮影日時順になる"""
+    seconds = list(range(50))
+    random.Random(chunk_size).shuffle(seconds)
+    writer = ResultsWriter(tmp_path, chunk_size=chunk_size)
+    for index, second in enumerate(seconds):
+        writer.write(result(index, second))
+    writer.write(result(99, None))
+
+    assert writer.write_csv(tmp_path / 'results.csv') == 51
+    rows = read_csv(tmp_path / 'results.csv')
+    # 撮影日時のない写真は先頭
+    assert rows[0]['撮影日時'] == '' and rows[0]['ファイル名'] == 'IMG_0099.jpg'
+    datetimes = [row['撮影日時'] for row in rows[1:]]
+    assert datetimes == sorted(datetimes)
+    assert datetimes[0] == '2024-01-01 12:00:00' and datetimes[-1] == '2024-01-01 12:00:49'
+    assert not writer.spool_path.exists()
+    assert not list(tmp_path.glob('.sort_*'))
+
+
+def test_same_datetime_keeps_write_order(tmp_path):
+    """同じ撮影日時の写真はチャンクをまたいでも書き込んだ順のまま"""
+    writer = ResultsWriter(tmp_path, chunk_size=2)
+    for index in range(9):
+        writer.write(result(index, index % 3))
+    writer.write_csv(tmp_path / 'results.csv')
+    names = [row['ファイル名'] for row in read_csv(tmp_path / 'results.csv')]
+    assert names == [f'IMG_{index:04d}.jpg' for index in (0, 3, 6, 1, 4, 7, 2, 5, 8)]
+
+
+def test_rewritten_photo_uses_latest_result(tmp_path):
+    """中断後の再評価で同じ写真が2回記録されていても、後の結果を1行だけ出力する"""
+    writer = ResultsWriter(tmp_path, chunk_size=2)
+    for index in range(5):
+        writer.write(result(index, index, score=10.0))
+    writer.write(result(2, 2, score=90.0))
+    assert writer.write_csv(tmp_path / 'results.csv') == 5
+    rows = read_csv(tmp_path / 'results.csv')
+    assert [row['総合スコア'] for row in rows] == ['10.0', '10.0', '90.0', '10.0', '10.0']
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    """書き込み途中で止まった最後の行は読み飛ばす"""
+    writer = ResultsWriter(tmp_path, chunk_size=2)
+    for index in range(4):
+        writer.write(result(index, index))
+    writer.close()
+    with open(writer.spool_path, 'a', encoding='utf-8') as f:
+        f.write('{"filename": "IMG_')
+    assert ResultsWriter(tmp_path, chunk_size=2).write_csv(tmp_path / 'results.csv') == 4
+
+
+def test_no_results(tmp_path):
+    assert ResultsWriter(tmp_path).write_csv(tmp_path / 'results.csv') == 0
+    assert not (tmp_path / 'results.csv').exists()